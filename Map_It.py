@@ -1,26 +1,27 @@
 import os
+import time
 import warnings
 import streamlit as st
-import pandas as pd
-import numpy as np
-from datetime import datetime, timedelta
-import re
+from datetime import datetime
 from io import BytesIO
-import base64
-import unicodedata
-import openpyxl
-import xlrd
 
-warnings.filterwarnings("ignore", category=UserWarning, module="streamlit.runtime.scriptrunner.script_runner")
+import sqlite3
 
-# Set page config for title and favicon
-st.set_page_config(
-    page_title="Map It",
-    layout="centered"
+from map_it_archive import ArchiveUnavailable, PostingArchive, batch_id
+from map_it_core import (
+    MAPPINGS, GroupStore, LRUCache, MappingError, convert_file, convert_sources, converted_filename, creditease_frame,
+    csv_bytes, errors_filename, format_money, reconciliation_csv, reconciliation_filename, record_posted_groups,
+    report_filename, report_json, rule_counts, source_label, validation_errors
 )
+from map_it_jobs import ConversionJob, job_executor
+
+# Seconds between two looks at a running conversion
+POLL_SECONDS = float(os.environ.get('MAP_IT_POLL_SECONDS', 0.5))
+
+warnings.filterwarnings("ignore", category=UserWarning, module="streamlit.runtime.scriptrunner.script_runner")
 
 # Custom CSS for purple and gold theme with orchid watermark
-st.markdown("""
+PAGE_CSS = """
 <style>
 :root {
     --primary: #63328a;
@@ -65,7 +66,7 @@ st.markdown("""
     letter-spacing: 0.5px;
 }
 
-.stButton>button {
+.stButton>button, .stDownloadButton>button {
     background: linear-gradient(135deg, var(--primary) 0%, var(--secondary) 100%);
     color: white;
     border-radius: 14px;
@@ -78,7 +79,7 @@ st.markdown("""
     width: 100%;
 }
 
-.stButton>button:hover {
+.stButton>button:hover, .stDownloadButton>button:hover {
     transform: translateY(-2px) scale(1.01);
     box-shadow: 0 6px 20px rgba(99,50,138,0.22);
 }
@@ -142,692 +143,267 @@ st.markdown("""
     margin: 0.5rem 0;
 }
 </style>
-""", unsafe_allow_html=True)
-
-# Mapping dictionary for descriptions
-DESCRIPTION_MAPPING = {
-    # Interest related
-    'interest': 'Monthly Interest',
-    'monthly interest': 'Monthly Interest',
-    'interest reversal': 'Interest Reversal',
-    'reversal interest': 'Interest Reversal',
-    'int reversal': 'Interest Reversal',
-    'reversal int': 'Interest Reversal',
-    'arrears interest': 'Arrear Interest',
-    'penalty interest': 'Penalty Interest',
-
-    # Direct deposits
-    'direct deposits': 'Direct Deposits',
-    'direct deposit': 'Direct Deposits',
-
-    # Refunds
-    'refund': 'Refund',
-    'refunds': 'Refund',
-
-    # Fees
-    'service fee': 'Service Fee',
-    'card fee': 'Card Fee',
-    'legal fee': 'Legal Fees',
-    'legal fees': 'Legal Fees',
-    'funeral fee': 'Funeral Fee',
-    'arrangement fee': 'Arrangement Fee',
-    'transfer fee': 'Transfer Fee',
-    'early settlement fee': 'Early Settlement Fee',
-
-    # Reversals
-    'receipt reversal': 'Receipts Reversals',
-    'reversal receipt': 'Receipts Reversals',
-    'cash drawer receipt reversal': 'Cash Drawer Receipt Reversal',
-    'reversal service fee': 'Reversal Service Fee',
-    'reversal card fee': 'Reversal Card Fee',
-    'reverse legal fees': 'Reverse Legal Fees',
-    'reverse funeral fee': 'Reverse Funeral Fee',
-    'reverse arrangement fee': 'Reversal Initiation Fee',
-    'reverse write off': 'Reverse Write Off',
-    'write off reversal': 'Reverse Write Off',
-    'writeoff reversal': 'Reverse Write Off',
-    'reverse write - off': 'Reverse Write Off',
-    'reverse writeoff': 'Reverse Write Off',
-    'reverse complete write off': 'Reverse Write Off',
-    'complete write off reversal': 'Reverse Write Off',
-    'reverse complete write - off': 'Reverse Write Off',
-    'reverse complete writeoff': 'Reverse Write Off',
-
-    # Status changes
-    'contract status - active': 'Contract Status - Active',
-    'status-active': 'Contract Status - Active',
-    'contract status - complete': 'Contract Status - Complete',
-    'status - complete': 'Contract Status - Complete',
-    'status complete': 'Contract Status - Complete',
-    'status-complete': 'Contract Status - Complete',
-    'status - settled': 'Status - Settled',
-    'status - legal': 'Status - Legal',
-    'change status to legal': 'Status - Legal',
-    'status - cancelled': 'Status - Cancelled',
-
-    # Other transactions
-    'receipts': 'Receipts',
-    'receipt': 'Receipts',
-    'cash disbursement': 'Cash Disbursement',
-    'cash receipt': 'Cash Receipt',
-    'bank deposit': 'Bank Deposit',
-    'bank withdrawal': 'Bank Withdrawal',
-    'instalment': 'Instalment',
-    'write off': 'Write Off',
-    'complete write off': 'Complete Write Off',
-    'small balance write off': 'Small Balance Credit W-Off'
-}
-
-def clean_cell_value(value):
-    """
-    Comprehensive cleaning function to handle invisible characters and formatting issues
-    """
-    if pd.isna(value):
-        return ""
-
-    # Convert to string and handle float values properly
-    if isinstance(value, float) and value.is_integer():
-        text = str(int(value))
-    else:
-        text = str(value)
-
-    # Remove BOM (Byte Order Mark) characters
-    text = text.replace('\ufeff', '')
-    text = text.replace('\ufffe', '')
-
-    # Normalize unicode characters (convert special spaces, etc.)
-    text = unicodedata.normalize('NFKD', text)
-
-    # Remove various types of invisible characters commonly found in Excel
-    invisible_chars = [
-        '\u00a0',  # Non-breaking space
-        '\u1680',  # Ogham space mark
-        '\u2000', '\u2001', '\u2002', '\u2003', '\u2004', '\u2005',  # En quad, Em quad, etc.
-        '\u2006', '\u2007', '\u2008', '\u2009', '\u200a',  # Six-per-em space, etc.
-        '\u200b', '\u200c', '\u200d', '\u200e', '\u200f',  # Zero-width spaces and marks
-        '\u2028', '\u2029',  # Line separator, paragraph separator
-        '\u202a', '\u202b', '\u202c', '\u202d', '\u202e',  # Bidirectional text control
-        '\u202f',  # Narrow no-break space
-        '\u205f',  # Medium mathematical space
-        '\u2060',  # Word joiner
-        '\u3000',  # Ideographic space
-        '\ufeff',  # Zero-width no-break space (BOM)
-        '\u180e',  # Mongolian vowel separator
-        '\u061c',  # Arabic letter mark
-        '\u2066', '\u2067', '\u2068', '\u2069',  # Directional isolates
-    ]
-
-    for char in invisible_chars:
-        text = text.replace(char, ' ')
-
-    # Remove control characters (except common ones like \n, \t, \r)
-    text = ''.join(char for char in text if unicodedata.category(char)[0] != 'C' or char in '\n\t\r')
-
-    # Handle Excel-specific formatting artifacts
-    text = text.replace('\r\n', ' ').replace('\r', ' ').replace('\n', ' ')
-
-    # Remove multiple consecutive spaces and normalize
-    text = re.sub(r'\s+', ' ', text)
-    text = text.strip()
-
-    # Handle empty strings that might contain only invisible characters
-    if not text or text.isspace():
-        return ""
-
-    return text
-
-
-def normalize_column_name(col_name):
-    """
-    Normalize column names for better matching
-    """
-    if pd.isna(col_name):
-        return ""
-
-    # Clean the column name first
-    clean_name = clean_cell_value(col_name)
+"""
 
-    # Convert to lowercase and remove extra characters
-    normalized = re.sub(r'[^\w\s]', ' ', clean_name.lower())
-    normalized = re.sub(r'\s+', ' ', normalized).strip()
 
-    return normalized
+def apply_page_style():
+    """Set the page config and inject the theme CSS"""
+    # Set page config for title and favicon
+    st.set_page_config(
+        page_title="Map It",
+        layout="centered"
+    )
+    st.markdown(PAGE_CSS, unsafe_allow_html=True)
 
 
-def enhanced_column_finder(df, possible_names):
+@st.cache_resource
+def get_workbook_cache():
     """
-    Enhanced column finder with comprehensive cleaning and matching
-    """
-    # First, clean all column names and create multiple matching variations
-    cleaned_columns = {}
-    for col in df.columns:
-        original_col = str(col)
-        # Split at pipe and take first part if pipe exists
-        base_col = original_col.split('|')[0].strip()
-        cleaned_col = normalize_column_name(base_col)
-
-        # Create multiple variations for better matching
-        variations = [
-            cleaned_col,
-            cleaned_col.replace(' ', ''),  # No spaces
-            cleaned_col.replace(' ', '_'),  # Underscores
-            re.sub(r'[^\w]', '', cleaned_col),  # Alphanumeric only
-        ]
-
-        for variation in variations:
-            if variation:  # Only add non-empty variations
-                cleaned_columns[variation] = original_col
-
-    # Try to match with possible names
-    for target_name in possible_names:
-        target_normalized = normalize_column_name(target_name)
-        target_variations = [
-            target_normalized,
-            target_normalized.replace(' ', ''),
-            target_normalized.replace(' ', '_'),
-            re.sub(r'[^\w]', '', target_normalized),
-        ]
-
-        # Try exact matches first
-        for target_var in target_variations:
-            if target_var in cleaned_columns:
-                return cleaned_columns[target_var]
-
-        # Try partial matches
-        for target_var in target_variations:
-            for cleaned_col, original_col in cleaned_columns.items():
-                if target_var and cleaned_col and (target_var in cleaned_col or cleaned_col in target_var):
-                    return original_col
-
-        # Try word-by-word matching for multi-word columns
-        target_words = [word for word in target_normalized.split() if len(word) > 2]
-        if target_words:
-            for cleaned_col, original_col in cleaned_columns.items():
-                col_words = cleaned_col.split()
-                if any(word in col_words for word in target_words):
-                    return original_col
-
-    return None
-
-
-def extract_amount(comment_part):
-    """Extract amount from a comment part that might contain an amount"""
-    if not isinstance(comment_part, str):
-        return 0.0
-
-    # First look for explicit currency format ($25.97 or $1,000.00)
-    currency_match = re.search(r'\$?\s*([\d,]+(?:\.\d{1,2})?)', comment_part)
-    if currency_match:
-        amount_str = currency_match.group(1).replace(',', '')
-        try:
-            return float(amount_str)
-        except ValueError:
-            pass
-
-    # Then look for general numbers that might be amounts (25.97 or 1,000.00)
-    number_match = re.search(r'([\d,]+(?:\.\d{1,2})?)', comment_part)
-    if number_match:
-        amount_str = number_match.group(1).replace(',', '')
-        try:
-            return float(amount_str)
-        except ValueError:
-            pass
-
-    return 0.0
-
-
-def clean_comment(comment_part):
-    """Remove amount information from comment part while preserving key phrases"""
-    # First remove dollar amounts
-    cleaned = re.sub(r'\$[\d,]+\.?\d*', '', comment_part)
-    # Then remove standalone numbers
-    cleaned = re.sub(r'(^|\s)\d[\d,]*\.?\d*\b', ' ', cleaned)
-    # Clean but preserve important hyphenated terms
-    cleaned = re.sub(r'[^\w\s-]', ' ', cleaned.lower())
-    cleaned = re.sub(r'\s+', ' ', cleaned).strip()
-    return cleaned
-
-def get_transaction_type(description):
-    """Get transaction type from description"""
-    if description == "Monthly Interest":
-        return "INT"
-    elif description == "Reverse Write Off":
-        return "REV_WOFF"
-    elif description == "Reverse Complete Write Off":
-        return "REV_COMP_WOFF"
-    elif description == "Interest Reversal":
-        return "INT_ADJ_CR"
-    elif description == "Receipts":
-        return "REC"
-    elif description == "Arrear Interest":
-        return "INT_ARR"
-    elif description == "Penalty Interest":
-        return "P_INT"
-    elif description == "Direct Deposits":
-        return "DIRECT_DEPOSIT"
-    elif description == "Refund":
-        return "REFUND"
-    elif description == "Service Fee":
-        return "SERV_FEE"
-    elif description == "Card Fee":
-        return "CARD_FEE"
-    elif description == "Legal Fees":
-        return "LEG_FEE"
-    elif description == "Funeral Fee":
-        return "FUN_FEE"
-    elif description == "Arrangement Fee":
-        return "INIT_FEE"
-    elif description == "Transfer Fee":
-        return "TRF_FEE"
-    elif description == "Early Settlement Fee":
-        return "SET_FEE"
-    elif description == "Receipts Reversals":
-        return "REV_REC"
-    elif description == "Cash Drawer Receipt Reversal":
-        return "R_CASH_REC"
-    elif description == "Reversal Service Fee":
-        return "R_SERV_FEE"
-    elif description == "Reversal Card Fee":
-        return "R_CARD_FEE"
-    elif description == "Reverse Legal Fees":
-        return "REV_LEG_FEE"
-    elif description == "Reverse Funeral Fee":
-        return "REV_FUN_FEE"
-    elif description == "Reversal Initiation Fee":
-        return "REV_INI_FEE"
-    elif description == "Contract Status - Active":
-        return "STAT_ACTIVE"
-    elif description == "Contract Status - Complete":
-        return "STAT_COMPLETE"
-    elif description == "Status - Settled":
-        return "STAT_SETT"
-    elif description == "Status - Legal":
-        return "STAT_LEGAL"
-    elif description == "Status - Cancelled":
-        return "STAT_CANCEL"
-    elif description == "Cash Disbursement":
-        return "CASH_DISB"
-    elif description == "Cash Receipt":
-        return "CASH_REC"
-    elif description == "Bank Deposit":
-        return "BANK_DEP"
-    elif description == "Bank Withdrawal":
-        return "BANK_WTHDRW"
-    elif description == "Instalment":
-        return "INS"
-    elif description == "Write Off":
-        return "WOFF"
-    elif description == "Complete Write Off":
-        return "COMP_WOFF"
-    elif description == "Small Balance Credit W-Off":
-        return "SB_C_WOFF"
-    return "GEN"
-
-
-def process_comment(comment):
-    """Process a comment string into individual transactions"""
-    if not isinstance(comment, str):
-        return []
-
-    # Clean the comment first
-    comment = clean_cell_value(comment)
-
-    # Normalize the comment - more aggressive cleaning
-    comment = re.sub(r'\s*,\s*', ', ', comment)  # Normalize commas
-    comment = re.sub(r'(\$)\s*(\d)', r'\1\2', comment)  # Fix $ spacing
-    comment = re.sub(r'[^\w\s\-,]', ' ', comment.lower())  # Remove special chars except hyphens
-    comment = re.sub(r'\s+', ' ', comment).strip()  # Normalize whitespace
-
-    transactions = []
-    parts = [part.strip() for part in re.split(r',(?![^()]*\))', comment)]
-
-    for part in parts:
-        if not part:
-            continue
-
-        # Extract amount first (before cleaning alters the string)
-        amount = extract_amount(part)
-
-        # Clean the part for matching
-        cleaned = clean_comment(part).lower()
-        cleaned = normalize_column_name(cleaned)
-
-        # Try exact matches first
-        matched = False
-        for key, value in DESCRIPTION_MAPPING.items():
-            if cleaned == normalize_column_name(key):
-                transactions.append({
-                    'description': value,
-                    'amount': amount
-                })
-                matched = True
-                break
-
-        # If no exact match, try partial matches
-        if not matched:
-            for key, value in DESCRIPTION_MAPPING.items():
-                norm_key = normalize_column_name(key)
-                if norm_key in cleaned or cleaned in norm_key:
-                    transactions.append({
-                        'description': value,
-                        'amount': amount
-                    })
-                    matched = True
-                    break
-
-        # If still no match, try word-by-word matching
-        if not matched:
-            key_words = set(cleaned.split())
-            for key, value in DESCRIPTION_MAPPING.items():
-                mapping_words = set(normalize_column_name(key).split())
-                if key_words & mapping_words:  # Any common words
-                    transactions.append({
-                        'description': value,
-                        'amount': amount
-                    })
-                    break
-
-    return transactions
-
-
-def validate_and_clean_dataframe(df):
-    """
-    Validate and clean the entire dataframe
+    Cache of cleaned workbooks shared by all sessions, keyed by the uploaded bytes.
+
+    Sized by the MAP_IT_CACHE_ENTRIES and MAP_IT_CACHE_MB environment variables.
     """
-    # Clean all cell values in the dataframe
-    for col in df.columns:
-        df[col] = df[col].apply(clean_cell_value)
+    return LRUCache(
+        max_entries=int(os.environ.get('MAP_IT_CACHE_ENTRIES', 8)),
+        max_bytes=int(os.environ.get('MAP_IT_CACHE_MB', 512)) * 1024 * 1024
+    )
 
-    return df
 
+@st.cache_resource
+def get_group_store():
+    """
+    Fingerprint store of converted contract groups shared by all sessions, or None if it cannot be opened.
 
-def detect_merged_comments(df, comment_col, contract_col, payee_col, employee_col):
-    """Detect and combine merged comments that span multiple rows"""
-    merged_rows = []
-    current_merge = None
+    Kept in GROUP_STORE_PATH (under MAP_IT_STATE_DIR).
+    """
+    try:
+        return GroupStore()
+    except (OSError, sqlite3.Error):
+        return None
 
-    for idx, row in df.iterrows():
-        contract_val = clean_cell_value(row[contract_col])
 
-        if current_merge and contract_val == current_merge['contract_no']:
-            current_merge['comment'] += ' ' + clean_cell_value(row[comment_col])
-            current_merge['end_idx'] = idx
-        else:
-            if current_merge:
-                merged_rows.append(current_merge)
-            current_merge = {
-                'contract_no': contract_val,
-                'payee': clean_cell_value(row[payee_col]),
-                'employee_no': clean_cell_value(row[employee_col]),
-                'comment': clean_cell_value(row[comment_col]),
-                'start_idx': idx,
-                'end_idx': idx
-            }
+@st.cache_resource
+def get_job_executor():
+    """Executor running the conversions of all sessions, sized by MAP_IT_JOB_WORKERS"""
+    return job_executor()
 
-    if current_merge:
-        merged_rows.append(current_merge)
 
-    return merged_rows
+@st.cache_resource
+def get_posting_archive():
+    """Posting history shared by all sessions, or None when pyarrow is not installed"""
+    try:
+        return PostingArchive()
+    except ArchiveUnavailable:
+        return None
 
 
-def validate_row_data(row, idx, contract_col, payee_col, employee_col, comment_col):
-    """Validate a single row with enhanced cleaning"""
-    errors = []
-    warnings = []
+def show_already_posted(archive, result_df, batch, effective_date):
+    """Warn about transactions of the batch that an earlier downloaded batch already contained"""
+    duplicates = archive.duplicates(result_df, [effective_date], exclude_batch=batch)
+    if len(duplicates):
+        st.warning(f"⚠️ {len(duplicates):,} of {len(result_df):,} transactions match ones already posted in an "
+                   f"earlier batch (same contract, transaction type, amount and value date)")
+        with st.expander("Show already posted transactions"):
+            st.dataframe(creditease_frame(duplicates), use_container_width=True)
 
-    # Clean and validate contract number
-    contract_val = clean_cell_value(row.get(contract_col, ''))
-    if not contract_val:
-        errors.append(f"Row {idx + 1}: Missing or empty contract number")
 
-    # Clean and validate payee
-    payee_val = clean_cell_value(row.get(payee_col, ''))
-    if not payee_val:
-        errors.append(f"Row {idx + 1}: Missing or empty payee name")
+def get_download_data(result_df, report, effective_date, compress):
+    """
+    CSV bytes for the download button.
 
-    # Clean and validate employee number
-    employee_val = clean_cell_value(row.get(employee_col, ''))
-    if not employee_val:
-        errors.append(f"Row {idx + 1}: Missing or empty employee/EC number")
+    The bytes are built once per converted upload and kept in the session, so
+    reruns caused by other widgets reuse them instead of re-encoding the CSV.
+    """
+    key = (report.get('digest'), report.get('mapping', {}).get('digest'), effective_date, compress,
+           report.get('incremental', {}).get('delta'))
+    download = st.session_state.get('download')
+    if download is None or download['key'] != key or key[0] is None:
+        download = {'key': key, 'data': csv_bytes(result_df, compress)}
+        st.session_state['download'] = download
+    return download['data']
+
+
+def show_performance(report, source_name):
+    """Collapsible panel with the run's stage timings and counters, plus the JSON report"""
+    run_stats = report.get('stats')
+    if not run_stats or not run_stats['stages']:
+        return
+
+    with st.expander("⏱️ Performance"):
+        st.write(f"Total: {run_stats['total_seconds']:.3f}s")
+        stage_table = {
+            'Stage': list(run_stats['stages']),
+            'Seconds': [f"{seconds:.3f}" for seconds in run_stats['stages'].values()],
+        }
+        memory = run_stats.get('memory')
+        if memory:
+            stage_table['Peak MB'] = [f"{memory['stages'].get(stage, 0) / 2**20:,.1f}" for stage in run_stats['stages']]
+            st.write(f"Peak memory: {memory['peak_bytes'] / 2**20:,.1f} MB of a "
+                     f"{memory['budget_bytes'] / 2**20:,.0f} MB budget ({memory['mode']})")
+        st.table(stage_table)
+        st.table({
+            'Counter': list(run_stats['counters']),
+            'Value': [f"{value:,}" for value in run_stats['counters'].values()],
+        })
+        st.download_button(
+            "📄 Download run report (.json)",
+            data=report_json(report),
+            file_name=report_filename(source_name),
+            mime='application/json'
+        )
+
+
+def convert_uploads(sources, effective_date, all_sheets, workbook_cache, store, mapping_version=None, delta=False,
+                    stats=None):
+    """
+    Convert the uploaded workbooks, as (name, bytes) sources, into one batch.
+
+    A single workbook converted from its first sheet goes through the shared
+    workbook cache; several workbooks, or every sheet, are converted in
+    parallel with convert_sources. Contract groups converted before are
+    reused from the group store, and with delta only new or changed groups
+    are kept. Runs on a job thread, so it takes the shared resources as
+    arguments instead of calling Streamlit.
+    """
+    if len(sources) == 1 and not all_sheets:
+        name, data = sources[0]
+        upload = BytesIO(data)
+        upload.name = name
+        result_df, report = convert_file(upload, effective_date, cache=workbook_cache, stats=stats,
+                                         mapping=mapping_version, store=store, delta=delta)
+        cache_stats = workbook_cache.stats()
+        report['cache_caption'] = (
+            f"Workbook cache {report['cache']}: {cache_stats['hits']} hits, "
+            f"{cache_stats['misses']} misses, {cache_stats['entries']} cached"
+        )
+        return result_df, report
+
+    return convert_sources(sources, effective_date, all_sheets=all_sheets, stats=stats, mapping=mapping_version,
+                           store=store, delta=delta)
+
+
+def conversion_key(uploaded_files, effective_date, all_sheets, mapping_version, delta):
+    """The inputs a conversion depends on, used to tell whether a job is still current"""
+    uploads = tuple((uploaded_file.name, uploaded_file.size, getattr(uploaded_file, 'file_id', None))
+                    for uploaded_file in uploaded_files)
+    return uploads, effective_date, all_sheets, mapping_version, delta
+
+
+def submit_conversion(uploaded_files, key, effective_date, all_sheets, mapping_version, delta):
+    """Start converting the uploads as a background job and make it the session's current job"""
+    sources = [(uploaded_file.name, uploaded_file.getvalue()) for uploaded_file in uploaded_files]
+    job = ConversionJob(key, get_job_executor(), convert_uploads, sources, effective_date, all_sheets,
+                        get_workbook_cache(), get_group_store(), mapping_version, delta, memory=True)
+    st.session_state['job'] = job
+    return job
+
+
+def wait_for_conversion(uploaded_files, effective_date, all_sheets, mapping_version, delta):
+    """
+    The session's finished conversion of the uploads as (result_df, report, run_stats).
 
-    # Clean and validate comment
-    comment_val = clean_cell_value(row.get(comment_col, ''))
-    if not comment_val:
-        errors.append(f"Row {idx + 1}: Missing or empty comment")
+    The conversion runs as a background job kept in the session, so reruns
+    only look at it: while it runs this shows its progress with a cancel
+    button and reruns the script every POLL_SECONDS. If the inputs change
+    while it runs, it is left to finish and the uploads are then converted
+    again with the new inputs, reading the workbook from the cache.
+    """
+    key = conversion_key(uploaded_files, effective_date, all_sheets, mapping_version, delta)
+    job = st.session_state.get('job')
+    if job is None or (job.key != key and job.done()):
+        job = submit_conversion(uploaded_files, key, effective_date, all_sheets, mapping_version, delta)
+
+    if not job.done():
+        fraction, text = job.progress()
+        st.progress(fraction or 0.0, text=f"{text} · {job.elapsed():.0f}s")
+        if job.key != key:
+            st.caption("The settings changed while this conversion was running; the file will be converted "
+                       "again with the new settings when it finishes, or cancel it to start over now")
+        if job.cancel_requested():
+            st.caption("Cancelling; the conversion stops at the end of the current step")
+        elif st.button("⏹️ Cancel conversion"):
+            job.cancel()
+        time.sleep(POLL_SECONDS)
+        st.rerun()
+
+    if job.cancelled():
+        st.warning(f"Conversion cancelled after {job.elapsed():.0f}s")
+        if st.button("🔄 Convert again"):
+            submit_conversion(uploaded_files, key, effective_date, all_sheets, mapping_version, delta)
+            st.rerun()
+        st.stop()
+
+    result_df, report = job.result()
+    return result_df, report, job.stats
+
+
+def show_sources(report):
+    """Table of the rows and transactions contributed by each workbook and sheet"""
+    st.markdown("### 🗂️ Sources")
+    st.table({
+        'Source': [source_label(source) for source in report['sources']],
+        'Rows': [f"{source['rows']:,}" for source in report['sources']],
+        'Transactions': [f"{source['transactions']:,}" for source in report['sources']],
+        'Status': ["❌ Failed" if source['error'] else "✅" for source in report['sources']],
+    })
+
+
+def show_validation_errors(errors, source_name):
+    """Rows failing each validation rule, with every error downloadable as CSV"""
+    st.markdown("### 🧾 Validation Errors")
+    counts = rule_counts(errors)
+    st.table({
+        'Rule': list(counts),
+        'Rows': [f"{count:,}" for count in counts.values()],
+    })
+    st.download_button(
+        f"📥 Download all {len(errors):,} errors (.csv)",
+        data=errors.to_csv(index=False).encode('utf-8'),
+        file_name=errors_filename(source_name),
+        mime='text/csv'
+    )
 
-    return errors, warnings
 
+def show_reconciliation(reconciliation, source_name):
+    """Transaction type totals, the control-total check and the reconciliation report download"""
+    st.markdown("### 📊 Transaction Breakdown")
+    by_type = reconciliation['by_type']
+    st.bar_chart({'Transactions': {name: count for name, (count, _) in by_type.items()}})
+    st.table({
+        'Transaction Type': list(by_type),
+        'Transactions': [f"{count:,}" for count, _ in by_type.values()],
+        'Total': [format_money(cents) for _, cents in by_type.values()],
+    })
+
+    control = reconciliation['control']
+    if control is not None:
+        mismatched = control['mismatched']
+        if mismatched:
+            st.warning(f"⚠️ {len(mismatched):,} of {control['checked']:,} contracts do not match their control "
+                       f"total in `{control['column']}`")
+            st.table({
+                'Contract No': mismatched[:20],
+                'Converted': [format_money(reconciliation['by_contract'][contract_no][1])
+                              for contract_no in mismatched[:20]],
+                'Control Total': [format_money(reconciliation['by_contract'][contract_no][2])
+                                  for contract_no in mismatched[:20]],
+            })
+            if len(mismatched) > 20:
+                st.caption(f"Showing the first 20; the reconciliation report lists all {len(mismatched):,}")
+        else:
+            st.caption(f"All {control['checked']:,} contracts match their control total in `{control['column']}`")
 
-def convert_file(uploaded_file, effective_date):
-    """Convert the uploaded file with enhanced data cleaning and validation"""
-    try:
-        # Reset file pointer to beginning
-        uploaded_file.seek(0)
-
-        # First verify it's actually an Excel file by checking the file signature
-        file_signature = uploaded_file.read(8)
-        uploaded_file.seek(0)
-
-        # Excel file signatures
-        excel_signatures = [
-            b'\x50\x4B\x03\x04',  # Modern Excel (xlsx)
-            b'\xD0\xCF\x11\xE0',  # Older Excel (xls)
-            b'\x09\x08\x10\x00',  # Older Excel variants
-            b'\xFD\xFF\xFF\xFF'  # Some older Excel versions
-        ]
-
-        is_excel = any(file_signature.startswith(sig) for sig in excel_signatures)
-        if not is_excel:
-            return None, "❌ The uploaded file doesn't appear to be a valid Excel file. Please upload a .xlsx or .xls file."
-
-        # Try multiple approaches to read the Excel file
-        df = None
-        read_errors = []
-
-        # Method 1: Try with openpyxl engine (for .xlsx)
-        try:
-            df = pd.read_excel(uploaded_file, engine='openpyxl', header=0)
-        except Exception as e:
-            read_errors.append(f"openpyxl engine: {str(e)}")
-            uploaded_file.seek(0)
-
-        # Method 2: Try with xlrd engine (for older .xls files) only if needed
-        if df is None and file_signature.startswith(b'\xD0\xCF\x11\xE0'):  # Only for .xls files
-            try:
-                # Check if xlrd is installed
-                try:
-                    import xlrd
-                    xlrd_installed = True
-                except ImportError:
-                    xlrd_installed = False
-                    read_errors.append("xlrd not installed (required for .xls files)")
-
-                if xlrd_installed:
-                    df = pd.read_excel(uploaded_file, engine='xlrd', header=0)
-            except Exception as e:
-                read_errors.append(f"xlrd engine: {str(e)}")
-                uploaded_file.seek(0)
-
-        # Method 3: Try default engine (will use openpyxl for .xlsx)
-        if df is None:
-            try:
-                df = pd.read_excel(uploaded_file, header=0)
-            except Exception as e:
-                read_errors.append(f"default engine: {str(e)}")
-
-        if df is None:
-            error_msg = "❌ **Unable to read Excel file.**\n\n"
-            error_msg += "**Possible solutions:**\n"
-            error_msg += "- Make sure you're uploading a valid Excel file (.xlsx or .xls)\n"
-
-            if any("xlrd" in err.lower() for err in read_errors):
-                error_msg += "\n**For .xls files:**\n"
-                error_msg += "This environment doesn't have the 'xlrd' package installed.\n"
-                error_msg += "You can either:\n"
-                error_msg += "1. Save your file as .xlsx format instead, or\n"
-                error_msg += "2. Install xlrd with: `pip install xlrd`\n"
-
-            error_msg += "\n**Technical details:**\n"
-            error_msg += "\n".join(f"- {err}" for err in read_errors)
-            return None, error_msg
-
-        # Rest of your existing processing code remains exactly the same...
-        df = validate_and_clean_dataframe(df)
-
-        # Find required columns with enhanced detection
-        contract_col = enhanced_column_finder(df, [
-            'contract no', 'contract', 'contract number', 'contractno', 'contract num'
-        ])
-
-        payee_col = enhanced_column_finder(df, [
-            'name', 'customer name', 'payee', 'fullname', 'employee', 'full name',
-            'client name', 'employee name', 'employeename', 'customer', 'clientname'
-        ])
-
-        employee_col = enhanced_column_finder(df, [
-            'employee number', 'ec number', 'ec num', 'employee num', 'ec number',
-            'employeenumber', 'ecnumber', 'emp num', 'emp number', 'id number'
-        ])
-
-        comment_col = enhanced_column_finder(df, [
-            'comment', 'description', 'transaction description', 'comments',
-            'transaction', 'desc', 'transaction desc'
-        ])
-
-        # Check for missing columns with detailed feedback
-        missing_columns = []
-        column_suggestions = {}
-
-        if not contract_col:
-            missing_columns.append("Contract Number")
-            column_suggestions["Contract Number"] = "Try columns like: Contract No, Contract, Contract Number"
-
-        if not payee_col:
-            missing_columns.append("Payee/Customer Name")
-            column_suggestions["Payee/Customer Name"] = "Try columns like: Name, Customer Name, Payee, Client Name"
-
-        if not employee_col:
-            missing_columns.append("Employee Number")
-            column_suggestions["Employee Number"] = "Try columns like: Employee Number, EC Number, ID Number"
-
-        if not comment_col:
-            missing_columns.append("Comment/Description")
-            column_suggestions[
-                "Comment/Description"] = "Try columns like: Comment, Description, Transaction Description"
-
-        if missing_columns:
-            error_msg = f"❌ **Missing required columns:** {', '.join(missing_columns)}\n\n"
-            error_msg += "**Suggestions:**\n"
-            for col, suggestion in column_suggestions.items():
-                error_msg += f"- **{col}**: {suggestion}\n"
-            error_msg += "\n**Available columns in your file:**\n"
-            for col in df.columns:
-                error_msg += f"- `{col}`\n"
-            return None, error_msg
-
-        # Show successful column mapping
-        st.success(f"✅ **Column mapping successful:**")
-        st.write(f"- Contract Number: `{contract_col}`")
-        st.write(f"- Payee/Customer: `{payee_col}`")
-        st.write(f"- Employee Number: `{employee_col}`")
-        st.write(f"- Comments: `{comment_col}`")
-
-        # Validate data quality
-        validation_errors = []
-        validation_warnings = []
-
-        for idx, row in df.iterrows():
-            errors, warnings = validate_row_data(row, idx, contract_col, payee_col, employee_col, comment_col)
-            validation_errors.extend(errors)
-            validation_warnings.extend(warnings)
-
-        if validation_errors:
-            error_msg = "❌ **Data validation errors found:**\n\n"
-            for error in validation_errors[:10]:  # Show first 10 errors
-                error_msg += f"- {error}\n"
-            if len(validation_errors) > 10:
-                error_msg += f"\n... and {len(validation_errors) - 10} more errors"
-            return None, error_msg
-
-        # Process merged comments
-        merged_comments = detect_merged_comments(df, comment_col, contract_col, payee_col, employee_col)
-        converted_data = []
-        processed_indices = set()
-
-        # Process merged rows first
-        for merge in merged_comments:
-            if merge['end_idx'] > merge['start_idx']:
-                for idx in range(merge['start_idx'], merge['end_idx'] + 1):
-                    processed_indices.add(idx)
-
-                transactions = process_comment(merge['comment'])
-                for transaction in transactions:
-                    converted_data.append({
-                        'Contract No': merge['contract_no'],
-                        'Transaction Type': get_transaction_type(transaction['description']),
-                        'Description': transaction['description'],
-                        'Amount': transaction['amount'],
-                        'Value Date': effective_date.strftime('%d-%b-%y'),
-                        'Effective Date': effective_date.strftime('%d-%b-%y'),
-                        'Post Date': datetime.now().strftime('%d-%b-%y'),
-                        'Employee Number': merge['employee_no'],
-                        'Payee': merge['payee']
-                    })
-
-        # Process individual rows
-        for idx, row in df.iterrows():
-            if idx not in processed_indices:
-                contract_no = clean_cell_value(row[contract_col])
-                payee = clean_cell_value(row[payee_col])
-                employee_no = clean_cell_value(row[employee_col])
-                comment = clean_cell_value(row[comment_col])
-
-                transactions = process_comment(comment)
-                for transaction in transactions:
-                    converted_data.append({
-                        'Contract No': contract_no,
-                        'Transaction Type': get_transaction_type(transaction['description']),
-                        'Description': transaction['description'],
-                        'Amount': transaction['amount'],
-                        'Value Date': effective_date.strftime('%d-%b-%y'),
-                        'Effective Date': effective_date.strftime('%d-%b-%y'),
-                        'Post Date': datetime.now().strftime('%d-%b-%y'),
-                        'Employee Number': employee_no,
-                        'Payee': payee
-                    })
-
-        if not converted_data:
-            return None, "❌ No valid transactions found in the file. Please check your comment/description format."
-
-        result_df = pd.DataFrame(converted_data)
-        return result_df, None
-
-    except Exception as e:
-        error_msg = f"❌ **Error processing file:** {str(e)}\n\n"
-        error_msg += "**Common solutions:**\n"
-        error_msg += "- Ensure the file is a valid Excel (.xlsx or .xls) file\n"
-        error_msg += "- Check that the file is not corrupted\n"
-        error_msg += "- Verify that required columns exist\n"
-        error_msg += "- Try saving the Excel file in a different format\n"
-        return None, error_msg
-
-
-def create_download_link(df, uploaded_filename):
-    """Create a download link for the CSV file"""
-    # Get the uploaded filename without extension and add '_converted.csv'
-    base_name = os.path.splitext(uploaded_filename)[0]
-    filename = f"{base_name}_converted.csv"
-
-    csv = df.to_csv(index=False)
-    b64 = base64.b64encode(csv.encode()).decode()
-    href = f'<a href="data:file/csv;base64,{b64}" download="{filename}" style="text-decoration: none;">'
-    href += '<button style="background: linear-gradient(135deg, #63328a 0%, #f9c846 100%); '
-    href += 'color: white; border: none; padding: 12px 24px; border-radius: 8px; '
-    href += 'font-weight: bold; cursor: pointer;">📥 Download CSV</button></a>'
-    return href
+    st.download_button(
+        "📥 Download reconciliation report (.csv)",
+        data=reconciliation_csv(reconciliation),
+        file_name=reconciliation_filename(source_name),
+        mime='text/csv'
+    )
 
 
 def main():
+    apply_page_style()
+
     # Header
     st.markdown("""
     <div class="header">
@@ -836,14 +412,29 @@ def main():
     </div>
     """, unsafe_allow_html=True)
 
+    # Orchid watermark, fixed in the corner; drawn first so it stays while a conversion runs
+    st.markdown('<div class="orchid-text">Orchid</div>', unsafe_allow_html=True)
+
     # Main content
     st.markdown("### 📁 Upload Excel File")
 
     # File uploader
-    uploaded_file = st.file_uploader(
-        "Choose an Excel file (.xlsx or .xls)",
+    uploaded_files = st.file_uploader(
+        "Choose one or more Excel files (.xlsx or .xls)",
         type=['xlsx', 'xls'],
-        help="Upload your Excel file containing contract data with columns for Contract No, Payee, Employee Number, and Comments"
+        accept_multiple_files=True,
+        help="Upload your Excel files containing contract data with columns for Contract No, Payee, Employee Number, and Comments. Several files are combined into one batch"
+    )
+    all_sheets = st.checkbox(
+        "Convert every sheet",
+        value=False,
+        help="Convert all sheets of each workbook instead of only the first one"
+    )
+    delta = st.checkbox(
+        "Export only new or changed contracts",
+        value=False,
+        help="Leave out contract groups already downloaded for the same effective date, "
+             "so re-uploading a workbook with late rows does not post the rest twice"
     )
 
     # Date input
@@ -854,11 +445,62 @@ def main():
         help="This date will be used as the Value Date and Effective Date for all transactions"
     )
 
-    if uploaded_file is not None:
+    # Offer earlier mapping versions only when archived copies exist
+    mapping_version = None
+    try:
+        versions = MAPPINGS.versions()
+    except (OSError, MappingError):
+        versions = []
+    if len(versions) > 1:
+        mapping_version = st.selectbox(
+            "Transaction mapping version",
+            versions,
+            help="The first entry is the current mapping; pick an earlier version to reproduce an old batch"
+        )
+
+    if uploaded_files:
         st.markdown("### 🔄 Processing File...")
-
-        with st.spinner("Analyzing file structure and cleaning data..."):
-            result_df, error_message = convert_file(uploaded_file, effective_date)
+        # Name the outputs after the workbook, or "batch" when several are combined
+        output_name = uploaded_files[0].name if len(uploaded_files) == 1 else "batch"
+
+        result_df, report, run_stats = wait_for_conversion(uploaded_files, effective_date, all_sheets,
+                                                           mapping_version, delta)
+        error_message = report['error']
+
+        if report['columns']:
+            # Show successful column mapping
+            st.success(f"✅ **Column mapping successful:**")
+            confidence = report.get('column_confidence', {})
+            for role, label in (('contract', "Contract Number"), ('payee', "Payee/Customer"),
+                                ('employee', "Employee Number"), ('comment', "Comments")):
+                match = f" ({confidence[role]:.0%} match)" if role in confidence else ""
+                st.write(f"- {label}: `{report['columns'][role]}`{match}")
+            if report.get('header_row'):
+                st.caption(f"Header found on row {report['header_row'] + 1}; the rows above it were skipped")
+
+        if len(report.get('sources', [])) > 1:
+            show_sources(report)
+
+        captions = [report['cache_caption']] if 'cache_caption' in report else []
+        if 'mapping' in report:
+            captions.append(f"Mapping version {report['mapping']['version']}")
+        if 'comment_cache' in report:
+            captions.append(
+                f"Comment templates: {report['comment_cache']['hits']} reused, "
+                f"{report['comment_cache']['misses']} parsed"
+            )
+        if report.get('memory_plan', {}).get('path') == 'low_memory':
+            captions.append(f"Read row by row: about {report['memory_plan']['in_memory_bytes'] / 2**20:,.0f} MB "
+                            f"would not fit the {report['memory_plan']['budget_bytes'] / 2**20:,.0f} MB memory budget")
+        if 'incremental' in report:
+            incremental = report['incremental']
+            caption = (f"Contract groups: {incremental['reused']:,} of {incremental['groups']:,} reused from "
+                       f"earlier uploads, {incremental['already_posted']:,} already converted for this date")
+            if incremental['delta']:
+                caption += f" (left out, {incremental['skipped_transactions']:,} transactions)"
+            captions.append(caption)
+        if captions:
+            st.caption(" · ".join(captions))
 
         if error_message:
             st.error("**File Processing Failed**")
@@ -867,32 +509,55 @@ def main():
             {error_message}
             </div>
             """, unsafe_allow_html=True)
+            errors = validation_errors(report)
+            if errors is not None:
+                show_validation_errors(errors, output_name)
         else:
             st.success("**File processed successfully!**")
 
-            # Show statistics
+            archive = get_posting_archive()
+            batch = batch_id(report, effective_date)
+            if archive is not None:
+                show_already_posted(archive, result_df, batch, effective_date)
+
+            # Show statistics, as totalled while the transactions were converted
+            reconciliation = report['reconciliation']
             col1, col2 = st.columns(2)
             with col1:
-                st.metric("Total Number of Transactions", len(result_df))
+                st.metric("Total Number of Transactions", reconciliation['transactions'])
             with col2:
-                st.metric("Batch Total", f"${result_df['Amount'].sum():,.2f}")
+                st.metric("Batch Total", format_money(reconciliation['total_cents']))
 
             # Show preview
             st.markdown("### 👀 Preview of Converted Data")
-            st.dataframe(result_df.head(5), use_container_width=True)
+            st.dataframe(creditease_frame(result_df.head(5)), use_container_width=True)
 
             if len(result_df) > 5:
                 st.info(f"Showing first 5 rows of {len(result_df)} total transactions")
 
-                # Download options
-                st.markdown("### 💾 Download Results")
-                download_link = create_download_link(result_df, uploaded_file.name)
-                st.markdown(download_link, unsafe_allow_html=True)
-
-            # Show transaction type breakdown
-            st.markdown("### 📊 Transaction Breakdown")
-            transaction_counts = result_df['Transaction Type'].value_counts()
-            st.bar_chart(transaction_counts)
+            # Download options
+            st.markdown("### 💾 Download Results")
+            compress = st.checkbox("Compress download (.csv.gz)", value=False)
+            file_name = converted_filename(output_name) + ('.gz' if compress else '')
+            with run_stats.stage('export'):
+                download_data = get_download_data(result_df, report, effective_date, compress)
+            report['stats'] = run_stats.as_dict()
+            downloaded = st.download_button(
+                "📥 Download CSV",
+                data=download_data,
+                file_name=file_name,
+                mime='application/gzip' if compress else 'text/csv'
+            )
+            if downloaded:
+                # Only downloaded groups count as posted for later delta exports
+                record_posted_groups(get_group_store(), report, effective_date)
+            # A downloaded batch is recorded in the posting history once
+            if downloaded and archive is not None and archive.append(result_df, batch, effective_date):
+                st.caption("Batch recorded in the posting history")
+
+            show_reconciliation(reconciliation, output_name)
+
+        show_performance(report, output_name)
 
     else:
         st.info("👆 Please upload an Excel file to begin conversion")
@@ -909,9 +574,6 @@ def main():
 
         """)
 
-    # Orchid watermark
-    st.markdown('<div class="orchid-text">Orchid</div>', unsafe_allow_html=True)
-
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,138 @@
+"""
+Differential check and throughput benchmark for the comment tokenizer.
+
+Builds a corpus of comments from the synthetic workbook generator plus
+randomly fuzzed strings (currency signs, thousands separators, decimals,
+hyphens, stray punctuation and non-ASCII text), checks that process_comment
+returns exactly what the old regex chain (process_comment_regex) returns for
+every one of them, and reports throughput in comment fragments per second.
+
+Exits with status 1 if any comment parses differently.
+
+Example:
+    python benchmarks/bench_comment_lexer.py --comments 50000 --output lexer.json
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import map_it_core as core  # noqa: E402
+from workbook_generator import PHRASE_MIXES, generate_rows  # noqa: E402
+
+# Characters the fuzzer mixes into comments, chosen to hit every branch of the grammar
+FUZZ_PIECES = [
+    '$', ',', '.', '-', '_', ' ', '  ', '(', ')', '/', '&', '%', '#', "'", '"', ':', ';',
+    '\t', '\n', '\u00a0', '\u200b', '\ufeff', '\u00e9', '\u0130', '\u00df', '\ufb01', '\u00b2', '\u0661\u0662',
+    '\u0663', '\u03a9', '\u2014',
+    '0', '1', '25', '1,000', '1,000.50', '25.97', '.5', '007', '2024-06-30',
+]
+
+
+def fuzz_comment(rnd, keys):
+    """A random comment built from mapping phrases, numbers and awkward characters"""
+    pieces = []
+    for _ in range(rnd.randint(1, 12)):
+        roll = rnd.random()
+        if roll < 0.35:
+            phrase = rnd.choice(keys)
+            pieces.append(phrase.upper() if rnd.random() < 0.2 else phrase)
+        else:
+            pieces.append(rnd.choice(FUZZ_PIECES))
+    return ''.join(pieces) if rnd.random() < 0.5 else ' '.join(pieces)
+
+
+def build_corpus(comments, seed=0):
+    """Generated workbook comments for every phrase mix, followed by fuzzed comments"""
+    corpus = []
+    per_mix = comments // (2 * len(PHRASE_MIXES))
+    for mix in PHRASE_MIXES:
+        rows = generate_rows(rows=per_mix, phrase_mix=mix, invisible_density=0.1, seed=seed)
+        next(rows)
+        corpus.extend(row[3] for row in rows)
+
+    rnd = random.Random(seed)
+    keys = list(core.DESCRIPTION_MAPPING)
+    corpus.extend(fuzz_comment(rnd, keys) for _ in range(comments - len(corpus)))
+    return corpus
+
+
+def differences(corpus, limit=10):
+    """Comments for which the tokenizer and the regex chain disagree, up to limit of them"""
+    parser = core.CommentParser(core.DESCRIPTION_MATCHER)
+    found = []
+    for comment in corpus:
+        expected = core.process_comment_regex(comment)
+        actual = parser.parse(comment)
+        if actual != expected:
+            found.append({'comment': comment, 'expected': expected, 'actual': actual})
+            if len(found) >= limit:
+                break
+    return found
+
+
+def throughput(func, corpus, fragments, repeat):
+    """Best time over repeat runs of func over the corpus, as (seconds, fragments per second)"""
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for comment in corpus:
+            func(comment)
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best, fragments / best if best else 0.0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Check the comment tokenizer against the regex chain and time both.")
+    parser.add_argument('--comments', type=int, default=20000, help="Corpus size (default: 20000)")
+    parser.add_argument('--repeat', type=int, default=3, help="Runs per measurement (default: 3)")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help="Write the results as JSON to this path")
+    args = parser.parse_args(argv)
+
+    corpus = build_corpus(args.comments, args.seed)
+    fragments = sum(len(core.split_comment(core.normalize_comment(comment))) for comment in corpus)
+
+    mismatches = differences(corpus)
+    print(f"Differential check: {len(corpus):,} comments, {fragments:,} fragments, "
+          f"{'no differences' if not mismatches else f'{len(mismatches)}+ differences'}")
+    for mismatch in mismatches:
+        print(f"  {mismatch['comment']!r}\n    regex chain: {mismatch['expected']}\n    tokenizer:   {mismatch['actual']}")
+
+    cold_parser = core.CommentParser(core.DESCRIPTION_MATCHER)
+    warm_parser = core.CommentParser(core.DESCRIPTION_MATCHER)
+    for comment in corpus:
+        warm_parser.parse(comment)
+
+    def parse_cold(comment):
+        cold_parser.cache.clear()
+        return cold_parser.parse(comment)
+
+    measurements = {
+        'regex_chain': core.process_comment_regex,
+        'tokenize_comment': core.tokenize_comment,
+        'parse_uncached': parse_cold,
+        'parse_cached': warm_parser.parse,
+    }
+    results = {}
+    print(f"{'':<20}{'seconds':>10}{'fragments/s':>16}")
+    for name, func in measurements.items():
+        seconds, rate = throughput(func, corpus, fragments, args.repeat)
+        results[name] = {'seconds': seconds, 'fragments_per_second': rate}
+        print(f"{name:<20}{seconds:>10.3f}{rate:>16,.0f}")
+
+    if args.output:
+        with open(args.output, 'w') as handle:
+            json.dump({'comments': len(corpus), 'fragments': fragments, 'differences': len(mismatches),
+                       'throughput': results}, handle, indent=2)
+        print(f"Results written to {args.output}")
+    return 1 if mismatches else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
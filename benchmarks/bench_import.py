@@ -0,0 +1,122 @@
+"""
+Cold-start import benchmark for the core and the app.
+
+Imports the conversion core, the core with its bundled mapping compiled and
+the Streamlit app module, each in a fresh interpreter per run, and reports
+the best and median wall time of the import, plus the slowest modules
+that module imports directly in one extra run under `python -X importtime`.
+Bytecode is compiled by an untimed first run, so the times are those of a
+restarted worker, not of a first install. The app is skipped when
+streamlit is not installed.
+
+Exits with status 1 if importing the core loads any of HEAVY_MODULES.
+
+Example:
+    python benchmarks/bench_import.py --repeat 20 --output imports.json
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# What each measurement runs in its fresh interpreter
+TARGETS = {
+    'core': "import map_it_core",
+    'core_mapping': "import map_it_core; map_it_core.DEFAULT_MAPPING",
+    'app': "import Map_It",
+}
+
+# Modules the core must leave to the code paths that need them
+HEAVY_MODULES = ('numpy', 'pandas', 'openpyxl', 'xlrd', 'pyarrow', 'streamlit')
+
+CHILD = """
+import json, sys, time
+started = time.perf_counter()
+{statement}
+seconds = time.perf_counter() - started
+print(json.dumps({{'seconds': seconds, 'loaded': [name for name in {heavy!r} if name in sys.modules]}}))
+"""
+
+
+def run_child(statement, importtime=False):
+    """(measurement dict or None, stderr) of running statement in a fresh interpreter"""
+    command = [sys.executable] + (['-X', 'importtime'] if importtime else [])
+    command += ['-c', CHILD.format(statement=statement, heavy=HEAVY_MODULES)]
+    completed = subprocess.run(command, cwd=ROOT, capture_output=True, text=True)
+    if completed.returncode:
+        return None, completed.stderr
+    return json.loads(completed.stdout.strip().splitlines()[-1]), completed.stderr
+
+
+def slowest_imports(importtime_output, module, top):
+    """The modules imported directly by module with the largest cumulative time, as (name, milliseconds)"""
+    # importtime lists a module after everything it imported, nested one level deeper
+    children = []
+    for line in importtime_output.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        depth = (len(name) - len(name.lstrip(' ')) - 1) // 2
+        if depth == 0:
+            if name.strip() == module:
+                return sorted(children, key=lambda item: -item[1])[:top]
+            children = []
+        elif depth == 1:
+            children.append((name.strip(), int(cumulative) / 1000))
+    return []
+
+
+def measure(statement, repeat, top):
+    """Best and median seconds of importing over repeat fresh interpreters, or None with the error"""
+    first, stderr = run_child(statement)
+    if first is None:
+        return None, stderr.strip().splitlines()[-1] if stderr.strip() else "failed"
+
+    seconds = [run_child(statement)[0]['seconds'] for _ in range(repeat)]
+    _, importtime_output = run_child(statement, importtime=True)
+    return {
+        'best_ms': min(seconds) * 1000,
+        'median_ms': statistics.median(seconds) * 1000,
+        'loaded_heavy_modules': first['loaded'],
+        'slowest_imports': slowest_imports(importtime_output, statement.split()[1].rstrip(';'), top),
+    }, None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measure cold-start import time of the core and the app.")
+    parser.add_argument('--repeat', type=int, default=10, help="Fresh interpreters per target (default: 10)")
+    parser.add_argument('--top', type=int, default=5, help="Slowest direct imports to list (default: 5)")
+    parser.add_argument('--output', help="Write the results as JSON to this path")
+    args = parser.parse_args(argv)
+
+    results = {}
+    print(f"{'':<16}{'best ms':>10}{'median ms':>12}  heavy modules loaded")
+    for name, statement in TARGETS.items():
+        result, error = measure(statement, args.repeat, args.top)
+        if result is None:
+            results[name] = {'skipped': error}
+            print(f"{name:<16}{'skipped':>10}  {error}")
+            continue
+        results[name] = result
+        print(f"{name:<16}{result['best_ms']:>10.1f}{result['median_ms']:>12.1f}  "
+              f"{', '.join(result['loaded_heavy_modules']) or '-'}")
+        for module, milliseconds in result['slowest_imports']:
+            print(f"{'':<18}{module:<30}{milliseconds:>8.1f} ms")
+
+    core_heavy = results.get('core', {}).get('loaded_heavy_modules', [])
+    if core_heavy:
+        print(f"Importing the core loaded {', '.join(core_heavy)}")
+
+    if args.output:
+        with open(args.output, 'w') as handle:
+            json.dump({'python': sys.version.split()[0], 'repeat': args.repeat, 'results': results}, handle, indent=2)
+        print(f"Results written to {args.output}")
+    return 1 if core_heavy or 'skipped' in results.get('core', {}) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,107 @@
+"""
+Memory benchmark of the in-memory and low-memory conversion paths.
+
+Generates a workbook per --sizes entry and converts it once per path, each
+in a fresh interpreter with pandas and openpyxl already imported, and
+reports estimate_memory's estimate for the path next to the peak resident
+memory growth RunStats measured. The constants of the estimate in
+map_it_core are fitted to this table.
+
+Exits with status 1 if the two paths produce different CSVs; with
+--edge-cases the workbooks hold the cells read_excel coerces, such as text
+contract numbers with leading zeros and booleans, so this checks that both
+paths coerce them alike.
+
+Example:
+    python benchmarks/bench_memory.py --sizes 20000,100000 --extra-columns 10 --edge-cases --output memory.json
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from workbook_generator import add_generator_arguments, generate_workbook, generator_options  # noqa: E402
+
+PATHS = ('in_memory', 'low_memory')
+
+# Run in the fresh interpreter: the budget is set so memory_plan picks the path, and RunStats does not enforce it
+CHILD = """
+import hashlib, json, sys
+from datetime import date
+import openpyxl, pandas
+import map_it_core as core
+
+path, route = sys.argv[1], sys.argv[2]
+with open(path, 'rb') as handle:
+    estimate = core.estimate_memory(handle)
+core.MEMORY_BUDGET_MB = 0 if route == 'in_memory' else estimate['in_memory_bytes'] // 2**20 - 1
+stats = core.RunStats(memory=True, memory_budget=0)
+result_df, report = core.convert_file(path, date(2024, 6, 30), stats=stats)
+print(json.dumps({
+    'estimate': estimate,
+    'path': report['memory_plan']['path'],
+    'peak_bytes': report['stats']['memory']['peak_bytes'],
+    'seconds': report['stats']['total_seconds'],
+    'csv_md5': None if result_df is None else hashlib.md5(core.csv_bytes(result_df)).hexdigest(),
+    'error': report['error'],
+}))
+"""
+
+
+def run_child(path, route):
+    """The child's measurement dict, or None with its error"""
+    completed = subprocess.run([sys.executable, '-c', CHILD, path, route], cwd=ROOT, capture_output=True, text=True)
+    if completed.returncode:
+        return None, completed.stderr.strip().splitlines()[-1]
+    return json.loads(completed.stdout.strip().splitlines()[-1]), None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare estimated and measured memory of both conversion paths.")
+    parser.add_argument('--sizes', default='10000,50000,100000', help="Comma-separated row counts to generate")
+    parser.add_argument('--output', help="Write the results as JSON to this path")
+    add_generator_arguments(parser)
+    args = parser.parse_args(argv)
+
+    results = []
+    differing = 0
+    print(f"{'rows':>8}{'sheet MB':>10}  {'path':<11}{'estimate MB':>12}{'measured MB':>13}{'ratio':>7}{'seconds':>9}")
+    with tempfile.TemporaryDirectory() as workdir:
+        for rows in (int(size) for size in args.sizes.split(',')):
+            args.rows = rows
+            path = os.path.join(workdir, f"bench_{rows}.xlsx")
+            generate_workbook(path, **generator_options(args))
+            checksums = set()
+            for route in PATHS:
+                result, error = run_child(path, route)
+                if result is None:
+                    print(f"{rows:>8}  {route:<11}failed: {error}")
+                    results.append({'rows': rows, 'path': route, 'error': error})
+                    differing += 1
+                    continue
+                estimate = result['estimate'][f"{route}_bytes"]
+                checksums.add(result['csv_md5'])
+                results.append({'rows': rows, 'path': result['path'], 'sheet_bytes': result['estimate']['sheet_bytes'],
+                                'estimate_bytes': estimate, 'peak_bytes': result['peak_bytes'],
+                                'seconds': result['seconds'], 'error': result['error']})
+                print(f"{rows:>8}{result['estimate']['sheet_bytes'] / 2**20:>10.1f}  {result['path']:<11}"
+                      f"{estimate / 2**20:>12.1f}{result['peak_bytes'] / 2**20:>13.1f}"
+                      f"{result['peak_bytes'] / estimate:>7.2f}{result['seconds']:>9.2f}")
+            if len(checksums) > 1:
+                print(f"{rows:>8}  the two paths produced DIFFERENT CSVs")
+                differing += 1
+
+    if args.output:
+        with open(args.output, 'w') as handle:
+            json.dump({'options': generator_options(args), 'results': results}, handle, indent=2)
+        print(f"Results written to {args.output}")
+    return 1 if differing else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,141 @@
+"""
+Benchmark of building the CreditEase result frame.
+
+Parses the comments of a synthetic export into contract groups, repeating
+them until the batch holds the requested number of transactions, and then
+builds the result frame twice: the old way, one 9-key dict per transaction
+with the dates formatted per row, and with ResultBuilder. Reports the time,
+the peak memory allocated while building (tracemalloc) and the size of the
+finished frame for both, and checks that both frames write the same CSV.
+
+Exits with status 1 if the CSVs differ.
+
+Example:
+    python benchmarks/bench_result_frame.py --transactions 500000 --output result_frame.json
+"""
+import argparse
+import gc
+import json
+import os
+import sys
+import time
+import tracemalloc
+from datetime import date, datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pandas as pd  # noqa: E402
+
+import map_it_core as core  # noqa: E402
+from workbook_generator import PHRASE_MIXES, generate_rows  # noqa: E402
+
+EFFECTIVE_DATE = date(2024, 6, 30)
+
+
+def build_groups(transactions, phrase_mix='uniform', seed=0):
+    """(contract, payee, employee, parsed transactions) groups holding `transactions` transactions in total"""
+    rows = generate_rows(rows=10000, phrase_mix=phrase_mix, seed=seed)
+    next(rows)
+    distinct = []
+    for contract, payee, employee, comment in rows:
+        parsed = core.process_comment(core.clean_cell_value(comment))
+        if parsed:
+            distinct.append((str(contract), core.clean_cell_value(payee), employee, parsed))
+
+    groups = []
+    total = 0
+    while total < transactions:
+        for contract, payee, employee, parsed in distinct:
+            groups.append((f"{contract}-{len(groups)}", payee, employee, parsed))
+            total += len(parsed)
+            if total >= transactions:
+                break
+    return groups
+
+
+def dict_rows_frame(groups, mapping):
+    """The result frame as built before ResultBuilder: a dict per transaction, dates per row, float amounts"""
+    rows = []
+    for contract_no, payee, employee_no, transactions in groups:
+        for transaction in transactions:
+            rows.append({
+                'Contract No': contract_no,
+                'Transaction Type': mapping.transaction_type(transaction['description']),
+                'Description': transaction['description'],
+                'Amount': transaction['cents'] / 100,
+                'Value Date': EFFECTIVE_DATE.strftime('%d-%b-%y'),
+                'Effective Date': EFFECTIVE_DATE.strftime('%d-%b-%y'),
+                'Post Date': datetime.now().strftime('%d-%b-%y'),
+                'Employee Number': employee_no,
+                'Payee': payee
+            })
+    return pd.DataFrame(rows)
+
+
+def builder_frame(groups, mapping):
+    """The result frame built column-wise with ResultBuilder"""
+    builder = core.ResultBuilder(mapping, core.BatchDates(EFFECTIVE_DATE))
+    for group in groups:
+        builder.add(*group)
+    return builder.frame()
+
+
+def measure(func, groups, mapping, repeat):
+    """Best time, tracemalloc peak and frame size of building the result frame with func"""
+    best = None
+    for _ in range(repeat):
+        gc.collect()
+        started = time.perf_counter()
+        result_df = func(groups, mapping)
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+        del result_df
+
+    gc.collect()
+    tracemalloc.start()
+    result_df = func(groups, mapping)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        'seconds': best,
+        'peak_bytes': peak,
+        'frame_bytes': int(result_df.memory_usage(deep=True).sum()),
+    }, result_df
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare building the result frame from dicts and column-wise.")
+    parser.add_argument('--transactions', type=int, default=500000, help="Batch size (default: 500000)")
+    parser.add_argument('--phrase-mix', choices=PHRASE_MIXES, default='uniform')
+    parser.add_argument('--repeat', type=int, default=3, help="Timed runs per method (default: 3)")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help="Write the results as JSON to this path")
+    args = parser.parse_args(argv)
+
+    mapping = core.resolve_mapping()
+    groups = build_groups(args.transactions, args.phrase_mix, args.seed)
+    transactions = sum(len(group[3]) for group in groups)
+
+    results = {}
+    frames = {}
+    for name, func in (('dict_rows', dict_rows_frame), ('result_builder', builder_frame)):
+        results[name], frames[name] = measure(func, groups, mapping, args.repeat)
+    same_csv = core.csv_bytes(frames['dict_rows']) == core.csv_bytes(frames['result_builder'])
+
+    print(f"{transactions:,} transactions in {len(groups):,} groups, "
+          f"{'identical CSV' if same_csv else 'CSV DIFFERS'}")
+    print(f"{'':<18}{'seconds':>10}{'peak MB':>12}{'frame MB':>12}")
+    for name, result in results.items():
+        print(f"{name:<18}{result['seconds']:>10.3f}{result['peak_bytes'] / 2**20:>12.1f}"
+              f"{result['frame_bytes'] / 2**20:>12.1f}")
+
+    if args.output:
+        with open(args.output, 'w') as handle:
+            json.dump({'transactions': transactions, 'groups': len(groups), 'identical_csv': same_csv,
+                       'results': results}, handle, indent=2)
+        print(f"Results written to {args.output}")
+    return 0 if same_csv else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,171 @@
+"""
+Local load test of the HTTP conversion service.
+
+Starts map_it_service on a free localhost port inside this process, posts
+the same workbook (generated, or given with --workbook) from several
+client threads at once, and reports the status codes, the latency and
+time to first CSV byte of successful requests, and the throughput. A
+client turned away with 503 at the service's concurrency limit retries
+after a short pause, up to --retries times. Every CSV returned is checked
+against convert_file's output for the workbook.
+
+Exits with status 1 if any CSV differs or any request finally fails.
+
+Example:
+    python benchmarks/bench_service.py --requests 40 --concurrency 8 --workers 4 --rows 20000
+"""
+import argparse
+import http.client
+import json
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import map_it_core as core  # noqa: E402
+import map_it_service as service_module  # noqa: E402
+from workbook_generator import add_generator_arguments, generate_workbook, generator_options  # noqa: E402
+
+EFFECTIVE_DATE = date(2024, 6, 30)
+
+# Seconds a client turned away with 503 waits before its first retry; later retries wait longer
+RETRY_PAUSE = 0.1
+
+
+def post_workbook(port, data, name, retries=0):
+    """
+    (status, body, seconds to the first body byte, total seconds, retries) of one conversion request.
+
+    Times count from the first attempt, so waiting for a free slot is included.
+    """
+    started = time.perf_counter()
+    for attempt in range(retries + 1):
+        status, body, first_byte = _post(port, data, name)
+        if status != 503:
+            break
+        time.sleep(RETRY_PAUSE * (attempt + 1))
+    return status, body, first_byte - started, time.perf_counter() - started, attempt
+
+
+def _post(port, data, name):
+    """(status, body, perf_counter at the first body byte) of one attempt"""
+    connection = http.client.HTTPConnection('127.0.0.1', port, timeout=600)
+    try:
+        connection.request('POST', f"/convert?effective_date={EFFECTIVE_DATE.isoformat()}&name={name}", body=data,
+                           headers={'Content-Type': 'application/octet-stream'})
+        response = connection.getresponse()
+        first = response.read(1)
+        first_byte = time.perf_counter()
+        return response.status, first + response.read(), first_byte
+    finally:
+        connection.close()
+
+
+def get_health(port):
+    connection = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+    try:
+        connection.request('GET', '/health')
+        return json.loads(connection.getresponse().read())
+    finally:
+        connection.close()
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load-test the Map It HTTP service on localhost.")
+    parser.add_argument('--workbook', help="Post an existing workbook instead of generating one")
+    parser.add_argument('--requests', type=int, default=20, help="Conversion requests to send (default: 20)")
+    parser.add_argument('--concurrency', type=int, default=4, help="Client threads sending them (default: 4)")
+    parser.add_argument('--workers', type=int, default=2, help="Service worker processes (default: 2)")
+    parser.add_argument('--max-requests', type=int, default=None,
+                        help="Service concurrency limit (default: 2 x workers)")
+    parser.add_argument('--timeout', type=float, default=300, help="Service conversion timeout in seconds")
+    parser.add_argument('--retries', type=int, default=50, help="Retries of a request turned away with 503")
+    parser.add_argument('--output', help="Write the results as JSON to this path")
+    add_generator_arguments(parser)
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as workdir:
+        path = args.workbook or os.path.join(workdir, "bench.xlsx")
+        if not args.workbook:
+            generate_workbook(path, **generator_options(args))
+        with open(path, 'rb') as handle:
+            data = handle.read()
+        name = os.path.basename(path)
+
+        result_df, report = core.convert_file(path, EFFECTIVE_DATE)
+        if result_df is None:
+            print(f"The workbook does not convert: {report['error']}", file=sys.stderr)
+            return 1
+        expected = core.csv_bytes(result_df)
+
+        service = service_module.ConversionService(args.workers, args.max_requests, args.timeout, spool_dir=workdir)
+        server = service_module.make_server(service, port=0, quiet=True)
+        port = server.server_address[1]
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        try:
+            started = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=args.concurrency) as clients:
+                responses = list(clients.map(lambda _: post_workbook(port, data, name, args.retries),
+                                             range(args.requests)))
+            elapsed = time.perf_counter() - started
+            health = get_health(port)
+        finally:
+            server.shutdown()
+            server.server_close()
+            service.close()
+
+    statuses = Counter(status for status, _, _, _, _ in responses)
+    succeeded = [response for response in responses if response[0] == 200]
+    differing = sum(body != expected for _, body, _, _, _ in succeeded)
+    failed = len(responses) - len(succeeded)
+    retried = sum(retries for _, _, _, _, retries in responses)
+
+    results = {
+        'workbook_bytes': len(data),
+        'transactions': len(result_df),
+        'requests': args.requests,
+        'concurrency': args.concurrency,
+        'workers': service.workers,
+        'max_requests': service.max_requests,
+        'statuses': {str(status): count for status, count in sorted(statuses.items())},
+        'retries_after_503': retried,
+        'differing_csv': differing,
+        'seconds': elapsed,
+        'conversions_per_second': len(succeeded) / elapsed if elapsed else 0.0,
+        'health': health,
+    }
+    print(f"{args.requests} requests of {len(data) / 2**20:.1f} MB ({len(result_df):,} transactions), "
+          f"{args.concurrency} clients, {service.workers} workers, limit {service.max_requests}")
+    print(f"Statuses: {', '.join(f'{status}: {count}' for status, count in sorted(statuses.items()))}, "
+          f"{retried} retries after 503")
+    if succeeded:
+        latencies = [total for _, _, _, total, _ in succeeded]
+        first_bytes = [first_byte for _, _, first_byte, _, _ in succeeded]
+        results['latency'] = {'p50': statistics.median(latencies), 'p95': percentile(latencies, 0.95),
+                              'max': max(latencies), 'first_byte_p50': statistics.median(first_bytes)}
+        print(f"Latency:  p50 {results['latency']['p50']:.2f}s, p95 {results['latency']['p95']:.2f}s, "
+              f"max {results['latency']['max']:.2f}s, first byte p50 {results['latency']['first_byte_p50']:.2f}s")
+    print(f"Throughput: {results['conversions_per_second']:.2f} conversions/s over {elapsed:.1f}s, "
+          f"{'identical CSVs' if not differing else f'{differing} CSVs DIFFER'}")
+
+    if args.output:
+        with open(args.output, 'w') as handle:
+            json.dump(results, handle, indent=2)
+        print(f"Results written to {args.output}")
+    return 1 if differing or failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,184 @@
+"""
+Stage-by-stage benchmark of the Map It conversion pipeline.
+
+Generates a synthetic workbook (or uses an existing one), times each stage of
+the conversion separately and writes the results as JSON so runs can be
+compared across commits.
+
+Example:
+    python benchmarks/bench_stages.py --rows 200000 --extra-columns 60 --output before.json
+    python benchmarks/bench_stages.py --rows 200000 --extra-columns 60 --output after.json --compare before.json
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import date, datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pandas as pd  # noqa: E402
+
+import map_it_core as core  # noqa: E402
+from workbook_generator import add_generator_arguments, generate_workbook, generator_options  # noqa: E402
+
+EFFECTIVE_DATE = date(2024, 6, 30)
+
+
+def time_stage(func, repeat):
+    """Run func `repeat` times and return (timings, last result)"""
+    timings = []
+    result = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = func()
+        timings.append(time.perf_counter() - started)
+    return timings, result
+
+
+def git_revision():
+    """Short hash of the checked-out commit, or None outside a git checkout"""
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)),
+            stderr=subprocess.DEVNULL, text=True
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_stages(path, repeat=3):
+    """Time every pipeline stage on the workbook at path and return {stage: timings}"""
+    stages = {}
+
+    def record(name, func):
+        timings, result = time_stage(func, repeat)
+        stages[name] = timings
+        return result
+
+    head = record('excel_read_header', lambda: pd.read_excel(path, header=None, nrows=core.HEADER_SNIFF_ROWS))
+    header_row, names = record('sniff_header_row',
+                               lambda: core.sniff_header_row(head.itertuples(index=False, name=None)))
+    raw = record('excel_read', lambda: pd.read_excel(path, header=header_row))
+    columns, _, error_msg = record('find_columns', lambda: core.find_columns(names))
+    if error_msg:
+        raise SystemExit(f"Benchmark workbook is missing required columns:\n{error_msg}")
+    mapped = list(dict.fromkeys(columns.values()))
+    positions = sorted({names.index(column) for column in mapped})
+    record('excel_read_mapped_columns', lambda: pd.read_excel(path, header=header_row, usecols=positions))
+    record('read_workbook_rows', lambda: core.read_workbook_rows(path))
+
+    record('validate_and_clean_dataframe_all_columns', lambda: core.validate_and_clean_dataframe(raw.copy()))
+    df = record('validate_and_clean_dataframe', lambda: core.validate_and_clean_dataframe(raw[mapped].copy()))
+
+    record('validation', lambda: core.validation_table(df, columns))
+
+    def parse_comments():
+        # Start cold every run so the template cache does not flatter later runs
+        core.COMMENT_PARSER.cache.clear()
+        return [core.process_comment(comment) for comment in df[columns['comment']].to_numpy()]
+
+    record('process_comment_per_row', parse_comments)
+
+    def row_pipeline():
+        core.COMMENT_PARSER.cache.clear()
+        dates = core.BatchDates(EFFECTIVE_DATE)
+        merged_rows = core.ResultBuilder(core.DEFAULT_MAPPING, dates)
+        single_rows = core.ResultBuilder(core.DEFAULT_MAPPING, dates)
+        pipeline = core.RowPipeline(EFFECTIVE_DATE, merged_rows.add, single_rows.add)
+        for row in zip(df.index, *(df[columns[role]].to_numpy() for role in core.ROLES)):
+            pipeline.add(*row)
+        pipeline.finish()
+        merged_rows.extend(single_rows)
+        return pipeline, merged_rows.frame()
+
+    pipeline, result_df = record('row_pipeline', row_pipeline)
+    record('csv_export', lambda: core.csv_bytes(result_df))
+
+    def end_to_end():
+        core.COMMENT_PARSER.cache.clear()
+        return core.convert_file(path, EFFECTIVE_DATE)
+
+    record('convert_file', end_to_end)
+
+    counts = {
+        'rows': len(df),
+        'groups': pipeline.groups,
+        'merged_groups': pipeline.merged_groups,
+        'transactions': len(result_df),
+    }
+    return stages, counts
+
+
+def summarize(stages):
+    return {
+        name: {'best': min(timings), 'mean': sum(timings) / len(timings), 'runs': len(timings)}
+        for name, timings in stages.items()
+    }
+
+
+def print_results(results, baseline=None):
+    baseline_stages = (baseline or {}).get('stages', {})
+    print(f"{'stage':<42}{'best (s)':>12}{'mean (s)':>12}" + (f"{'vs base':>10}" if baseline else ''))
+    for name, timing in results['stages'].items():
+        line = f"{name:<42}{timing['best']:>12.4f}{timing['mean']:>12.4f}"
+        if name in baseline_stages and timing['best'] > 0:
+            line += f"{baseline_stages[name]['best'] / timing['best']:>9.2f}x"
+        print(line)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark each stage of the Map It pipeline.")
+    parser.add_argument('--workbook', help="Benchmark an existing workbook instead of generating one")
+    parser.add_argument('--format', choices=['xlsx', 'xls'], default='xlsx', help="Format of the generated workbook")
+    parser.add_argument('--repeat', type=int, default=3, help="Runs per stage (default: 3)")
+    parser.add_argument('--output', help="Write the results as JSON to this path")
+    parser.add_argument('--compare', help="Earlier JSON results to compare against")
+    add_generator_arguments(parser)
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as workdir:
+        if args.workbook:
+            path = args.workbook
+            workbook = {'path': os.path.abspath(path)}
+        else:
+            path = os.path.join(workdir, f"bench.{args.format}")
+            workbook = dict(generator_options(args), format=args.format)
+            started = time.perf_counter()
+            generate_workbook(path, **generator_options(args))
+            print(f"Generated {args.rows:,} rows in {time.perf_counter() - started:.1f}s")
+        workbook['bytes'] = os.path.getsize(path)
+
+        stages, counts = run_stages(path, args.repeat)
+
+    results = {
+        'meta': {
+            'timestamp': datetime.now().isoformat(timespec='seconds'),
+            'git_revision': git_revision(),
+            'python': platform.python_version(),
+            'pandas': pd.__version__,
+            'platform': platform.platform(),
+        },
+        'workbook': workbook,
+        'counts': counts,
+        'stages': summarize(stages),
+    }
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as handle:
+            baseline = json.load(handle)
+    print_results(results, baseline)
+
+    if args.output:
+        with open(args.output, 'w') as handle:
+            json.dump(results, handle, indent=2)
+        print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,204 @@
+"""
+Synthetic workbook generator for Map It benchmarks.
+
+Writes realistic .xlsx (openpyxl) or .xls (xlwt) exports with a configurable
+number of rows, extra columns, DESCRIPTION_MAPPING phrase mix, fraction of
+merged consecutive-contract rows, invisible-character density, header
+variant, title rows above the header and cells read_excel coerces.
+
+Example:
+    python benchmarks/workbook_generator.py bench.xlsx --rows 100000 --extra-columns 60
+"""
+import argparse
+import os
+import random
+import sys
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from map_it_core import DESCRIPTION_MAPPING, INVISIBLE_CHARS  # noqa: E402
+
+# Header rows for the four required columns, from clean exports to messy ones
+HEADER_VARIANTS = {
+    'standard': ['Contract No', 'Customer Name', 'EC Number', 'Comment'],
+    'alternate': ['Contract Number', 'Payee', 'Employee Number', 'Transaction Description'],
+    'messy': ['\ufeffContract No | ref', 'CLIENT NAME ', 'Ec Num.', ' comments\u200b'],
+}
+
+# Phrases that show up most in real exports, used by the 'skewed' mix
+COMMON_PHRASES = ['monthly interest', 'service fee', 'receipts', 'card fee', 'instalment', 'direct deposit']
+
+# Words that match nothing or only through the word-overlap fallback
+NOISE_WORDS = ['adj', 'manual', 'per', 'branch', 'fee', 'rev', 'status', 'corr']
+
+PHRASE_MIXES = ('uniform', 'skewed', 'noisy')
+
+# .xls sheets hold at most 65536 rows including the header
+XLS_MAX_ROWS = 65535
+
+
+def _amount(rnd):
+    """A random amount written the way operators type them"""
+    value = rnd.choice([rnd.randint(1, 99), rnd.randint(100, 5000), round(rnd.uniform(1, 500), 2)])
+    text = f"{value:,}" if rnd.random() < 0.2 else str(value)
+    return f"${text}" if rnd.random() < 0.3 else text
+
+
+def _phrase(rnd, phrase_mix, keys):
+    if phrase_mix == 'skewed' and rnd.random() < 0.8:
+        return rnd.choice(COMMON_PHRASES)
+    phrase = rnd.choice(keys)
+    if phrase_mix == 'noisy':
+        roll = rnd.random()
+        if roll < 0.2:
+            position = rnd.randrange(len(phrase) + 1)
+            phrase = phrase[:position] + rnd.choice('aeiost') + phrase[position:]
+        elif roll < 0.35:
+            phrase = f"{rnd.choice(NOISE_WORDS)} {rnd.choice(NOISE_WORDS)}"
+        elif roll < 0.45:
+            phrase = phrase.upper()
+    return phrase
+
+
+def _inject_invisible(rnd, text, density):
+    """Sprinkle invisible and control characters into a cell with the given probability"""
+    if density <= 0 or rnd.random() >= density:
+        return text
+    junk = rnd.choice(INVISIBLE_CHARS + ['\r\n', '\t', '  '])
+    position = rnd.randrange(len(text) + 1)
+    return text[:position] + junk + text[position:]
+
+
+def _edge_cells(rnd, values, contract):
+    """
+    Rewrite a data row with cells read_excel coerces column by column: text
+    contract and employee numbers with leading zeros among numeric ones,
+    booleans among the employee numbers and numeric payees, plus an error or
+    date cell in a last, unmapped column
+    """
+    employee = contract * 3 % 1000003
+    roll = rnd.random()
+    values[0] = f"{contract:09d}" if roll < 0.1 else contract
+    values[2] = f"{employee:07d}" if roll < 0.2 else True if roll < 0.22 else employee
+    if rnd.random() < 0.05:
+        values[1] = contract
+    values.append('#N/A' if roll < 0.05 else rnd.choice([date(2024, 1, 1) + timedelta(days=contract % 365), 1.5]))
+
+
+def generate_rows(rows=1000, extra_columns=0, phrase_mix='uniform', merged_fraction=0.3,
+                  invisible_density=0.05, header_variant='standard', title_rows=0, edge_cases=False, seed=0):
+    """
+    Yield `title_rows` banner rows, the header row and then `rows` data rows of a synthetic export.
+
+    With edge_cases, the data rows hold cells read_excel coerces (see
+    _edge_cells) in an extra last column and the sheet ends with blank rows.
+    """
+    if phrase_mix not in PHRASE_MIXES:
+        raise ValueError(f"phrase_mix must be one of {', '.join(PHRASE_MIXES)}")
+
+    rnd = random.Random(seed)
+    keys = list(DESCRIPTION_MAPPING)
+    for title_row in range(title_rows):
+        # Report titles and blank spacer rows, as exported above the real header
+        yield [f"Transactions report, page {title_row + 1}"] if title_row % 2 == 0 else []
+    yield HEADER_VARIANTS[header_variant] + [f"Extra {column}" for column in range(extra_columns)] + (
+        ['Posted'] if edge_cases else [])
+
+    contract = 100000
+    for row in range(rows):
+        # A merged row continues the previous contract with more of its comment
+        if row == 0 or rnd.random() >= merged_fraction:
+            contract += rnd.randint(1, 7)
+        parts = [f"{_phrase(rnd, phrase_mix, keys)} {_amount(rnd)}" for _ in range(rnd.choice([1, 1, 2, 3]))]
+        values = [
+            contract,
+            _inject_invisible(rnd, f"Customer {contract}", invisible_density),
+            f"EC{contract * 3 % 1000003:07d}",
+            _inject_invisible(rnd, ', '.join(parts), invisible_density),
+        ]
+        values.extend(rnd.randint(0, 10**6) if column % 2 else f"value {row}-{column}"
+                      for column in range(extra_columns))
+        if edge_cases:
+            _edge_cells(rnd, values, contract)
+        yield values
+    if edge_cases:
+        yield from ([], [None, None])
+
+
+def write_workbook(path, rows_iter):
+    """Write rows to an .xlsx or .xls workbook, depending on the extension of path"""
+    if path.lower().endswith('.xls'):
+        try:
+            import xlwt
+        except ImportError:
+            raise RuntimeError("Writing .xls workbooks requires xlwt: `pip install xlwt`")
+
+        book = xlwt.Workbook()
+        sheet = book.add_sheet('Sheet1')
+        for row_number, values in enumerate(rows_iter):
+            if row_number > XLS_MAX_ROWS:
+                raise ValueError(f".xls workbooks are limited to {XLS_MAX_ROWS:,} data rows")
+            for column, value in enumerate(values):
+                sheet.write(row_number, column, value)
+        book.save(path)
+        return path
+
+    import openpyxl
+
+    book = openpyxl.Workbook(write_only=True)
+    sheet = book.create_sheet('Sheet1')
+    for values in rows_iter:
+        sheet.append(values)
+    book.save(path)
+    return path
+
+
+def generate_workbook(path, **options):
+    """Generate a synthetic workbook at path; options are those of generate_rows"""
+    return write_workbook(path, generate_rows(**options))
+
+
+def add_generator_arguments(parser):
+    """Add the workbook shape options shared by the generator and the benchmark"""
+    parser.add_argument('--rows', type=int, default=10000, help="Number of data rows (default: 10000)")
+    parser.add_argument('--extra-columns', type=int, default=0, help="Unused columns added after the required four")
+    parser.add_argument('--phrase-mix', choices=PHRASE_MIXES, default='uniform',
+                        help="uniform over DESCRIPTION_MAPPING, skewed to common phrases, or noisy with typos")
+    parser.add_argument('--merged-fraction', type=float, default=0.3,
+                        help="Probability that a row continues the previous contract (default: 0.3)")
+    parser.add_argument('--invisible-density', type=float, default=0.05,
+                        help="Probability that a text cell contains invisible characters (default: 0.05)")
+    parser.add_argument('--header-variant', choices=sorted(HEADER_VARIANTS), default='standard')
+    parser.add_argument('--title-rows', type=int, default=0, help="Banner rows written above the header row")
+    parser.add_argument('--edge-cases', action='store_true',
+                        help="Write cells read_excel coerces, such as text numbers with leading zeros and booleans")
+    parser.add_argument('--seed', type=int, default=0)
+
+
+def generator_options(args):
+    """generate_rows keyword arguments from parsed command-line arguments"""
+    return {
+        'rows': args.rows,
+        'extra_columns': args.extra_columns,
+        'phrase_mix': args.phrase_mix,
+        'merged_fraction': args.merged_fraction,
+        'invisible_density': args.invisible_density,
+        'header_variant': args.header_variant,
+        'title_rows': args.title_rows,
+        'edge_cases': args.edge_cases,
+        'seed': args.seed,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate a synthetic Map It workbook.")
+    parser.add_argument('path', help="Output .xlsx or .xls path")
+    add_generator_arguments(parser)
+    args = parser.parse_args(argv)
+    generate_workbook(args.path, **generator_options(args))
+    print(f"Wrote {args.rows:,} rows to {args.path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,228 @@
+"""
+Local posting-history archive for Map It.
+
+Every downloaded batch is appended to a Parquet archive partitioned by
+effective date, so new batches can be checked for transactions that were
+already posted and finance can query totals over any date range.
+
+Example:
+    python map_it_archive.py totals --by contract --start 2024-06-01 --end 2024-06-30
+    python map_it_archive.py duplicates converted/june_converted.csv --effective-date 2024-06-30
+"""
+import argparse
+import hashlib
+import importlib.util
+import os
+import sys
+import tempfile
+from datetime import date, datetime
+
+from map_it_core import STATE_DIR, format_cents, parse_cents
+
+ARCHIVE_DIR = os.path.join(STATE_DIR, 'archive')
+
+# Columns identifying a posting: the same values twice mean the transaction was posted twice
+POSTING_KEY_COLUMNS = ['Contract No', 'Transaction Type', 'Amount', 'Value Date']
+
+# Columns the totals can be grouped by
+TOTALS_BY = {'contract': 'Contract No', 'type': 'Transaction Type'}
+
+
+class ArchiveUnavailable(RuntimeError):
+    """pyarrow, needed to read and write the Parquet archive, is not installed"""
+
+
+def _require_pyarrow():
+    # Only checks that pyarrow is installed; pandas imports it when the archive is first read or written
+    if importlib.util.find_spec('pyarrow') is None:
+        raise ArchiveUnavailable("The posting history needs pyarrow: `pip install pyarrow`")
+
+
+def posting_keys(result_df):
+    """64-bit hash of each row's contract, transaction type, amount (integer cents) and value date"""
+    import pandas as pd
+
+    key_frame = pd.DataFrame({
+        'Contract No': result_df['Contract No'].astype(str),
+        'Transaction Type': result_df['Transaction Type'].astype(str),
+        'Amount': result_df['Amount'].astype('int64'),
+        'Value Date': result_df['Value Date'].astype(str),
+    })
+    return pd.util.hash_pandas_object(key_frame, index=False).to_numpy()
+
+
+def batch_id(report, effective_date):
+    """Identifier of a converted batch: the same upload, mapping and date always get the same one"""
+    digest = hashlib.sha256()
+    for part in (report.get('digest'), report.get('mapping', {}).get('digest'), effective_date.isoformat(),
+                 repr(report.get('incremental', {}).get('delta'))):
+        digest.update(str(part).encode('utf-8'))
+    return digest.hexdigest()[:16]
+
+
+class PostingArchive:
+    """
+    Parquet archive of posted batches under root, one directory per effective date.
+
+    Each batch is one file, effective_date=YYYY-MM-DD/<batch id>.parquet,
+    holding the CreditEase rows with Amount in integer cents, plus a 'Batch'
+    id, an 'Archived' timestamp and the 'posting_key' hash of
+    POSTING_KEY_COLUMNS. Duplicate checks read only the posting_key and
+    Batch columns of the partitions for the batch's effective dates and join
+    them against the new keys in one vectorised lookup. Value Date always
+    equals Effective Date in Map It batches, so no other partition can hold
+    a duplicate.
+    """
+
+    def __init__(self, root=ARCHIVE_DIR):
+        _require_pyarrow()
+        self.root = root
+
+    def _partition(self, effective_date):
+        return os.path.join(self.root, f"effective_date={effective_date.isoformat()}")
+
+    def partitions(self, start=None, end=None):
+        """(effective date, directory) of every partition in [start, end], oldest first"""
+        if not os.path.isdir(self.root):
+            return []
+        partitions = []
+        for name in sorted(os.listdir(self.root)):
+            if not name.startswith('effective_date='):
+                continue
+            try:
+                partition_date = date.fromisoformat(name.split('=', 1)[1])
+            except ValueError:
+                continue
+            if (start is None or partition_date >= start) and (end is None or partition_date <= end):
+                partitions.append((partition_date, os.path.join(self.root, name)))
+        return partitions
+
+    def contains(self, batch, effective_date):
+        return os.path.exists(os.path.join(self._partition(effective_date), f"{batch}.parquet"))
+
+    def append(self, result_df, batch, effective_date):
+        """
+        Add a batch's rows to the archive; returns False if the batch was already archived.
+
+        The file is written under a temporary name and renamed into place, so
+        readers never see a partial batch.
+        """
+        import pandas as pd
+
+        if self.contains(batch, effective_date):
+            return False
+        partition = self._partition(effective_date)
+        os.makedirs(partition, exist_ok=True)
+
+        frame = result_df.copy()
+        frame['Contract No'] = frame['Contract No'].astype(str)
+        frame['Employee Number'] = frame['Employee Number'].astype(str)
+        frame['Batch'] = batch
+        frame['Archived'] = pd.Timestamp(datetime.now())
+        frame['posting_key'] = posting_keys(result_df)
+
+        handle, partial = tempfile.mkstemp(dir=partition, prefix='.map_it_', suffix='.partial')
+        os.close(handle)
+        try:
+            frame.to_parquet(partial, index=False)
+            os.replace(partial, os.path.join(partition, f"{batch}.parquet"))
+        finally:
+            if os.path.exists(partial):
+                os.remove(partial)
+        return True
+
+    def read(self, start=None, end=None, columns=None):
+        """Archived rows with effective dates in [start, end], optionally only some columns"""
+        import pandas as pd
+
+        frames = []
+        for _, partition in self.partitions(start, end):
+            for name in sorted(os.listdir(partition)):
+                if name.endswith('.parquet'):
+                    frames.append(pd.read_parquet(os.path.join(partition, name), columns=columns))
+        if not frames:
+            return pd.DataFrame(columns=columns)
+        return pd.concat(frames, ignore_index=True)
+
+    def duplicates(self, result_df, effective_dates, exclude_batch=None):
+        """
+        Rows of result_df already archived for any of effective_dates, with the earlier 'Batch'.
+
+        exclude_batch leaves out a batch's own rows, so checking a batch
+        after it was archived does not report it against itself.
+        """
+        import pandas as pd
+
+        index = pd.concat(
+            [self.read(effective_date, effective_date, columns=['posting_key', 'Batch'])
+             for effective_date in set(effective_dates)],
+            ignore_index=True
+        )
+        if exclude_batch is not None:
+            index = index[index['Batch'] != exclude_batch]
+        index = index.drop_duplicates('posting_key')
+
+        keys = posting_keys(result_df)
+        found = pd.Index(index['posting_key'].to_numpy(dtype='uint64')).get_indexer(keys)
+        duplicated = found >= 0
+        duplicates = result_df[duplicated].copy()
+        duplicates['Batch'] = index['Batch'].to_numpy()[found[duplicated]]
+        return duplicates
+
+    def totals(self, by='contract', start=None, end=None):
+        """Number of transactions and total amount in cents per contract or transaction type over [start, end]"""
+        column = TOTALS_BY[by]
+        frame = self.read(start, end, columns=[column, 'Amount'])
+        totals = frame.groupby(column, sort=True)['Amount'].agg(['count', 'sum'])
+        return totals.rename(columns={'count': 'Transactions', 'sum': 'Total'}).reset_index()
+
+
+def parse_date(value):
+    return datetime.strptime(value, '%Y-%m-%d').date()
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Query the Map It posting history.")
+    parser.add_argument('--archive', default=ARCHIVE_DIR, help=f"Archive directory (default: {ARCHIVE_DIR})")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    totals = commands.add_parser('totals', help="Transactions and total amount per contract or transaction type")
+    totals.add_argument('--by', choices=sorted(TOTALS_BY), default='contract')
+    totals.add_argument('--start', type=parse_date, help="First effective date (YYYY-MM-DD)")
+    totals.add_argument('--end', type=parse_date, help="Last effective date (YYYY-MM-DD)")
+
+    duplicates = commands.add_parser('duplicates', help="Rows of a converted CSV that were already posted")
+    duplicates.add_argument('csv', help="A `_converted.csv` produced by Map It")
+    duplicates.add_argument('--effective-date', type=parse_date, required=True,
+                            help="Effective date the CSV was converted for (YYYY-MM-DD)")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    try:
+        archive = PostingArchive(args.archive)
+    except ArchiveUnavailable as e:
+        print(e, file=sys.stderr)
+        return 1
+
+    if args.command == 'totals':
+        totals = archive.totals(args.by, args.start, args.end)
+        totals['Total'] = format_cents(totals['Total'].to_numpy())
+        print(totals.to_string(index=False))
+        return 0
+
+    import pandas as pd
+
+    result_df = pd.read_csv(args.csv, dtype={'Contract No': str, 'Employee Number': str, 'Amount': str})
+    result_df['Amount'] = parse_cents(result_df['Amount'])
+    duplicates = archive.duplicates(result_df, [args.effective_date])
+    print(f"{len(duplicates):,} of {len(result_df):,} transactions were already posted")
+    if len(duplicates):
+        duplicates['Amount'] = format_cents(duplicates['Amount'].to_numpy())
+        print(duplicates.to_string(index=False))
+    return 1 if len(duplicates) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,250 @@
+"""
+Command-line batch conversion for Map It.
+
+Converts every workbook matched by the given directories or glob patterns
+across a pool of worker processes and writes one `_converted.csv` per input.
+
+Example:
+    python map_it_batch.py exports/ "archive/2024-*.xlsx" --effective-date 2024-06-30
+"""
+import argparse
+import glob
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import date, datetime
+
+from map_it_archive import ARCHIVE_DIR, ArchiveUnavailable, PostingArchive, batch_id
+from map_it_core import (
+    GROUP_STORE_PATH, NULL_STATS, GroupStore, RunStats, convert_file, convert_file_streaming, convert_sources,
+    converted_filename, errors_filename, plain_report, reconciliation_csv, reconciliation_filename,
+    record_posted_groups, report_filename, report_json, validation_errors, workbook_digest, write_csv
+)
+
+EXCEL_EXTENSIONS = ('.xlsx', '.xls')
+
+
+def find_workbooks(inputs):
+    """Expand directories and glob patterns into a sorted list of workbook paths"""
+    paths = set()
+    for pattern in inputs:
+        if os.path.isdir(pattern):
+            candidates = [os.path.join(pattern, name) for name in os.listdir(pattern)]
+        else:
+            candidates = glob.glob(pattern)
+        for path in candidates:
+            name = os.path.basename(path)
+            # Skip Excel lock files such as "~$report.xlsx"
+            if os.path.isfile(path) and path.lower().endswith(EXCEL_EXTENSIONS) and not name.startswith('~$'):
+                paths.add(os.path.abspath(path))
+    return sorted(paths)
+
+
+def convert_one(path, effective_date, output_dir=None, stream=False, stats=False, all_sheets=False,
+                mapping_version=None, store_path=None, delta=False, archive_dir=None):
+    """
+    Convert a single workbook to CSV and return its report (runs in a worker process).
+
+    With stats, stage timings, counters and each stage's peak memory are
+    collected, the conversion is held to the memory budget, and the report
+    is also written as JSON next to the CSV. With all_sheets, every sheet of the
+    workbook is converted into the one CSV. mapping_version pins the
+    transaction mapping; by default the current mapping file is used.
+    With store_path, contract groups are reused from the GroupStore at that
+    path and the groups written are recorded there as posted, and with
+    delta only groups not posted before are written. With archive_dir, the
+    converted rows are checked against the posting history there and then
+    appended to it; report['already_posted'] counts the rows an earlier
+    batch already contained. A converted workbook also gets its
+    reconciliation report, `_reconciliation.csv`, next to the CSV, and
+    report['reconciliation_output'] holds its path. When rows fail
+    validation, every error is written to an `_errors.csv` next to where the
+    CSV would go and report['errors_output'] holds its path.
+    """
+    started = time.perf_counter()
+    target_dir = output_dir or os.path.dirname(path)
+    output_path = os.path.join(target_dir, converted_filename(path))
+    run_stats = RunStats(memory=True) if stats else None
+
+    if stream:
+        output_path, report = convert_file_streaming(path, effective_date, output_path, stats=run_stats,
+                                                     mapping=mapping_version)
+    else:
+        store = None if store_path is None else GroupStore(store_path)
+        try:
+            if all_sheets:
+                # Already inside a worker process, so the sheets are converted one after another
+                result_df, report = convert_sources([(path, path)], effective_date, all_sheets=True, workers=1,
+                                                    stats=run_stats, mapping=mapping_version, store=store,
+                                                    delta=delta)
+            else:
+                result_df, report = convert_file(path, effective_date, stats=run_stats, mapping=mapping_version,
+                                                 store=store, delta=delta)
+            if result_df is None:
+                output_path = None
+            else:
+                with (run_stats or NULL_STATS).stage('export'):
+                    write_csv(result_df, output_path)
+                # Only groups written to a CSV count as posted for later delta runs
+                record_posted_groups(store, report, effective_date)
+                if archive_dir is not None:
+                    with (run_stats or NULL_STATS).stage('archive'):
+                        _archive_batch(PostingArchive(archive_dir), path, result_df, report, effective_date)
+                if run_stats:
+                    report['stats'] = run_stats.as_dict()
+        finally:
+            if store is not None:
+                store.close()
+
+    table = validation_errors(report)
+    # The table is written here rather than sent back to the parent process
+    report = plain_report(report)
+    if table is not None:
+        report['errors_output'] = os.path.join(target_dir, errors_filename(path))
+        table.to_csv(report['errors_output'], index=False)
+
+    if output_path is not None:
+        report['reconciliation_output'] = os.path.join(target_dir, reconciliation_filename(path))
+        with open(report['reconciliation_output'], 'wb') as handle:
+            handle.write(reconciliation_csv(report['reconciliation']))
+
+    report['source'] = path
+    report['output'] = output_path
+
+    report['seconds'] = time.perf_counter() - started
+    if stats:
+        with open(os.path.join(target_dir, report_filename(path)), 'wb') as handle:
+            handle.write(report_json(report))
+    return report
+
+
+def _archive_batch(archive, path, result_df, report, effective_date):
+    """Count the rows already in the posting history, then append the batch to it"""
+    if 'digest' not in report:
+        with open(path, 'rb') as handle:
+            report['digest'] = workbook_digest(handle)
+    batch = batch_id(report, effective_date)
+    report['already_posted'] = len(archive.duplicates(result_df, [effective_date], exclude_batch=batch))
+    archive.append(result_df, batch, effective_date)
+
+
+def run_batch(paths, effective_date, output_dir=None, workers=None, stream=False, stats=False, all_sheets=False,
+              mapping_version=None, store_path=None, delta=False, archive_dir=None):
+    """Convert workbooks across a process pool, yielding reports as they complete"""
+    if output_dir:
+        os.makedirs(output_dir, exist_ok=True)
+
+    with ProcessPoolExecutor(max_workers=workers or os.cpu_count()) as executor:
+        futures = {executor.submit(convert_one, path, effective_date, output_dir, stream, stats, all_sheets,
+                                   mapping_version, store_path, delta, archive_dir): path for path in paths}
+        for future in as_completed(futures):
+            try:
+                yield future.result()
+            except Exception as e:
+                # A crashed worker should not take the rest of the batch down
+                report = {'source': futures[future], 'output': None, 'rows': 0,
+                          'transactions': 0, 'seconds': 0.0, 'error': f"Worker failed: {e}"}
+                yield report
+
+
+def print_summary(reports, elapsed):
+    """Print a throughput summary for a finished batch"""
+    converted = [report for report in reports if not report['error']]
+    failed = [report for report in reports if report['error']]
+    rows = sum(report['rows'] for report in reports)
+    transactions = sum(report['transactions'] for report in converted)
+    cache_hits = sum(report.get('comment_cache', {}).get('hits', 0) for report in reports)
+    cache_misses = sum(report.get('comment_cache', {}).get('misses', 0) for report in reports)
+
+    print()
+    print(f"Files:        {len(reports)} ({len(converted)} converted, {len(failed)} failed)")
+    print(f"Rows read:    {rows:,}")
+    print(f"Transactions: {transactions:,}")
+    print(f"Elapsed:      {elapsed:.2f}s")
+    if elapsed > 0:
+        print(f"Throughput:   {len(reports) / elapsed:.2f} files/s, {rows / elapsed:,.0f} rows/s")
+    if cache_hits + cache_misses:
+        print(f"Comment templates: {cache_hits:,} hits, {cache_misses:,} misses "
+              f"({cache_hits / (cache_hits + cache_misses):.0%} reused)")
+
+    for report in failed:
+        first_line = report['error'].strip().splitlines()[0]
+        print(f"FAILED {report['source']}: {first_line}")
+        if report.get('errors_output'):
+            print(f"       Every validation error is listed in {report['errors_output']}")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Convert Excel workbooks into CreditEase CSV files.")
+    parser.add_argument('inputs', nargs='+', help="Directories or glob patterns of .xlsx/.xls workbooks")
+    parser.add_argument('--effective-date', type=date.fromisoformat, default=datetime.now().date(),
+                        help="Value/Effective date for all transactions (YYYY-MM-DD, default: today)")
+    parser.add_argument('--output-dir', help="Where to write the CSV files (default: next to each input)")
+    parser.add_argument('--workers', type=int, default=None,
+                        help="Number of worker processes (default: one per CPU core)")
+    parser.add_argument('--stream', action='store_true',
+                        help="Stream .xlsx rows straight to CSV with bounded memory, for very large workbooks")
+    parser.add_argument('--stats', action='store_true',
+                        help="Time each stage, track its peak memory against MAP_IT_MEMORY_BUDGET_MB and write a "
+                             "`_report.json` run report next to each CSV")
+    parser.add_argument('--all-sheets', action='store_true',
+                        help="Convert every sheet of each workbook instead of only the first one")
+    parser.add_argument('--mapping-version',
+                        help="Convert with this transaction mapping version from the mappings directory "
+                             "(default: the current mapping file)")
+    parser.add_argument('--incremental', action='store_true',
+                        help="Reuse contract groups converted before from the fingerprint store "
+                             f"(default: {GROUP_STORE_PATH}, see --store)")
+    parser.add_argument('--delta', action='store_true',
+                        help="Only write contract groups not already posted (written or downloaded) for the same "
+                             "effective date; implies --incremental")
+    parser.add_argument('--store', default=GROUP_STORE_PATH, help="Path of the contract group fingerprint store")
+    parser.add_argument('--archive', nargs='?', const=ARCHIVE_DIR, metavar='DIR',
+                        help="Check each batch against the posting history and append it "
+                             f"(default directory: {ARCHIVE_DIR}); needs pyarrow")
+    args = parser.parse_args(argv)
+    if args.stream and args.all_sheets:
+        parser.error("--stream reads only the first sheet and cannot be combined with --all-sheets")
+    if args.stream and (args.incremental or args.delta or args.archive):
+        parser.error("--stream cannot be combined with --incremental, --delta or --archive")
+    if args.archive:
+        try:
+            PostingArchive(args.archive)
+        except ArchiveUnavailable as e:
+            parser.error(str(e))
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    paths = find_workbooks(args.inputs)
+    if not paths:
+        print("No .xlsx or .xls workbooks found.", file=sys.stderr)
+        return 1
+
+    started = time.perf_counter()
+    reports = []
+    store_path = args.store if args.incremental or args.delta else None
+    for report in run_batch(paths, args.effective_date, args.output_dir, args.workers, args.stream, args.stats,
+                            args.all_sheets, args.mapping_version, store_path, args.delta, args.archive):
+        status = f"{report['transactions']:,} transactions" if not report['error'] else "failed"
+        if report.get('already_posted'):
+            status += f", {report['already_posted']:,} already posted"
+        control = (report.get('reconciliation') or {}).get('control')
+        if not report['error'] and control and control['mismatched']:
+            status += f", {len(control['mismatched']):,} contracts off their control total"
+        if (report.get('memory_plan') or {}).get('path') == 'low_memory':
+            status += ", read row by row to fit the memory budget"
+        memory = (report.get('stats') or {}).get('memory')
+        if memory:
+            status += f", peak {memory['peak_bytes'] / 2**20:,.0f} MB"
+        print(f"{os.path.basename(report['source'])}: {status} ({report['seconds']:.2f}s)")
+        reports.append(report)
+
+    print_summary(reports, time.perf_counter() - started)
+    return 1 if any(report['error'] for report in reports) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,3023 @@
+"""
+Headless conversion core for Map It.
+
+Turns an Excel workbook into CreditEase financial transaction rows without
+any Streamlit dependency, so conversions can run from the app, the batch
+command line or a worker process.
+
+Importing the module only loads the standard library. numpy and pandas are
+imported by the functions that work on frames, the Excel engines (openpyxl
+for .xlsx, xlrd for .xls) when a workbook of that type is read, and the
+bundled mapping is compiled the first time it is used.
+"""
+import csv
+import hashlib
+import importlib.util
+import json
+import os
+import re
+import shutil
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+import unicodedata
+from array import array
+from collections import OrderedDict
+from contextlib import contextmanager, nullcontext
+from datetime import datetime
+from io import BytesIO, StringIO
+from itertools import chain, islice
+
+# Invisible characters commonly found in Excel, replaced by a space during cleaning
+INVISIBLE_CHARS = [
+    '\u00a0',  # Non-breaking space
+    '\u1680',  # Ogham space mark
+    '\u2000', '\u2001', '\u2002', '\u2003', '\u2004', '\u2005',  # En quad, Em quad, etc.
+    '\u2006', '\u2007', '\u2008', '\u2009', '\u200a',  # Six-per-em space, etc.
+    '\u200b', '\u200c', '\u200d', '\u200e', '\u200f',  # Zero-width spaces and marks
+    '\u2028', '\u2029',  # Line separator, paragraph separator
+    '\u202a', '\u202b', '\u202c', '\u202d', '\u202e',  # Bidirectional text control
+    '\u202f',  # Narrow no-break space
+    '\u205f',  # Medium mathematical space
+    '\u2060',  # Word joiner
+    '\u3000',  # Ideographic space
+    '\ufeff',  # Zero-width no-break space (BOM)
+    '\u180e',  # Mongolian vowel separator
+    '\u061c',  # Arabic letter mark
+    '\u2066', '\u2067', '\u2068', '\u2069',  # Directional isolates
+]
+
+# Byte Order Mark characters are dropped before unicode normalisation
+_BOM_TABLE = {ord('\ufeff'): None, ord('\ufffe'): None}
+
+# ASCII control characters (except \n, \t, \r) are dropped, everything else is kept
+_ASCII_CLEAN_TABLE = {
+    code: None for code in list(range(0x20)) + [0x7f] if chr(code) not in '\n\t\r'
+}
+
+_WHITESPACE_RE = re.compile(r'\s+')
+
+
+class _CleanTable(dict):
+    """
+    str.translate table for the unicode cleaning path.
+
+    Invisible characters become a space and control characters (unicode
+    category C, except \n, \t, \r) are dropped. Entries are filled in lazily
+    the first time a character is seen, so the table covers every code point
+    without precomputing all of them.
+    """
+
+    def __missing__(self, code):
+        char = chr(code)
+        if char in INVISIBLE_CHARS:
+            result = ord(' ')
+        elif unicodedata.category(char)[0] == 'C' and char not in '\n\t\r':
+            result = None
+        else:
+            result = code
+        self[code] = result
+        return result
+
+
+_UNICODE_CLEAN_TABLE = _CleanTable()
+
+
+def _cell_text(value):
+    """Convert a non-missing cell value to text, printing integral floats without '.0'"""
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+
+def _clean_text(text):
+    """Clean a single string, skipping the unicode work for pure ASCII text"""
+    if text.isascii():
+        text = text.translate(_ASCII_CLEAN_TABLE)
+    else:
+        text = unicodedata.normalize('NFKD', text.translate(_BOM_TABLE))
+        text = text.translate(_UNICODE_CLEAN_TABLE)
+
+    # Line breaks and all other whitespace runs collapse to a single space
+    return _WHITESPACE_RE.sub(' ', text).strip()
+
+
+def _is_missing(value):
+    """pd.isna for a single cell value, without importing pandas for plain Python values"""
+    if value is None:
+        return True
+    if type(value) is str:
+        return False
+    if isinstance(value, float):
+        return value != value
+    # Any other missing marker (NaT, pd.NA, numpy scalars) comes from an already imported pandas or numpy
+    pandas = sys.modules.get('pandas')
+    return pandas is not None and bool(pandas.isna(value))
+
+
+def clean_cell_value(value):
+    """
+    Comprehensive cleaning function to handle invisible characters and formatting issues
+    """
+    if _is_missing(value):
+        return ""
+
+    return _clean_text(_cell_text(value))
+
+
+def clean_series(series):
+    """
+    Column-wise equivalent of series.apply(clean_cell_value)
+
+    Pure ASCII cells are cleaned with pandas string operations over the whole
+    column; only cells containing non-ASCII characters go through the unicode
+    normalisation path.
+    """
+    import numpy as np
+    import pandas as pd
+
+    missing = series.isna().to_numpy()
+    texts = [
+        "" if is_missing else value if type(value) is str else _cell_text(value)
+        for value, is_missing in zip(series.to_numpy(dtype=object), missing)
+    ]
+    texts = pd.Series(texts, index=series.index, dtype=object)
+
+    is_ascii = np.fromiter(map(str.isascii, texts), dtype=bool, count=len(texts))
+    cleaned = texts.copy()
+    if is_ascii.any():
+        cleaned[is_ascii] = (
+            texts[is_ascii]
+            .str.translate(_ASCII_CLEAN_TABLE)
+            .str.replace(_WHITESPACE_RE, ' ', regex=True)
+            .str.strip()
+        )
+    if not is_ascii.all():
+        cleaned[~is_ascii] = texts[~is_ascii].map(_clean_text)
+
+    return cleaned
+
+
+def normalize_column_name(col_name):
+    """
+    Normalize column names for better matching
+    """
+    if _is_missing(col_name):
+        return ""
+
+    # Clean the column name first
+    clean_name = clean_cell_value(col_name)
+
+    # Convert to lowercase and remove extra characters
+    normalized = re.sub(r'[^\w\s]', ' ', clean_name.lower())
+    normalized = re.sub(r'\s+', ' ', normalized).strip()
+
+    return normalized
+
+
+def _name_variations(normalized):
+    """Spellings of a normalised column name tried when matching: as is, without spaces, with underscores, alphanumeric"""
+    return [
+        normalized,
+        normalized.replace(' ', ''),  # No spaces
+        normalized.replace(' ', '_'),  # Underscores
+        re.sub(r'[^\w]', '', normalized),  # Alphanumeric only
+    ]
+
+
+class ColumnIndex:
+    """
+    Normalised header names of a sheet, built once and matched against many candidate names.
+
+    Every header is split at '|', normalised and expanded into its spelling
+    variations a single time, so resolving all the column roles costs one
+    pass over the headers per candidate name instead of rebuilding them for
+    each role.
+    """
+
+    def __init__(self, columns):
+        self.columns = list(columns)
+        self._variations = {}
+        for col in self.columns:
+            original_col = str(col)
+            # Split at pipe and take first part if pipe exists
+            base_col = original_col.split('|')[0].strip()
+            for variation in _name_variations(normalize_column_name(base_col)):
+                if variation:  # Only add non-empty variations
+                    self._variations[variation] = original_col
+
+    def find(self, possible_names):
+        """
+        Return (column, confidence) for the first of possible_names found, or (None, 0.0).
+
+        The column is chosen by trying each name in turn: exact matches of its
+        spelling variations, then substring matches, then a shared word.
+        confidence is the best score any of possible_names reaches on that
+        column: 1.0 for an exact match, 0.5-0.9 for a substring match
+        depending on how much of the longer name the shorter one covers, and
+        0.4 for a shared word.
+        """
+        for target_name in possible_names:
+            column = self._match(normalize_column_name(target_name))
+            if column is not None:
+                return column, max(self._score(normalize_column_name(name), column) for name in possible_names)
+        return None, 0.0
+
+    def _match(self, target_normalized):
+        """Column matching one normalised target name, or None"""
+        target_variations = _name_variations(target_normalized)
+
+        # Try exact matches first
+        for target_var in target_variations:
+            if target_var in self._variations:
+                return self._variations[target_var]
+
+        # Try partial matches
+        for target_var in target_variations:
+            for cleaned_col, original_col in self._variations.items():
+                if target_var and cleaned_col and (target_var in cleaned_col or cleaned_col in target_var):
+                    return original_col
+
+        # Try word-by-word matching for multi-word columns
+        target_words = [word for word in target_normalized.split() if len(word) > 2]
+        if target_words:
+            for cleaned_col, original_col in self._variations.items():
+                col_words = cleaned_col.split()
+                if any(word in col_words for word in target_words):
+                    return original_col
+
+        return None
+
+    def _score(self, target_normalized, column):
+        """How well one normalised target name matches a column's variations (0-1)"""
+        col_variations = [variation for variation, original_col in self._variations.items() if original_col == column]
+        score = 0.0
+        for target_var in _name_variations(target_normalized):
+            for cleaned_col in col_variations:
+                if target_var == cleaned_col:
+                    return 1.0
+                if target_var and (target_var in cleaned_col or cleaned_col in target_var):
+                    shorter, longer = sorted((len(target_var), len(cleaned_col)))
+                    score = max(score, 0.5 + 0.4 * shorter / longer)
+        target_words = [word for word in target_normalized.split() if len(word) > 2]
+        if any(word in cleaned_col.split() for word in target_words for cleaned_col in col_variations):
+            score = max(score, 0.4)
+        return score
+
+    def find_exact(self, possible_names):
+        """The column whose name matches one of possible_names exactly (in any spelling variation), or None"""
+        for target_name in possible_names:
+            for target_var in _name_variations(normalize_column_name(target_name)):
+                if target_var and target_var in self._variations:
+                    return self._variations[target_var]
+        return None
+
+    def resolve(self, role_names=None):
+        """(columns, confidence) dicts for every role of role_names (ROLE_NAMES by default) that matched"""
+        columns = {}
+        confidence = {}
+        for role, possible_names in (role_names or ROLE_NAMES).items():
+            column, score = self.find(possible_names)
+            if column is not None:
+                columns[role] = column
+                confidence[role] = score
+        return columns, confidence
+
+
+def enhanced_column_finder(df, possible_names):
+    """
+    Enhanced column finder with comprehensive cleaning and matching
+    """
+    return ColumnIndex(df.columns).find(possible_names)[0]
+
+
+def extract_amount(comment_part):
+    """Extract amount from a comment part that might contain an amount"""
+    if not isinstance(comment_part, str):
+        return 0.0
+
+    # First look for explicit currency format ($25.97 or $1,000.00)
+    currency_match = re.search(r'\$?\s*([\d,]+(?:\.\d{1,2})?)', comment_part)
+    if currency_match:
+        amount_str = currency_match.group(1).replace(',', '')
+        try:
+            return float(amount_str)
+        except ValueError:
+            pass
+
+    # Then look for general numbers that might be amounts (25.97 or 1,000.00)
+    number_match = re.search(r'([\d,]+(?:\.\d{1,2})?)', comment_part)
+    if number_match:
+        amount_str = number_match.group(1).replace(',', '')
+        try:
+            return float(amount_str)
+        except ValueError:
+            pass
+
+    return 0.0
+
+
+def to_cents(amount):
+    """A dollar amount as integer cents"""
+    return int(round(amount * 100))
+
+
+# An amount as written in text: digits with optional thousands separators and cents
+_AMOUNT_TEXT_RE = r'^\s*\$?\s*(-?)([\d,]+)(?:\.(\d{1,2}))?\s*$'
+
+
+def parse_cents(texts):
+    """
+    Parse a Series of amount texts ("25", "25.0", "$1,000.50") into int64 cents.
+
+    Works on the whole column with vectorised string extraction; texts that
+    are not amounts become 0.
+    """
+    import numpy as np
+    import pandas as pd
+
+    parts = texts.astype(str).str.extract(_AMOUNT_TEXT_RE)
+    whole = pd.to_numeric(parts[1].str.replace(',', '', regex=False), errors='coerce').fillna(0).astype(np.int64)
+    fraction = parts[2].fillna('0').str.ljust(2, '0').astype(np.int64)
+    cents = whole * 100 + fraction
+    return cents.where(parts[0] != '-', -cents).to_numpy(dtype=np.int64)
+
+
+def text_cents(text):
+    """Parse one amount text into int cents like parse_cents, or None when it is not an amount"""
+    match = _AMOUNT_TEXT_MATCH(text)
+    if match is None:
+        return None
+    sign, whole, fraction = match.groups()
+    cents = int(whole.replace(',', '') or 0) * 100 + int((fraction or '0').ljust(2, '0'))
+    return -cents if sign else cents
+
+
+_AMOUNT_TEXT_MATCH = re.compile(_AMOUNT_TEXT_RE).match
+
+
+def format_cents(cents):
+    """
+    Format integer cents the way the Amount column has always been written.
+
+    Matches repr() of the amount as a float ("25.0", "25.5", "25.97") for
+    amounts below 2**53 cents, without going through floats. Works on a
+    whole array at once and returns an array of strings.
+    """
+    import numpy as np
+
+    cents = np.asarray(cents, dtype=np.int64)
+    if not cents.size:
+        # np.char.zfill cannot size its output for an empty array
+        return cents.astype(str)
+    whole, fraction = np.divmod(np.abs(cents), 100)
+    fraction_text = np.where(fraction % 10 == 0, (fraction // 10).astype(str), np.char.zfill(fraction.astype(str), 2))
+    text = np.char.add(np.char.add(whole.astype(str), '.'), fraction_text)
+    return np.where(cents < 0, np.char.add('-', text), text)
+
+
+def format_money(cents):
+    """A cents total as a dollar figure with thousands separators, e.g. $1,234.50"""
+    whole, fraction = divmod(abs(int(cents)), 100)
+    return f"${'-' if cents < 0 else ''}{whole:,}.{fraction:02d}"
+
+
+def clean_comment(comment_part):
+    """Remove amount information from comment part while preserving key phrases"""
+    # First remove dollar amounts
+    cleaned = re.sub(r'\$[\d,]+\.?\d*', '', comment_part)
+    # Then remove standalone numbers
+    cleaned = re.sub(r'(^|\s)\d[\d,]*\.?\d*\b', ' ', cleaned)
+    # Clean but preserve important hyphenated terms
+    cleaned = re.sub(r'[^\w\s-]', ' ', cleaned.lower())
+    cleaned = re.sub(r'\s+', ' ', cleaned).strip()
+    return cleaned
+
+
+class LRUCache:
+    """
+    Thread-safe least-recently-used cache with hit, miss and eviction counters.
+
+    Entries are evicted oldest-first once there are more than max_entries of
+    them or, when max_bytes is set, once the sizes passed to put() add up to
+    more than max_bytes.
+    """
+
+    def __init__(self, max_entries=128, max_bytes=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def get(self, key, default=None):
+        """Return the cached value for key, marking it as most recently used"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, value, size=0):
+        """Store value under key, evicting least recently used entries as needed"""
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._bytes -= previous[1]
+            self._entries[key] = (value, size)
+            self._bytes += size
+
+            while self._entries and (
+                len(self._entries) > self.max_entries
+                or (self.max_bytes is not None and self._bytes > self.max_bytes)
+            ):
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self._bytes -= evicted_size
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        """Counters and current size of the cache"""
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'entries': len(self._entries),
+            'bytes': self._bytes,
+        }
+
+
+# Minimum trigram similarity (0-1) for a fuzzy match; mapping files can override it
+FUZZY_THRESHOLD = float(os.environ.get('MAP_IT_FUZZY_THRESHOLD', 0.6))
+
+
+def _trigrams(text):
+    """Character trigrams of each word, padded like pg_trgm ("  fee " -> '  f', ' fe', 'fee', 'ee ')"""
+    grams = set()
+    for word in text.split():
+        padded = f"  {word} "
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+
+class DescriptionMatcher:
+    """
+    Precompiled lookup over a description mapping.
+
+    Matches a normalised part in three tiers, the first mapping key (in dict
+    order) winning within the first two. Mapping keys are normalised once at
+    build time:
+
+    - exact matches use a hash table of normalised keys
+    - "key in part" substring matches use an Aho-Corasick automaton
+    - "part in key" substring matches use a table of every key substring
+    - otherwise the key with the highest trigram similarity (Dice
+      coefficient) is used, found through an inverted trigram index, as long
+      as it reaches fuzzy_threshold; ties go to the earlier key
+    """
+
+    def __init__(self, mapping, fuzzy_threshold=FUZZY_THRESHOLD):
+        self.descriptions = list(mapping.values())
+        self.norm_keys = [normalize_column_name(key) for key in mapping]
+        self.fuzzy_threshold = fuzzy_threshold
+
+        self._exact = {}
+        self._key_substrings = {}
+        self._trigram_index = {}
+        self._trigram_counts = {}
+        for rank, norm_key in enumerate(self.norm_keys):
+            self._exact.setdefault(norm_key, rank)
+            for start in range(len(norm_key) + 1):
+                for end in range(start, len(norm_key) + 1):
+                    self._key_substrings.setdefault(norm_key[start:end], rank)
+            if self._exact[norm_key] == rank:
+                grams = _trigrams(norm_key)
+                self._trigram_counts[rank] = len(grams)
+                for gram in grams:
+                    self._trigram_index.setdefault(gram, []).append(rank)
+
+        self._build_automaton()
+
+    def _build_automaton(self):
+        """Build the Aho-Corasick automaton over the normalised keys"""
+        # Each node keeps its transitions, failure link and the lowest key
+        # rank ending at this node or any of its suffixes.
+        self._goto = [{}]
+        self._fail = [0]
+        self._out = [None]
+
+        for rank, norm_key in enumerate(self.norm_keys):
+            node = 0
+            for char in norm_key:
+                next_node = self._goto[node].get(char)
+                if next_node is None:
+                    next_node = len(self._goto)
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._out.append(None)
+                    self._goto[node][char] = next_node
+                node = next_node
+            if self._out[node] is None or rank < self._out[node]:
+                self._out[node] = rank
+
+        queue = list(self._goto[0].values())
+        for node in queue:
+            for char, child in self._goto[node].items():
+                fallback = self._fail[node]
+                while fallback and char not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                self._fail[child] = self._goto[fallback].get(char, 0)
+                inherited = self._out[self._fail[child]]
+                if inherited is not None and (self._out[child] is None or inherited < self._out[child]):
+                    self._out[child] = inherited
+                queue.append(child)
+
+    def _first_key_in(self, text):
+        """Lowest rank of a key occurring as a substring of text"""
+        best = self._out[0]
+        node = 0
+        for char in text:
+            while node and char not in self._goto[node]:
+                node = self._fail[node]
+            node = self._goto[node].get(char, 0)
+            rank = self._out[node]
+            if rank is not None and (best is None or rank < best):
+                best = rank
+        return best
+
+    def match_rank(self, cleaned):
+        """Return the rank of the mapping entry matching a normalised part, or None"""
+        rank = self._exact.get(cleaned)
+        if rank is not None:
+            return rank
+
+        rank = self._first_key_in(cleaned)
+        containing = self._key_substrings.get(cleaned)
+        if containing is not None and (rank is None or containing < rank):
+            rank = containing
+        if rank is not None:
+            return rank
+
+        rank, score = self.fuzzy_rank(cleaned)
+        return rank if score >= self.fuzzy_threshold else None
+
+    def fuzzy_rank(self, cleaned):
+        """(rank, score) of the key most similar to a normalised part, or (None, 0.0)"""
+        grams = _trigrams(cleaned)
+        shared = {}
+        for gram in grams:
+            for rank in self._trigram_index.get(gram, ()):
+                shared[rank] = shared.get(rank, 0) + 1
+
+        best_rank = None
+        best_score = 0.0
+        for rank in sorted(shared):
+            score = 2 * shared[rank] / (len(grams) + self._trigram_counts[rank])
+            if score > best_score:
+                best_rank, best_score = rank, score
+        return best_rank, best_score
+
+    def match(self, cleaned):
+        """Return the mapped description for a normalised part, or None"""
+        rank = self.match_rank(cleaned)
+        return None if rank is None else self.descriptions[rank]
+
+
+def normalize_comment(comment):
+    """Clean a comment and normalise its commas, spacing and punctuation before splitting"""
+    # Clean the comment first
+    comment = clean_cell_value(comment)
+
+    # Normalize the comment - more aggressive cleaning
+    comment = re.sub(r'\s*,\s*', ', ', comment)  # Normalize commas
+    comment = re.sub(r'(\$)\s*(\d)', r'\1\2', comment)  # Fix $ spacing
+    comment = re.sub(r'[^\w\s\-,]', ' ', comment.lower())  # Remove special chars except hyphens
+    comment = re.sub(r'\s+', ' ', comment).strip()  # Normalize whitespace
+    return comment
+
+
+def split_comment(comment):
+    """Split a normalised comment into its non-empty comma-separated parts"""
+    parts = [part.strip() for part in re.split(r',(?![^()]*\))', comment)]
+    return [part for part in parts if part]
+
+
+def match_part(part, matcher=None):
+    """Map one comment part to its description, ignoring the amount in it"""
+    # Clean the part for matching
+    cleaned = clean_comment(part).lower()
+    cleaned = normalize_column_name(cleaned)
+    return (matcher or _default_mapping().matcher).match(cleaned)
+
+
+def process_comment_regex(comment, matcher=None):
+    """
+    Reference implementation of process_comment built from the regex chain.
+
+    Kept so the single-pass tokenizer can be checked against it; see
+    benchmarks/bench_comment_lexer.py.
+    """
+    if not isinstance(comment, str):
+        return []
+    transactions = []
+    for part in split_comment(normalize_comment(comment)):
+        description = match_part(part, matcher)
+        if description is not None:
+            transactions.append({'description': description, 'cents': to_cents(extract_amount(part))})
+    return transactions
+
+
+# One token of the comment grammar: a comma ending a part, a number standing on
+# its own (an amount, dropped from the phrase), or a word of letters, digits,
+# underscores and hyphens. Everything else ($, '.', spaces, punctuation) only
+# separates tokens.
+_COMMENT_TOKEN_RE = re.compile(r'(,)|(\d+)(?!\w)|([\w-]+)')
+_DIGITS_RE = re.compile(r'\d+')
+
+
+def _phrase(words):
+    """The description-matching text of a part's words, as match_part would clean it"""
+    text = ' '.join(words)
+    if not text.isascii():
+        return normalize_column_name(text.lower())
+    if '-' in text:
+        return ' '.join(text.replace('-', ' ').split())
+    return text
+
+
+def tokenize_comment(comment):
+    """
+    Split a comment into one (phrase, cents) pair per comma-separated part, in a single scan.
+
+    The phrase is the part's text with amounts removed, normalised for
+    DescriptionMatcher; cents is the first number in the part as integer
+    cents, or 0. "$1,000.50" reads as the numbers 1, 000 and 50, as it
+    always has. Equivalent to split_comment, match_part's cleaning and
+    extract_amount.
+    """
+    pairs = []
+    words = []
+    amount = None
+    has_tokens = False
+    for comma, number, word in _COMMENT_TOKEN_RE.findall(clean_cell_value(comment).lower()):
+        if comma:
+            if has_tokens:
+                pairs.append((_phrase(words), 0 if amount is None else int(amount) * 100))
+                words = []
+                amount = None
+                has_tokens = False
+            continue
+
+        has_tokens = True
+        if number:
+            if amount is None:
+                amount = number
+        else:
+            words.append(word)
+            if amount is None and not word.isalpha():
+                digits = _DIGITS_RE.search(word)
+                if digits:
+                    amount = digits.group()
+
+    if has_tokens:
+        pairs.append((_phrase(words), 0 if amount is None else int(amount) * 100))
+    return pairs
+
+
+class CommentParser:
+    """
+    Memoizing comment parser.
+
+    Comments are split into (phrase, cents) pairs by tokenize_comment.
+    Comments that differ only in their amounts ("monthly interest 25, service
+    fee 5" and "monthly interest 30, service fee 7") have the same phrases,
+    so the descriptions matched for them are cached per tuple of phrases in
+    an LRU cache and only the amounts change between hits.
+    """
+
+    def __init__(self, matcher, max_templates=4096):
+        self.matcher = matcher
+        self.cache = LRUCache(max_entries=max_templates)
+        self.parts = 0
+        self.unmatched = 0
+
+    def parse(self, comment):
+        """Process a comment string into individual transactions"""
+        if not isinstance(comment, str):
+            return []
+
+        pairs = tokenize_comment(comment)
+        key = tuple(phrase for phrase, _ in pairs)
+        descriptions = self.cache.get(key)
+        if descriptions is None:
+            descriptions = tuple(self.matcher.match(phrase) for phrase in key)
+            self.cache.put(key, descriptions)
+        self.parts += len(pairs)
+        self.unmatched += descriptions.count(None)
+
+        return [
+            {'description': description, 'cents': cents}
+            for (_, cents), description in zip(pairs, descriptions)
+            if description is not None
+        ]
+
+    def stats(self):
+        """Template cache counters plus the number of parts parsed and left unmatched"""
+        return dict(self.cache.stats(), parts=self.parts, unmatched=self.unmatched)
+
+
+COMMENT_CACHE_SIZE = int(os.environ.get('MAP_IT_COMMENT_CACHE_SIZE', 4096))
+
+# Directory of transaction-type mapping files; CURRENT_MAPPING_FILE is the one in use
+MAPPING_DIR = os.environ.get('MAP_IT_MAPPING_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'mappings'))
+CURRENT_MAPPING_FILE = 'transaction_types.json'
+
+
+class MappingError(ValueError):
+    """A mapping file is missing, malformed, or the requested version does not exist"""
+
+
+class TransactionMapping:
+    """
+    A transaction-type mapping file compiled for lookups.
+
+    The file is JSON with a 'version', an optional 'default_code' (GEN if
+    omitted), 'transaction_types' mapping each description to its CreditEase
+    code, and 'phrases' mapping comment phrases to descriptions. Phrases are
+    listed in priority order: when a comment part matches several, the
+    earliest wins. An optional 'fuzzy_threshold' overrides FUZZY_THRESHOLD.
+    The file is validated when it is loaded; the DescriptionMatcher and a
+    CommentParser with its own template cache are built the first time a
+    comment is parsed, so mappings only listed for their version are never
+    compiled.
+    """
+
+    def __init__(self, data, source=None, digest=None):
+        if not isinstance(data, dict):
+            raise MappingError("the mapping must be a JSON object")
+        missing = [key for key in ('version', 'transaction_types', 'phrases') if key not in data]
+        if missing:
+            raise MappingError(f"missing {', '.join(missing)}")
+
+        self.version = str(data['version'])
+        self.default_code = data.get('default_code', 'GEN')
+        self.codes = dict(data['transaction_types'])
+        self.phrases = dict(data['phrases'])
+        unknown = sorted(set(self.phrases.values()) - set(self.codes))
+        if unknown:
+            raise MappingError(f"phrases map to descriptions without a transaction type: {', '.join(unknown)}")
+        self.fuzzy_threshold = data.get('fuzzy_threshold', FUZZY_THRESHOLD)
+        if not isinstance(self.fuzzy_threshold, (int, float)) or not 0 <= self.fuzzy_threshold <= 1:
+            raise MappingError("fuzzy_threshold must be a number between 0 and 1")
+
+        self.source = source
+        self.digest = digest
+        self._matcher = None
+        self._parser = None
+        self._compile_lock = threading.Lock()
+
+    @property
+    def matcher(self):
+        if self._matcher is None:
+            with self._compile_lock:
+                if self._matcher is None:
+                    self._matcher = DescriptionMatcher(self.phrases, fuzzy_threshold=self.fuzzy_threshold)
+        return self._matcher
+
+    @property
+    def parser(self):
+        if self._parser is None:
+            matcher = self.matcher
+            with self._compile_lock:
+                if self._parser is None:
+                    self._parser = CommentParser(matcher, max_templates=COMMENT_CACHE_SIZE)
+        return self._parser
+
+    @classmethod
+    def from_file(cls, path):
+        try:
+            with open(path, 'rb') as handle:
+                raw = handle.read()
+            data = json.loads(raw)
+        except (OSError, ValueError) as e:
+            raise MappingError(f"cannot read {path}: {e}")
+        try:
+            return cls(data, source=os.path.abspath(path), digest=hashlib.sha256(raw).hexdigest())
+        except MappingError as e:
+            raise MappingError(f"{path}: {e}")
+
+    def transaction_type(self, description):
+        """CreditEase transaction type for a description"""
+        return self.codes.get(description, self.default_code)
+
+    def describe(self):
+        """Version, file and content hash, recorded in conversion reports"""
+        return {'version': self.version, 'source': self.source, 'digest': self.digest}
+
+
+class MappingRegistry:
+    """
+    Compiled mapping files of a directory, shared by every conversion in the process.
+
+    get() returns the current file (CURRENT_MAPPING_FILE), recompiled when
+    its modification time or size changes, so edits take effect on the next
+    conversion without a restart. get(version) pins a conversion to the file
+    in the directory whose 'version' matches, e.g. an archived copy, so a
+    batch can be reproduced after the current mapping has moved on.
+    """
+
+    def __init__(self, directory=MAPPING_DIR, current=CURRENT_MAPPING_FILE):
+        self.directory = directory
+        self.current = current
+        self._compiled = {}
+        self._lock = threading.Lock()
+
+    def load(self, path):
+        """Compiled mapping for a file, recompiled only if it changed on disk"""
+        try:
+            stat = os.stat(path)
+        except OSError as e:
+            raise MappingError(f"cannot read {path}: {e.strerror}")
+        signature = (stat.st_mtime_ns, stat.st_size)
+        with self._lock:
+            entry = self._compiled.get(path)
+            if entry is None or entry[0] != signature:
+                entry = (signature, TransactionMapping.from_file(path))
+                self._compiled[path] = entry
+            return entry[1]
+
+    def paths(self):
+        """Every mapping file in the directory, current file first"""
+        current = os.path.join(self.directory, self.current)
+        others = sorted(
+            os.path.join(self.directory, name) for name in os.listdir(self.directory)
+            if name.endswith('.json') and name != self.current
+        )
+        return [current] + others
+
+    def _readable(self):
+        """(mappings, errors) for every file in the directory, skipping files that fail to load"""
+        mappings = []
+        errors = []
+        for path in self.paths():
+            try:
+                mappings.append(self.load(path))
+            except MappingError as e:
+                errors.append(str(e))
+        return mappings, errors
+
+    def versions(self):
+        """Versions available for pinning, current first"""
+        return list(dict.fromkeys(mapping.version for mapping in self._readable()[0]))
+
+    def get(self, version=None):
+        """The current mapping, or the one with the given version"""
+        if version is None:
+            return self.load(os.path.join(self.directory, self.current))
+        mappings, errors = self._readable()
+        for mapping in mappings:
+            if mapping.version == str(version):
+                return mapping
+        message = f"mapping version {version} not found in {self.directory}"
+        if errors:
+            message += " (unreadable: " + "; ".join(errors) + ")"
+        raise MappingError(message)
+
+
+MAPPINGS = MappingRegistry()
+
+
+def _default_mapping():
+    """
+    The mapping bundled with the app, compiled on first use.
+
+    Also sets the DEFAULT_MAPPING, DESCRIPTION_MAPPING, DESCRIPTION_MATCHER
+    and COMMENT_PARSER module attributes, which module __getattr__ resolves
+    through this function until then.
+    """
+    mapping = globals().get('DEFAULT_MAPPING')
+    if mapping is None:
+        mapping = MAPPINGS.get()
+        globals().update(DEFAULT_MAPPING=mapping, DESCRIPTION_MAPPING=mapping.phrases,
+                         DESCRIPTION_MATCHER=mapping.matcher, COMMENT_PARSER=mapping.parser)
+    return mapping
+
+
+def __getattr__(name):
+    if name in ('DEFAULT_MAPPING', 'DESCRIPTION_MAPPING', 'DESCRIPTION_MATCHER', 'COMMENT_PARSER'):
+        _default_mapping()
+        return globals()[name]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def resolve_mapping(mapping=None):
+    """A TransactionMapping, a pinned version string, or None for the current mapping"""
+    if isinstance(mapping, TransactionMapping):
+        return mapping
+    return MAPPINGS.get(mapping)
+
+
+def process_comment(comment, mapping=None):
+    """Process a comment string into individual transactions"""
+    return resolve_mapping(mapping).parser.parse(comment)
+
+
+def comment_parser_delta(before, parser=None):
+    """Counters a CommentParser (COMMENT_PARSER by default) accumulated since a stats() snapshot"""
+    after = (parser or _default_mapping().parser).stats()
+    return {counter: after[counter] - before[counter] for counter in ('hits', 'misses', 'evictions', 'parts', 'unmatched')}
+
+
+class ConversionCancelled(Exception):
+    """Raised from a stats hook to stop a conversion whose job was cancelled"""
+
+
+# Rows converted between two progress() calls
+PROGRESS_ROWS = int(os.environ.get('MAP_IT_PROGRESS_ROWS', 5000))
+
+# Memory one conversion may add to the process, in MB; 0 turns the budget off
+MEMORY_BUDGET_MB = int(os.environ.get('MAP_IT_MEMORY_BUDGET_MB', 1024))
+
+# How RunStats(memory=True) measures stages: 'rss' samples the process's resident memory on a background
+# thread; 'tracemalloc' traces Python allocations exactly but makes a conversion several times slower
+MEMORY_TRACKING = os.environ.get('MAP_IT_MEMORY_TRACKING', 'rss')
+
+# Seconds between two samples of resident memory
+MEMORY_SAMPLE_SECONDS = 0.02
+
+
+class MemoryBudgetExceeded(Exception):
+    """Raised from a stats hook when a conversion has grown past the memory budget"""
+
+    def __init__(self, stage, used_bytes, budget_bytes):
+        # Passed on to Exception so the exception survives pickling back from a worker process
+        super().__init__(stage, used_bytes, budget_bytes)
+        self.stage = stage
+        self.used_bytes = used_bytes
+        self.budget_bytes = budget_bytes
+
+    def __str__(self):
+        return f"{self.stage} used {self.used_bytes / 2**20:.0f} MB, over the {self.budget_bytes / 2**20:.0f} MB budget"
+
+
+def current_rss():
+    """Resident memory of this process in bytes, or None where it cannot be read (outside Linux)"""
+    try:
+        with open('/proc/self/statm', 'rb') as handle:
+            return int(handle.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError, AttributeError):
+        return None
+
+
+class MemoryTracker:
+    """
+    Peak memory of each stage of a conversion.
+
+    In 'rss' mode the process's resident memory is sampled every
+    MEMORY_SAMPLE_SECONDS while a stage is open, and a stage's peak is the
+    most it reached above the resident memory when tracking began; with
+    several conversions in one process their memory overlaps. In
+    'tracemalloc' mode a stage's peak is the most memory allocated during
+    that stage. Nested stages count towards their parent's peak. Tracking
+    only runs while a stage is open, and mode is None where neither works.
+    """
+
+    def __init__(self, mode=MEMORY_TRACKING):
+        self.mode = mode if mode in ('rss', 'tracemalloc') else None
+        self.baseline = None
+        # Highest memory seen, and memory at the start, of each open stage, innermost last
+        self._peaks = []
+        self._starts = []
+        self._lock = threading.Lock()
+        self._sampler = None
+        self._stop = threading.Event()
+        self._tracing = False
+
+    def _now(self):
+        if self.mode == 'tracemalloc':
+            import tracemalloc
+
+            return tracemalloc.get_traced_memory()[0]
+        return current_rss()
+
+    def enter(self):
+        """Start tracking a stage"""
+        if self.mode == 'tracemalloc':
+            import tracemalloc
+
+            if not self._peaks and not tracemalloc.is_tracing():
+                tracemalloc.start()
+                self._tracing = True
+            current, peak = tracemalloc.get_traced_memory()
+            if self._peaks:
+                self._peaks[-1] = max(self._peaks[-1], peak)
+            tracemalloc.reset_peak()
+            self._peaks.append(current)
+            self._starts.append(current)
+        elif self.mode == 'rss':
+            rss = current_rss()
+            if rss is None:
+                self.mode = None
+                return
+            with self._lock:
+                if self.baseline is None:
+                    self.baseline = rss
+                self._peaks.append(rss)
+                self._starts.append(self.baseline)
+            if self._sampler is None:
+                self._stop.clear()
+                self._sampler = threading.Thread(target=self._sample, name='map_it_memory', daemon=True)
+                self._sampler.start()
+
+    def exit(self):
+        """Stop tracking the innermost stage and return its peak in bytes, or None when memory is not tracked"""
+        if not self._peaks:
+            return None
+        if self.mode == 'tracemalloc':
+            import tracemalloc
+
+            top = max(self._peaks.pop(), tracemalloc.get_traced_memory()[1])
+        else:
+            self.observe()
+            with self._lock:
+                top = self._peaks.pop()
+        start = self._starts.pop()
+        if self._peaks:
+            self._peaks[-1] = max(self._peaks[-1], top)
+        elif self._tracing:
+            import tracemalloc
+
+            tracemalloc.stop()
+            self._tracing = False
+        elif self._sampler is not None:
+            self._stop.set()
+            self._sampler.join()
+            self._sampler = None
+        return max(top - start, 0)
+
+    def used(self):
+        """Memory used now above the baseline ('rss') or the start of the outermost open stage, or None"""
+        if self.mode == 'rss' and self.baseline is not None:
+            start = self.baseline
+        elif self.mode == 'tracemalloc' and self._starts:
+            start = self._starts[0]
+        else:
+            return None
+        now = self._now()
+        return None if now is None else now - start
+
+    def observe(self):
+        """Raise the peak of every open stage to the resident memory now ('rss' mode)"""
+        rss = current_rss() if self.mode == 'rss' else None
+        if rss is not None:
+            with self._lock:
+                self._peaks[:] = [max(peak, rss) for peak in self._peaks]
+
+    def _sample(self):
+        while not self._stop.wait(MEMORY_SAMPLE_SECONDS):
+            self.observe()
+
+
+class RunStats:
+    """
+    Stage timers and counters for one conversion.
+
+    Pass an instance as convert_file(..., stats=RunStats()) to collect them.
+    Without one, NULL_STATS is used and nothing is timed or counted.
+
+    progress() is called every PROGRESS_ROWS rows and as each source of a
+    batch finishes. A subclass may record it, or raise ConversionCancelled
+    from it or from stage() to stop the conversion.
+
+    With memory, each stage's peak memory is also tracked by a
+    MemoryTracker, and once the conversion uses more than memory_budget
+    bytes (MEMORY_BUDGET_MB by default; 0 for no limit) the next progress()
+    call raises MemoryBudgetExceeded.
+    """
+
+    def __init__(self, memory=False, memory_budget=None):
+        self.stages = {}
+        self.counters = {}
+        self.memory = MemoryTracker() if memory else None
+        self.memory_peaks = {}
+        self.memory_budget = MEMORY_BUDGET_MB * 2**20 if memory_budget is None else memory_budget
+        self._open_stages = []
+
+    @contextmanager
+    def stage(self, name):
+        """Time the enclosed block, adding to any earlier time recorded for the stage"""
+        started = time.perf_counter()
+        self._open_stages.append(name)
+        if self.memory is not None:
+            self.memory.enter()
+        try:
+            yield
+        finally:
+            self.stages[name] = self.stages.get(name, 0.0) + time.perf_counter() - started
+            self._open_stages.pop()
+            if self.memory is not None:
+                peak = self.memory.exit()
+                if peak is not None:
+                    self.memory_peaks[name] = max(self.memory_peaks.get(name, 0), peak)
+
+    def count(self, name, value=1):
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def progress(self, done, total):
+        """done of total rows (or sources) of the current stage are converted"""
+        self.check_memory()
+
+    def check_memory(self):
+        """Raise MemoryBudgetExceeded if the conversion uses more memory than its budget"""
+        if self.memory is None or not self.memory_budget:
+            return
+        used = self.memory.used()
+        if used is not None and used > self.memory_budget:
+            stage = self._open_stages[-1] if self._open_stages else 'conversion'
+            raise MemoryBudgetExceeded(stage, used, self.memory_budget)
+
+    def source_stats(self):
+        """Fresh stats for one source of a batch converted in this process, tracking memory like this one"""
+        return RunStats(self.memory is not None, self.memory_budget)
+
+    def add_counters(self, counters):
+        """Add the counters of another run, e.g. one converted in a worker process"""
+        for name, value in counters.items():
+            self.count(name, value)
+
+    def as_dict(self):
+        stats = {
+            'stages': dict(self.stages),
+            'total_seconds': sum(self.stages.values()),
+            'counters': dict(self.counters),
+        }
+        if self.memory is not None and self.memory.mode is not None:
+            stats['memory'] = {
+                'mode': self.memory.mode,
+                'baseline_bytes': self.memory.baseline,
+                'budget_bytes': self.memory_budget,
+                'stages': dict(self.memory_peaks),
+                'peak_bytes': max(self.memory_peaks.values(), default=0),
+            }
+        return stats
+
+
+class _NullStats:
+    """Stand-in for RunStats when instrumentation is disabled"""
+
+    def stage(self, name):
+        return nullcontext()
+
+    def count(self, name, value=1):
+        pass
+
+    def progress(self, done, total):
+        pass
+
+    def add_counters(self, counters):
+        pass
+
+
+NULL_STATS = _NullStats()
+
+
+def validate_and_clean_dataframe(df, columns=None):
+    """
+    Validate and clean the entire dataframe, or only the given columns
+    """
+    for col in (df.columns if columns is None else columns):
+        df[col] = clean_series(df[col])
+
+    return df
+
+
+# Validation message for an empty contract, payee, employee and comment value, in that order
+MISSING_VALUE_MESSAGES = (
+    "Missing or empty contract number",
+    "Missing or empty payee name",
+    "Missing or empty employee/EC number",
+    "Missing or empty comment",
+)
+
+
+def validation_table(df, columns):
+    """
+    Validate the cleaned contract, payee, employee and comment columns with column-wide masks.
+
+    Returns the error table: one row per missing value with the row number
+    used in messages (df's row label + 1), the source column and the rule
+    it breaks, ordered by row and then role like the messages.
+    """
+    import numpy as np
+
+    failed = [np.flatnonzero(df[columns[role]].eq('').to_numpy()) for role in ROLES]
+    rows = df.index.to_numpy()[np.concatenate(failed)] + 1
+    roles = np.repeat(np.arange(len(ROLES), dtype=np.int8), [len(positions) for positions in failed])
+    return _error_table(rows, roles, columns)
+
+
+def _error_table(rows, roles, columns):
+    """Error table of failed checks given as 1-based row numbers and positions in ROLES"""
+    import numpy as np
+    import pandas as pd
+
+    rows = np.asarray(rows, dtype=np.int64)
+    roles = np.asarray(roles, dtype=np.int8)
+    order = np.lexsort((roles, rows))
+    rows, roles = rows[order], roles[order]
+    names = [str(columns[role]) for role in ROLES]
+    return pd.DataFrame({
+        'Row': rows,
+        'Column': pd.Categorical(np.array(names, dtype=object)[roles], categories=list(dict.fromkeys(names))),
+        'Rule': pd.Categorical.from_codes(roles, categories=list(MISSING_VALUE_MESSAGES)),
+    })
+
+
+def validation_messages(table, limit=10):
+    """The first limit rows of an error table as "Row n: message" strings"""
+    head = table.head(limit)
+    return [f"Row {row}: {rule}" for row, rule in zip(head['Row'], head['Rule'])]
+
+
+def rule_counts(table):
+    """Number of errors per rule in an error table, for the rules that failed"""
+    return {rule: int(count) for rule, count in table['Rule'].value_counts(sort=False).items() if count}
+
+
+# Column roles, in the order rows are fed to RowPipeline
+ROLES = ('contract', 'payee', 'employee', 'comment')
+
+# Header names tried for each role, in order of preference
+ROLE_NAMES = {
+    'contract': [
+        'contract no', 'contract', 'contract number', 'contractno', 'contract num'
+    ],
+    'payee': [
+        'name', 'customer name', 'payee', 'fullname', 'employee', 'full name',
+        'client name', 'employee name', 'employeename', 'customer', 'clientname'
+    ],
+    'employee': [
+        'employee number', 'ec number', 'ec num', 'employee num', 'ec number',
+        'employeenumber', 'ecnumber', 'emp num', 'emp number', 'id number'
+    ],
+    'comment': [
+        'comment', 'description', 'transaction description', 'comments',
+        'transaction', 'desc', 'transaction desc'
+    ],
+}
+
+# Label and naming suggestion shown for each role when its column is missing
+ROLE_SUGGESTIONS = {
+    'contract': ("Contract Number", "Try columns like: Contract No, Contract, Contract Number"),
+    'payee': ("Payee/Customer Name", "Try columns like: Name, Customer Name, Payee, Client Name"),
+    'employee': ("Employee Number", "Try columns like: Employee Number, EC Number, ID Number"),
+    'comment': ("Comment/Description", "Try columns like: Comment, Description, Transaction Description"),
+}
+
+# Header names of the optional column holding each contract's expected total; only exact matches count
+CONTROL_TOTAL_NAMES = ['control total', 'control amount', 'expected total', 'contract total']
+
+# Number of rows at the top of a sheet searched for the header row
+HEADER_SNIFF_ROWS = int(os.environ.get('MAP_IT_HEADER_SNIFF_ROWS', 20))
+
+
+def find_columns(names):
+    """
+    Detect the contract, payee, employee and comment columns among header names.
+
+    Returns (columns, confidence, error_msg): columns maps each role to the
+    matching column name, confidence maps it to the match score (0-1) and
+    error_msg is None when all four were found.
+    """
+    columns, confidence = ColumnIndex(names).resolve()
+
+    # Check for missing columns with detailed feedback
+    missing = [role for role in ROLES if role not in columns]
+    if missing:
+        error_msg = f"❌ **Missing required columns:** {', '.join(ROLE_SUGGESTIONS[role][0] for role in missing)}\n\n"
+        error_msg += "**Suggestions:**\n"
+        for role in missing:
+            label, suggestion = ROLE_SUGGESTIONS[role]
+            error_msg += f"- **{label}**: {suggestion}\n"
+        error_msg += "\n**Available columns in your file:**\n"
+        for col in names:
+            error_msg += f"- `{col}`\n"
+        return {}, {}, error_msg
+
+    return {role: columns[role] for role in ROLES}, confidence, None
+
+
+def find_control_column(names, columns):
+    """The optional control-total column among header names, or None; a column already mapped to a role is never used"""
+    mapped = set(columns.values())
+    return ColumnIndex([name for name in names if name not in mapped]).find_exact(CONTROL_TOTAL_NAMES)
+
+
+def _header_cell(value):
+    """A header cell as read_excel would name its column: None when blank, integral floats as ints"""
+    if value is None or (isinstance(value, float) and value != value):
+        return None
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    return value
+
+
+def sniff_header_row(rows):
+    """
+    Find the header row among the first rows of a sheet.
+
+    rows holds the sheet's leading rows as lists of cell values. The header
+    is the first row whose names resolve all four roles to four different
+    columns; title and banner rows above it are skipped. When no row does,
+    the row resolving the most roles is used, the earliest on ties, so a
+    sheet with a usable first row reads as it always has.
+
+    Returns (row position, column names of that row).
+    """
+    best = (0, [])
+    best_resolved = -1
+    for position, values in enumerate(rows):
+        names = _header_names(_header_cell(value) for value in values)
+        columns, _ = ColumnIndex(names).resolve()
+        if len(columns) == len(ROLES) and len(set(columns.values())) == len(ROLES):
+            return position, names
+        if len(columns) > best_resolved:
+            best, best_resolved = (position, names), len(columns)
+    return best
+
+
+def format_validation_errors(validation_errors, error_count=None):
+    """Build the error message for failed row validation, listing the first 10 errors"""
+    error_count = len(validation_errors) if error_count is None else error_count
+    error_msg = "❌ **Data validation errors found:**\n\n"
+    for error in validation_errors[:10]:  # Show first 10 errors
+        error_msg += f"- {error}\n"
+    if error_count > 10:
+        error_msg += f"\n... and {error_count - 10} more errors"
+    return error_msg
+
+
+# strftime format of the Value Date, Effective Date and Post Date columns
+CREDITEASE_DATE_FORMAT = '%d-%b-%y'
+
+
+class BatchDates:
+    """
+    The date strings of one batch, formatted once.
+
+    Value Date and Effective Date come from effective_date, and Post Date
+    from posted_at, the time the batch started (now by default), so a batch
+    converted across midnight carries a single post date.
+    """
+
+    def __init__(self, effective_date, posted_at=None):
+        self.effective = effective_date.strftime(CREDITEASE_DATE_FORMAT)
+        self.post = (posted_at or datetime.now()).strftime(CREDITEASE_DATE_FORMAT)
+
+
+class ResultBuilder:
+    """
+    Column-wise builder of a CreditEase result frame.
+
+    Contract groups are added with their parsed transactions. Contract,
+    employee and payee values go into lists, descriptions into an array of
+    codes into the descriptions seen so far, and amounts into an int64 array
+    of cents; nothing is built per row. frame() returns Description,
+    Transaction Type and the three date columns as categoricals holding
+    only the values that occur, and Amount as int64 cents, which csv_bytes
+    and write_csv format as dollars.
+    """
+
+    def __init__(self, mapping, dates):
+        self.mapping = mapping
+        self.dates = dates
+        self.clear()
+
+    def clear(self):
+        self.contracts = []
+        self.employees = []
+        self.payees = []
+        self.description_names = []
+        self._description_codes = {}
+        self._descriptions = array('i')
+        self._amounts = array('q')
+
+    def __len__(self):
+        return len(self._amounts)
+
+    def _description_code(self, description):
+        code = self._description_codes.get(description)
+        if code is None:
+            code = self._description_codes[description] = len(self.description_names)
+            self.description_names.append(description)
+        return code
+
+    def add(self, contract_no, payee, employee_no, transactions):
+        """Add one contract group's transactions"""
+        count = len(transactions)
+        self.contracts.extend([contract_no] * count)
+        self.employees.extend([employee_no] * count)
+        self.payees.extend([payee] * count)
+        for transaction in transactions:
+            self._descriptions.append(self._description_code(transaction['description']))
+            self._amounts.append(transaction['cents'])
+
+    def extend(self, other):
+        """Append the rows of another builder for the same batch"""
+        self.contracts.extend(other.contracts)
+        self.employees.extend(other.employees)
+        self.payees.extend(other.payees)
+        recode = [self._description_code(description) for description in other.description_names]
+        self._descriptions.extend(recode[code] for code in other._descriptions)
+        self._amounts.extend(other._amounts)
+
+    def rows(self):
+        """The rows as lists of values in CREDITEASE_COLUMNS order, for a csv.writer"""
+        transaction_types = [self.mapping.transaction_type(description) for description in self.description_names]
+        effective, post = self.dates.effective, self.dates.post
+        amounts = format_cents(self._amounts).tolist()
+        for contract_no, code, amount, employee_no, payee in zip(
+                self.contracts, self._descriptions, amounts, self.employees, self.payees):
+            yield [contract_no, transaction_types[code], self.description_names[code], amount, effective, effective,
+                   post, employee_no, payee]
+
+    def frame(self):
+        """The result frame, with CREDITEASE_COLUMNS"""
+        import numpy as np
+        import pandas as pd
+
+        codes = np.frombuffer(self._descriptions, dtype=np.int32) if len(self) else np.zeros(0, dtype=np.int32)
+        transaction_types = [self.mapping.transaction_type(description) for description in self.description_names]
+        type_names = list(dict.fromkeys(transaction_types))
+        type_codes = np.array([type_names.index(code) for code in transaction_types], dtype=np.int32)
+        date_codes = np.zeros(len(self), dtype=np.int8)
+        effective = pd.Categorical.from_codes(date_codes, categories=[self.dates.effective])
+
+        return pd.DataFrame({
+            'Contract No': self.contracts,
+            'Transaction Type': pd.Categorical.from_codes(type_codes[codes], categories=type_names),
+            'Description': pd.Categorical.from_codes(codes, categories=self.description_names),
+            'Amount': np.array(self._amounts, dtype=np.int64),
+            'Value Date': effective,
+            'Effective Date': effective.copy(),
+            'Post Date': pd.Categorical.from_codes(date_codes, categories=[self.dates.post]),
+            'Employee Number': self.employees,
+            'Payee': self.payees,
+        }, columns=CREDITEASE_COLUMNS)
+
+
+# Result columns built as categoricals
+CATEGORICAL_COLUMNS = ['Transaction Type', 'Description', 'Value Date', 'Effective Date', 'Post Date']
+
+
+def concat_results(frames):
+    """Concatenate result frames, keeping the categorical columns categorical"""
+    import pandas as pd
+
+    result_df = pd.concat(frames, ignore_index=True)
+    for column in CATEGORICAL_COLUMNS:
+        if not isinstance(result_df[column].dtype, pd.CategoricalDtype):
+            result_df[column] = result_df[column].astype('category')
+    return result_df
+
+
+class Reconciliation:
+    """
+    Control totals of a batch, accumulated as its contract groups are emitted.
+
+    add() is called with each emitted group's transactions and keeps a
+    (transactions, cents) pair per description and per contract, so the
+    batch, transaction type and contract totals need no pass over the
+    result. expect() records a contract's control total from the source
+    file, the first one given for each contract; report() compares them with
+    the converted totals. Contracts with a group left out by delta are not
+    checked.
+    """
+
+    def __init__(self):
+        self.descriptions = {}
+        self.contracts = {}
+        self.expected = {}
+        self.skipped = set()
+
+    def add(self, contract_no, transactions):
+        """Add one emitted contract group's transactions"""
+        contract = self.contracts.get(contract_no)
+        if contract is None:
+            contract = self.contracts[contract_no] = [0, 0]
+        contract[0] += len(transactions)
+        for transaction in transactions:
+            cents = transaction['cents']
+            description = self.descriptions.get(transaction['description'])
+            if description is None:
+                description = self.descriptions[transaction['description']] = [0, 0]
+            description[0] += 1
+            description[1] += cents
+            contract[1] += cents
+
+    def expect(self, contract_no, text):
+        """Record a contract's control total, given as amount text; blank and non-amount texts are ignored"""
+        if contract_no not in self.expected:
+            cents = text_cents(text)
+            if cents is not None:
+                self.expected[contract_no] = cents
+
+    def report(self, mapping, control_column=None):
+        """
+        The totals as a JSON-ready dict.
+
+        'by_type' and 'by_contract' map each transaction type and contract, in
+        order of first appearance, to [transactions, cents]; contracts checked
+        against the control column get its cents as a third item. 'control'
+        is None without a control column, else it names the column and lists
+        the contracts whose converted total differs from it.
+        """
+        by_type = {}
+        for description, (count, cents) in self.descriptions.items():
+            totals = by_type.setdefault(mapping.transaction_type(description), [0, 0])
+            totals[0] += count
+            totals[1] += cents
+        by_contract = {contract_no: list(totals) for contract_no, totals in self.contracts.items()}
+
+        control = None
+        if control_column is not None:
+            for contract_no, expected in self.expected.items():
+                if contract_no not in self.skipped:
+                    by_contract.setdefault(contract_no, [0, 0]).append(expected)
+            control = _control_report(str(control_column), by_contract)
+
+        return {
+            'transactions': sum(count for count, _ in by_type.values()),
+            'total_cents': sum(cents for _, cents in by_type.values()),
+            'by_type': by_type,
+            'by_contract': by_contract,
+            'control': control,
+        }
+
+
+def _control_report(column, by_contract):
+    """The 'control' part of a reconciliation report: contracts with a control total, and those it does not match"""
+    checked = [(contract_no, totals) for contract_no, totals in by_contract.items() if len(totals) > 2]
+    return {
+        'column': column,
+        'checked': len(checked),
+        'mismatched': [contract_no for contract_no, totals in checked if totals[1] != totals[2]],
+    }
+
+
+def merge_reconciliations(reports):
+    """
+    Combine the reconciliation reports of several sources into one for the batch.
+
+    Totals, and the control totals of contracts given one, are summed per
+    type and per contract, and the contracts are checked again on the sums.
+    """
+    by_type = {}
+    by_contract = {}
+    columns = []
+    for report in reports:
+        for totals_by_name, merged in ((report['by_type'], by_type), (report['by_contract'], by_contract)):
+            for name, totals in totals_by_name.items():
+                current = merged.setdefault(name, [0, 0])
+                current[0] += totals[0]
+                current[1] += totals[1]
+                if len(totals) > 2:
+                    current[2:] = [sum(current[2:]) + totals[2]]
+        if report['control'] is not None:
+            columns.append(report['control']['column'])
+
+    return {
+        'transactions': sum(report['transactions'] for report in reports),
+        'total_cents': sum(report['total_cents'] for report in reports),
+        'by_type': by_type,
+        'by_contract': by_contract,
+        'control': _control_report(', '.join(dict.fromkeys(columns)), by_contract) if columns else None,
+    }
+
+
+def reconciliation_csv(reconciliation):
+    """
+    The reconciliation report as CSV bytes: the batch total, then the totals of each transaction type and contract.
+
+    Amounts are written like the Amount column. Contracts checked against the
+    source's control column also get its total, the difference and OK or
+    Mismatch.
+    """
+    by_type, by_contract = reconciliation['by_type'], reconciliation['by_contract']
+    amounts = iter(format_cents(
+        [reconciliation['total_cents']] + [cents for _, cents in by_type.values()]
+        + [totals[1] for totals in by_contract.values()]
+    ).tolist())
+    checked = [totals for totals in by_contract.values() if len(totals) > 2]
+    controls = iter(format_cents([totals[2] for totals in checked]).tolist())
+    differences = iter(format_cents([totals[1] - totals[2] for totals in checked]).tolist())
+
+    buffer = StringIO()
+    writer = csv.writer(buffer, lineterminator=os.linesep)
+    writer.writerow(['Level', 'Name', 'Transactions', 'Amount', 'Control Total', 'Difference', 'Status'])
+    writer.writerow(['Batch', '', reconciliation['transactions'], next(amounts)])
+    for name, (count, _) in by_type.items():
+        writer.writerow(['Transaction Type', name, count, next(amounts)])
+    for name, totals in by_contract.items():
+        row = ['Contract', name, totals[0], next(amounts)]
+        if len(totals) > 2:
+            row += [next(controls), next(differences), 'OK' if totals[1] == totals[2] else 'Mismatch']
+        writer.writerow(row)
+    return buffer.getvalue().encode('utf-8')
+
+
+# Directory for Map It's local state, such as the group fingerprint store
+STATE_DIR = os.environ.get('MAP_IT_STATE_DIR', os.path.join(os.path.expanduser('~'), '.map_it'))
+GROUP_STORE_PATH = os.path.join(STATE_DIR, 'groups.sqlite')
+
+
+def group_fingerprint(contract_no, payee, employee_no, comment):
+    """Hash of a cleaned contract group's values, identifying it across uploads"""
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update('\x1f'.join((contract_no, payee, employee_no, comment)).encode('utf-8'))
+    return digest.hexdigest()
+
+
+# Contract groups looked up in the GroupStore with one query
+STORE_LOOKUP_BATCH = 500
+
+
+class GroupStore:
+    """
+    SQLite store of converted contract groups, shared by every conversion using the same file.
+
+    Groups are identified by group_fingerprint. For each fingerprint and
+    mapping the parsed transactions are kept, so an unchanged group of a
+    re-uploaded workbook is not parsed again. For each fingerprint and
+    effective date the first upload (workbook digest) whose CSV was
+    exported with it is kept, so a group already posted can be left out of
+    a delta export. Converting a workbook does not post its groups; only
+    mark_posted, called once the CSV is downloaded or written, does.
+    """
+
+    def __init__(self, path=GROUP_STORE_PATH):
+        self.path = path
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._connection = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock, self._connection:
+            self._connection.execute('PRAGMA journal_mode=WAL')
+            self._connection.execute(
+                'CREATE TABLE IF NOT EXISTS groups ('
+                'fingerprint TEXT, mapping TEXT, transactions TEXT, PRIMARY KEY (fingerprint, mapping))'
+            )
+            self._connection.execute(
+                'CREATE TABLE IF NOT EXISTS posted ('
+                'fingerprint TEXT, effective_date TEXT, upload TEXT, PRIMARY KEY (fingerprint, effective_date))'
+            )
+
+    def lookup(self, fingerprints, mapping_key, effective_date):
+        """
+        (stored transactions by fingerprint, set of fingerprints already posted) for a batch of groups.
+
+        Takes one query per table for every STORE_LOOKUP_BATCH fingerprints.
+        Groups never converted with mapping_key are missing from the dict.
+        """
+        unique = list(dict.fromkeys(fingerprints))
+        stored = {}
+        posted = set()
+        with self._lock:
+            for start in range(0, len(unique), STORE_LOOKUP_BATCH):
+                chunk = unique[start:start + STORE_LOOKUP_BATCH]
+                marks = ', '.join('?' * len(chunk))
+                stored.update(self._connection.execute(
+                    f'SELECT fingerprint, transactions FROM groups WHERE mapping = ? AND fingerprint IN ({marks})',
+                    (mapping_key, *chunk)
+                ))
+                posted.update(fingerprint for fingerprint, in self._connection.execute(
+                    f'SELECT fingerprint FROM posted WHERE effective_date = ? AND fingerprint IN ({marks})',
+                    (effective_date, *chunk)
+                ))
+        return {
+            fingerprint: [{'description': description, 'cents': cents} for description, cents in json.loads(text)]
+            for fingerprint, text in stored.items()
+        }, posted
+
+    def record(self, converted, mapping_key):
+        """Store newly converted (fingerprint, transactions) pairs"""
+        with self._lock, self._connection:
+            self._connection.executemany(
+                'INSERT OR REPLACE INTO groups VALUES (?, ?, ?)',
+                ((fingerprint, mapping_key,
+                  json.dumps([[transaction['description'], transaction['cents']] for transaction in transactions]))
+                 for fingerprint, transactions in converted)
+            )
+
+    def mark_posted(self, fingerprints, effective_date, upload):
+        """Record the groups of an exported batch as posted for effective_date (an ISO date) by upload"""
+        with self._lock, self._connection:
+            self._connection.executemany(
+                'INSERT OR IGNORE INTO posted VALUES (?, ?, ?)',
+                ((fingerprint, effective_date, upload) for fingerprint in fingerprints)
+            )
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+
+class RowPipeline:
+    """
+    Single-pass validation, contract grouping and transaction extraction.
+
+    Rows are fed in file order as already-cleaned values. Each row is
+    validated, consecutive rows for the same contract are merged, and each
+    finished group's comment is parsed into transactions, which are handed
+    with the group's contract number, payee and employee number to
+    emit_merged (groups spanning several rows) or emit_single (one-row
+    groups), e.g. the add method of a ResultBuilder. Once any row fails
+    validation no more transactions are built, but all rows are still
+    checked so the error count is complete; only the first max_errors
+    messages are kept, and error_table() lists every error. Comments are
+    mapped with mapping, a TransactionMapping (the current one by default).
+
+    With a GroupStore, groups converted before with the same mapping reuse
+    their stored transactions; groups are looked up STORE_LOOKUP_BATCH at a
+    time and emitted in order once their batch is resolved. fingerprints
+    lists the groups the result holds, for GroupStore.mark_posted once it
+    is exported. With delta, groups already posted for this effective date
+    are left out.
+
+    Every emitted group is also added to reconciliation, a Reconciliation
+    holding the batch's control totals.
+    """
+
+    def __init__(self, effective_date, emit_merged, emit_single, max_errors=10, mapping=None, store=None,
+                 delta=False):
+        self.effective_date = effective_date
+        self.mapping = resolve_mapping(mapping)
+        self.emit_merged = emit_merged
+        self.emit_single = emit_single
+        self.max_errors = max_errors
+        self.store = store
+        self.delta = delta
+        self.errors = []
+        self.error_count = 0
+        self._error_rows = array('q')
+        self._error_roles = array('b')
+        self.rows = 0
+        self.groups = 0
+        self.merged_groups = 0
+        self.transactions = 0
+        self.reused_groups = 0
+        self.posted_groups = 0
+        self.skipped_transactions = 0
+        self._group = None
+        self.fingerprints = []
+        self._pending = []
+        self._converted = []
+        self.reconciliation = Reconciliation()
+
+    def add(self, idx, contract_no, payee, employee_no, comment, control=''):
+        """
+        Feed one cleaned row; idx is the 0-based row label used in error messages.
+
+        control is the row's cell of the source's control-total column, if it has one.
+        """
+        self.rows += 1
+        if control:
+            self.reconciliation.expect(contract_no, control)
+        if not (contract_no and payee and employee_no and comment):
+            for role, (value, message) in enumerate(zip((contract_no, payee, employee_no, comment),
+                                                        MISSING_VALUE_MESSAGES)):
+                if not value:
+                    self.error_count += 1
+                    self._error_rows.append(idx + 1)
+                    self._error_roles.append(role)
+                    if len(self.errors) < self.max_errors:
+                        self.errors.append(f"Row {idx + 1}: {message}")
+
+        group = self._group
+        if group is not None and contract_no == group[0]:
+            if not self.error_count:
+                group[3].append(comment)
+            group[4] += 1
+        else:
+            self._flush()
+            self._group = [contract_no, payee, employee_no, [comment], 1]
+
+    def error_table(self, columns):
+        """Every validation error so far as an error table, naming the source columns from columns"""
+        return _error_table(self._error_rows, self._error_roles, columns)
+
+    def finish(self):
+        """Flush the last group; call once after the final row"""
+        self._flush()
+        self._group = None
+        if self.store is not None:
+            self._resolve_pending()
+            if not self.error_count:
+                self.store.record(self._converted, self._mapping_key())
+
+    def _mapping_key(self):
+        return self.mapping.digest or self.mapping.version
+
+    def _flush(self):
+        group = self._group
+        if group is None or self.error_count:
+            return
+        contract_no, payee, employee_no, comments, size = group
+        self.groups += 1
+        self.merged_groups += size > 1
+        comment = ' '.join(comments)
+        if self.store is None:
+            self._emit(contract_no, payee, employee_no, self.mapping.parser.parse(comment), size)
+            return
+
+        self._pending.append((contract_no, payee, employee_no, comment, size,
+                              group_fingerprint(contract_no, payee, employee_no, comment)))
+        if len(self._pending) >= STORE_LOOKUP_BATCH:
+            self._resolve_pending()
+
+    def _resolve_pending(self):
+        """Look the pending groups up in the store at once, then parse, skip or emit each in order"""
+        pending, self._pending = self._pending, []
+        if not pending or self.error_count:
+            return
+        stored, posted = self.store.lookup([group[5] for group in pending], self._mapping_key(),
+                                           self.effective_date.isoformat())
+        for contract_no, payee, employee_no, comment, size, fingerprint in pending:
+            transactions = stored.get(fingerprint)
+            if transactions is None:
+                transactions = self.mapping.parser.parse(comment)
+                self._converted.append((fingerprint, transactions))
+            else:
+                self.reused_groups += 1
+            if fingerprint in posted:
+                self.posted_groups += 1
+                if self.delta:
+                    self.skipped_transactions += len(transactions)
+                    self.reconciliation.skipped.add(contract_no)
+                    continue
+            self.fingerprints.append(fingerprint)
+            self._emit(contract_no, payee, employee_no, transactions, size)
+
+    def _emit(self, contract_no, payee, employee_no, transactions, size):
+        self.transactions += len(transactions)
+        if transactions:
+            self.reconciliation.add(contract_no, transactions)
+            (self.emit_merged if size > 1 else self.emit_single)(contract_no, payee, employee_no, transactions)
+
+
+def _count_pipeline(stats, pipeline, parser_delta):
+    """Add a finished RowPipeline's counters and the comment parser's share of the run to stats"""
+    stats.count('groups', pipeline.groups)
+    stats.count('merged_groups', pipeline.merged_groups)
+    stats.count('parts_parsed', parser_delta['parts'])
+    stats.count('unmatched_parts', parser_delta['unmatched'])
+    stats.count('transactions', pipeline.transactions)
+    stats.count('validation_errors', pipeline.error_count)
+    if pipeline.store is not None:
+        stats.count('groups_reused', pipeline.reused_groups)
+        stats.count('groups_already_posted', pipeline.posted_groups)
+
+
+def _incremental_report(pipeline):
+    """How many groups a RowPipeline with a GroupStore reused or found already posted"""
+    return {
+        'groups': pipeline.groups,
+        'reused': pipeline.reused_groups,
+        'already_posted': pipeline.posted_groups,
+        'delta': pipeline.delta,
+        'skipped_transactions': pipeline.skipped_transactions,
+    }
+
+
+# Excel file signatures
+EXCEL_SIGNATURES = [
+    b'\x50\x4B\x03\x04',  # Modern Excel (xlsx)
+    b'\xD0\xCF\x11\xE0',  # Older Excel (xls)
+    b'\x09\x08\x10\x00',  # Older Excel variants
+    b'\xFD\xFF\xFF\xFF'  # Some older Excel versions
+]
+
+NOT_EXCEL_MESSAGE = "❌ The uploaded file doesn't appear to be a valid Excel file. Please upload a .xlsx or .xls file."
+
+# Output columns of a CreditEase financial transaction upload
+CREDITEASE_COLUMNS = [
+    'Contract No', 'Transaction Type', 'Description', 'Amount', 'Value Date',
+    'Effective Date', 'Post Date', 'Employee Number', 'Payee'
+]
+
+
+def converted_filename(source_name):
+    """Name of the CSV produced for a source workbook"""
+    base_name = os.path.splitext(os.path.basename(source_name))[0]
+    return f"{base_name}_converted.csv"
+
+
+def report_filename(source_name):
+    """Name of the JSON run report written next to a source workbook's CSV"""
+    base_name = os.path.splitext(os.path.basename(source_name))[0]
+    return f"{base_name}_report.json"
+
+
+def reconciliation_filename(source_name):
+    """Name of the reconciliation report CSV written next to a source workbook's CSV"""
+    base_name = os.path.splitext(os.path.basename(source_name))[0]
+    return f"{base_name}_reconciliation.csv"
+
+
+def errors_filename(source_name):
+    """Name of the CSV listing every validation error of a source workbook"""
+    base_name = os.path.splitext(os.path.basename(source_name))[0]
+    return f"{base_name}_errors.csv"
+
+
+def creditease_frame(df):
+    """A result frame as written out: integer-cents amounts formatted as dollars"""
+    import pandas as pd
+
+    if not pd.api.types.is_integer_dtype(df['Amount'].dtype):
+        return df
+    return df.assign(Amount=format_cents(df['Amount'].to_numpy()))
+
+
+def write_csv(df, target, compression=None):
+    """Write a result frame as a CreditEase CSV to a path or binary buffer"""
+    creditease_frame(df).to_csv(target, index=False, compression=compression)
+
+
+def csv_bytes(df, compress=False):
+    """Encode a result frame as CSV bytes in one pass, optionally gzip-compressed"""
+    buffer = BytesIO()
+    write_csv(df, buffer, {'method': 'gzip', 'mtime': 0} if compress else None)
+    return buffer.getvalue()
+
+
+def report_json(report):
+    """Encode a conversion report, including any stage timings, as JSON bytes"""
+    return json.dumps(plain_report(report), indent=2, default=str).encode('utf-8')
+
+
+def plain_report(report):
+    """A copy of report, and of its source reports, without the validation error tables and group fingerprints"""
+    plain = {key: value for key, value in report.items() if key not in ('error_table', 'group_fingerprints')}
+    if 'sources' in plain:
+        plain['sources'] = [plain_report(source_report) for source_report in plain['sources']]
+    return plain
+
+
+def record_posted_groups(store, report, effective_date):
+    """
+    Record the contract groups of a converted batch as posted in a GroupStore.
+
+    Call once the batch's CSV is downloaded or written; from then on a delta
+    conversion for the same effective date leaves these groups out.
+    """
+    if store is not None and report.get('group_fingerprints'):
+        store.mark_posted(report['group_fingerprints'], effective_date.isoformat(), report.get('digest'))
+
+
+def validation_errors(report):
+    """
+    The full validation error table of a failed conversion, or None when no row failed validation.
+
+    When several sources were converted, their tables are combined with the
+    source named in a leading Source column.
+    """
+    if report.get('error_table') is not None:
+        return report['error_table']
+    sources = report.get('sources', [])
+    failed = [source_report for source_report in sources if source_report.get('error_table') is not None]
+    if not failed:
+        return None
+    if len(sources) == 1:
+        return failed[0]['error_table']
+
+    import pandas as pd
+
+    tables = [source_report['error_table'] for source_report in failed]
+    labels = [source_label(source_report) for source_report in failed]
+    combined = pd.concat(tables, ignore_index=True)
+    combined['Column'] = combined['Column'].astype('category')
+    combined.insert(0, 'Source', pd.Categorical.from_codes(
+        [position for position, table in enumerate(tables) for _ in range(len(table))], categories=labels))
+    return combined
+
+
+def new_report(source_name=None):
+    """Create an empty conversion report"""
+    return {
+        'source': source_name,
+        'rows': 0,
+        'columns': {},
+        'transactions': 0,
+        'error': None,
+    }
+
+
+def _failed(report, error_msg):
+    """Record a conversion error and return the (result, report) pair for it"""
+    report['error'] = error_msg
+    return None, report
+
+
+def _validation_failed(report, table):
+    """Record failed row validation with its error table and per-rule counts, as _failed does"""
+    report['validation'] = {'errors': len(table), 'rules': rule_counts(table)}
+    report['error_table'] = table
+    return _failed(report, format_validation_errors(validation_messages(table), len(table)))
+
+
+# Memory model behind estimate_memory, fitted to the resident memory growth of conversions of generated
+# exports (benchmarks/bench_memory.py): a fixed cost, a cost per sheet row and, for the in-memory path, a cost
+# per byte of uncompressed sheet XML, as read_excel parses every column before keeping the mapped ones
+IN_MEMORY_FIXED_BYTES = 24 * 2**20
+IN_MEMORY_ROW_BYTES = 950
+IN_MEMORY_SHEET_FACTOR = 1.1
+LOW_MEMORY_FIXED_BYTES = 18 * 2**20
+LOW_MEMORY_ROW_BYTES = 1250
+# .xls workbooks are always read whole, so only their file size is used
+XLS_FILE_FACTOR = 8
+
+_SHEET_ROW_RE = re.compile(rb'<(?:\w+:)?row[\s>]')
+
+
+def estimate_memory(uploaded_file, sheet_name=0):
+    """
+    Estimate the memory converting a sheet of an Excel file object will take, before reading it.
+
+    For .xlsx the sheet's uncompressed size comes from the zip directory and
+    its rows are counted while the sheet XML is decompressed once, without
+    parsing it. Returns a dict with the sheet's 'rows' (None for .xls),
+    'sheet_bytes', 'in_memory_bytes' for the in-memory path and
+    'low_memory_bytes' for reading only the mapped columns row by row (None
+    for .xls), or None when the file cannot be estimated.
+    """
+    uploaded_file.seek(0)
+    signature = uploaded_file.read(8)
+    try:
+        if signature.startswith(b'\xD0\xCF\x11\xE0'):
+            size = uploaded_file.seek(0, os.SEEK_END)
+            return {'rows': None, 'sheet_bytes': size, 'in_memory_bytes': IN_MEMORY_FIXED_BYTES + XLS_FILE_FACTOR * size,
+                    'low_memory_bytes': None}
+        if not signature.startswith(b'\x50\x4B\x03\x04'):
+            return None
+
+        import zipfile
+
+        uploaded_file.seek(0)
+        with zipfile.ZipFile(uploaded_file) as archive:
+            sheet = _sheet_member(archive, sheet_name)
+            shared = [info for info in archive.infolist() if info.filename.endswith('sharedStrings.xml')]
+            sheet_bytes = archive.getinfo(sheet).file_size + sum(info.file_size for info in shared)
+            rows = 0
+            tail = b''
+            with archive.open(sheet) as handle:
+                for block in iter(lambda: handle.read(1 << 20), b''):
+                    # Keep a few bytes of the last block so a tag split between blocks is still counted
+                    text = tail + block
+                    rows += len(_SHEET_ROW_RE.findall(text))
+                    tail = text[-8:]
+                    rows -= len(_SHEET_ROW_RE.findall(tail))
+    except Exception:
+        return None
+    finally:
+        uploaded_file.seek(0)
+
+    return {
+        'rows': rows,
+        'sheet_bytes': sheet_bytes,
+        'in_memory_bytes': int(IN_MEMORY_FIXED_BYTES + IN_MEMORY_ROW_BYTES * rows + IN_MEMORY_SHEET_FACTOR * sheet_bytes),
+        'low_memory_bytes': LOW_MEMORY_FIXED_BYTES + LOW_MEMORY_ROW_BYTES * rows,
+    }
+
+
+def _sheet_member(archive, sheet_name=0):
+    """Name of the zip member holding a sheet (by position or name) of an .xlsx archive"""
+    import xml.etree.ElementTree as ElementTree
+
+    sheets = [element for element in ElementTree.fromstring(archive.read('xl/workbook.xml')).iter()
+              if element.tag.endswith('}sheet')]
+    sheet = sheets[sheet_name] if isinstance(sheet_name, int) else next(
+        element for element in sheets if element.get('name') == sheet_name)
+    relation = next(value for key, value in sheet.attrib.items() if key.endswith('}id'))
+    targets = {element.get('Id'): element.get('Target')
+               for element in ElementTree.fromstring(archive.read('xl/_rels/workbook.xml.rels'))}
+    target = targets[relation]
+    return target.lstrip('/') if target.startswith('/') else f"xl/{target}"
+
+
+def memory_plan(uploaded_file, sheet_name=0, budget=None):
+    """
+    Decide how to convert a sheet within the memory budget (MEMORY_BUDGET_MB by default, in bytes; 0 for none).
+
+    Returns estimate_memory's dict plus 'budget_bytes' and the 'path':
+    'in_memory' when the estimate fits the budget (or cannot be made),
+    'low_memory' when only the row-by-row path fits, and 'rejected' when
+    neither does.
+    """
+    budget = MEMORY_BUDGET_MB * 2**20 if budget is None else budget
+    plan = estimate_memory(uploaded_file, sheet_name) or {}
+    plan['budget_bytes'] = budget
+    if not budget or not plan or plan['in_memory_bytes'] <= budget:
+        plan['path'] = 'in_memory'
+    elif plan['low_memory_bytes'] is not None and plan['low_memory_bytes'] <= budget:
+        plan['path'] = 'low_memory'
+    else:
+        plan['path'] = 'rejected'
+    return plan
+
+
+def _too_large_message(plan):
+    """Error message for a workbook memory_plan rejected"""
+    needed = plan['low_memory_bytes'] or plan['in_memory_bytes']
+    error_msg = (f"❌ **This workbook is too large to convert within the memory budget.** Converting it would take "
+                 f"about {needed / 2**20:,.0f} MB and the budget is {plan['budget_bytes'] / 2**20:,.0f} MB.\n\n")
+    error_msg += "**Solutions:**\n"
+    error_msg += "- Split the workbook into smaller files, or export fewer rows at a time\n"
+    if plan['low_memory_bytes'] is None:
+        error_msg += "- Save the .xls workbook as .xlsx, which can be read row by row\n"
+    error_msg += "- Convert it with `map_it_batch.py --stream`, which writes the CSV without holding the batch\n"
+    error_msg += "- Raise the budget with `MAP_IT_MEMORY_BUDGET_MB` if the server has the memory\n"
+    return error_msg
+
+
+def _over_budget_message(error):
+    """Error message for a conversion stopped by MemoryBudgetExceeded"""
+    return (f"❌ **Conversion stopped to protect the server:** the {error.stage} stage used "
+            f"{error.used_bytes / 2**20:,.0f} MB, over the {error.budget_bytes / 2**20:,.0f} MB memory budget.\n\n"
+            "Split the workbook into smaller files or convert it with `map_it_batch.py --stream`.")
+
+
+def _over_budget(report, error_msg):
+    """Fail a conversion that does not fit the memory budget, marking report['over_budget']"""
+    report['over_budget'] = True
+    return _failed(report, error_msg)
+
+
+def _read_failed(error_msg):
+    """Result of read_workbook for a workbook that cannot be converted"""
+    return {'frame': None, 'columns': {}, 'rows': 0, 'error': error_msg}
+
+
+def read_workbook(uploaded_file, stats=NULL_STATS, sheet_name=0):
+    """
+    Read a sheet of an Excel file object (the first by default), detect the
+    required columns and clean them.
+
+    Only the first HEADER_SNIFF_ROWS rows are read to find the header row
+    and the four required columns; the body is then read with just those
+    columns, so the sheet's other columns are never parsed.
+
+    Returns a dict with the cleaned 'frame' (only the four mapped columns,
+    plus the control-total column when the sheet has one), the detected
+    'columns', their match 'confidence', the 'control' column name or None,
+    the 0-based 'header_row', the number of 'rows' read and an 'error'
+    message, which is None when the workbook can be converted.
+    """
+    # Reset file pointer to beginning
+    uploaded_file.seek(0)
+
+    # First verify it's actually an Excel file by checking the file signature
+    file_signature = uploaded_file.read(8)
+    uploaded_file.seek(0)
+
+    is_excel = any(file_signature.startswith(sig) for sig in EXCEL_SIGNATURES)
+    if not is_excel:
+        return _read_failed(NOT_EXCEL_MESSAGE)
+
+    # Try multiple approaches to read the top of the sheet
+    with stats.stage('read_header'):
+        head, read_errors = _read_excel(uploaded_file, file_signature, sheet_name, header=None, nrows=HEADER_SNIFF_ROWS)
+    if head is None:
+        return _read_failed(_unreadable_message(read_errors))
+
+    with stats.stage('detect_columns'):
+        header_row, names = sniff_header_row(head.itertuples(index=False, name=None))
+        columns, confidence, error_msg = find_columns(names)
+    if error_msg:
+        return _read_failed(error_msg)
+    control = find_control_column(names, columns)
+
+    positions = sorted({names.index(column) for column in [*columns.values(), control] if column is not None})
+    with stats.stage('read'):
+        uploaded_file.seek(0)
+        df, read_errors = _read_excel(uploaded_file, file_signature, sheet_name, header=header_row, usecols=positions)
+    if df is None:
+        return _read_failed(_unreadable_message(read_errors))
+    # Keep the names detected from the full header row, whatever read_excel calls the selected columns
+    df.columns = [names[position] for position in positions]
+    stats.count('rows_read', len(df))
+
+    # Only the mapped columns are ever read, so only those are cleaned and kept
+    with stats.stage('clean'):
+        df = validate_and_clean_dataframe(df)
+    stats.count('cells_cleaned', df.size)
+    return {'frame': df, 'columns': columns, 'confidence': confidence, 'control': control, 'header_row': header_row,
+            'rows': len(df), 'error': None}
+
+
+def _import_readers(uploaded_file):
+    """Import the libraries that read_workbook needs for an Excel file object's type"""
+    uploaded_file.seek(0)
+    is_xls = uploaded_file.read(8).startswith(b'\xD0\xCF\x11\xE0')
+    uploaded_file.seek(0)
+    import pandas  # noqa: F401
+
+    if not is_xls:
+        import openpyxl  # noqa: F401
+    elif importlib.util.find_spec('xlrd') is not None:
+        import xlrd  # noqa: F401
+
+
+def _read_excel(uploaded_file, file_signature, sheet_name=0, **options):
+    """
+    Read a sheet with whichever engine works, returning (df or None, read errors).
+
+    options (header, nrows, usecols) are passed on to read_excel; header
+    defaults to the first row. The engine is picked from the file signature,
+    so only the engine for the file's type is imported.
+    """
+    import pandas as pd
+
+    options.setdefault('header', 0)
+    df = None
+    read_errors = []
+    is_xls = file_signature.startswith(b'\xD0\xCF\x11\xE0')
+
+    # Method 1: Try with openpyxl engine (for .xlsx)
+    if not is_xls:
+        try:
+            df = pd.read_excel(uploaded_file, engine='openpyxl', sheet_name=sheet_name, **options)
+        except Exception as e:
+            read_errors.append(f"openpyxl engine: {str(e)}")
+            uploaded_file.seek(0)
+
+    # Method 2: Try with xlrd engine (for older .xls files)
+    if is_xls:
+        if importlib.util.find_spec('xlrd') is None:
+            read_errors.append("xlrd not installed (required for .xls files)")
+        else:
+            try:
+                df = pd.read_excel(uploaded_file, engine='xlrd', sheet_name=sheet_name, **options)
+            except Exception as e:
+                read_errors.append(f"xlrd engine: {str(e)}")
+                uploaded_file.seek(0)
+
+    # Method 3: Try default engine (will use openpyxl for .xlsx)
+    if df is None:
+        try:
+            df = pd.read_excel(uploaded_file, sheet_name=sheet_name, **options)
+        except Exception as e:
+            read_errors.append(f"default engine: {str(e)}")
+
+    return df, read_errors
+
+
+def _unreadable_message(read_errors):
+    """Error message for a workbook none of the engines could read"""
+    error_msg = "❌ **Unable to read Excel file.**\n\n"
+    error_msg += "**Possible solutions:**\n"
+    error_msg += "- Make sure you're uploading a valid Excel file (.xlsx or .xls)\n"
+
+    if any("xlrd" in err.lower() for err in read_errors):
+        error_msg += "\n**For .xls files:**\n"
+        error_msg += "This environment doesn't have the 'xlrd' package installed.\n"
+        error_msg += "You can either:\n"
+        error_msg += "1. Save your file as .xlsx format instead, or\n"
+        error_msg += "2. Install xlrd with: `pip install xlrd`\n"
+
+    error_msg += "\n**Technical details:**\n"
+    error_msg += "\n".join(f"- {err}" for err in read_errors)
+    return error_msg
+
+
+def workbook_digest(uploaded_file):
+    """SHA-256 of a file object's full contents, used as a content-addressed cache key"""
+    uploaded_file.seek(0)
+    digest = hashlib.sha256()
+    for block in iter(lambda: uploaded_file.read(1024 * 1024), b''):
+        digest.update(block)
+    uploaded_file.seek(0)
+    return digest.hexdigest()
+
+
+def convert_file(uploaded_file, effective_date, cache=None, stats=None, sheet_name=0, mapping=None, store=None,
+                 delta=False):
+    """
+    Convert an Excel workbook into CreditEase transaction rows.
+
+    uploaded_file may be a path or a binary file object. Returns a
+    (result_df, report) pair; on failure result_df is None and
+    report['error'] holds a message explaining what went wrong.
+
+    When an LRUCache is given, the cleaned workbook is cached by the hash of
+    the file's bytes, so converting the same upload again (for example with a
+    different effective date) skips reading and cleaning the workbook.
+    report['cache'] records whether it was a 'hit' or a 'miss'.
+
+    When a RunStats is given, stage timings and counters are collected into it
+    and copied to report['stats']. sheet_name selects the sheet to convert,
+    by position or name, as for read_excel.
+
+    mapping is a TransactionMapping or a pinned mapping version; by default
+    the current mapping file is used. report['mapping'] records which one.
+
+    With a GroupStore, contract groups converted before are taken from it
+    instead of being parsed again, and with delta only groups not already
+    posted for this effective date are returned. report['incremental']
+    counts the reused and already-posted groups; the groups returned are
+    only recorded as posted by record_posted_groups, once the batch is
+    exported.
+
+    A workbook not already cached is first sized up with memory_plan
+    (recorded in report['memory_plan']): one too large to read into memory
+    within MEMORY_BUDGET_MB is converted row by row instead, or refused when
+    even that would not fit, with report['over_budget'] set.
+    """
+    if isinstance(uploaded_file, (str, os.PathLike)):
+        with open(uploaded_file, 'rb') as handle:
+            return convert_file(handle, effective_date, cache, stats, sheet_name, mapping, store, delta)
+
+    if stats is None:
+        return _convert(uploaded_file, effective_date, cache, NULL_STATS, sheet_name, mapping, store, delta)
+    result_df, report = _convert(uploaded_file, effective_date, cache, stats, sheet_name, mapping, store, delta)
+    report['stats'] = stats.as_dict()
+    return result_df, report
+
+
+def _convert(uploaded_file, effective_date, cache, stats, sheet_name=0, mapping=None, store=None, delta=False):
+    """Body of convert_file, run with a RunStats or NULL_STATS"""
+    report = new_report(getattr(uploaded_file, 'name', None))
+    try:
+        mapping = resolve_mapping(mapping)
+    except MappingError as e:
+        return _failed(report, f"❌ **Transaction mapping error:** {e}")
+    report['mapping'] = mapping.describe()
+    if getattr(stats, 'memory', None) is not None:
+        # Before the first stage, so the memory baseline does not charge the readers' one-time cost to this file
+        _import_readers(uploaded_file)
+
+    try:
+        workbook = None
+        if cache is not None:
+            with stats.stage('hash'):
+                key = workbook_digest(uploaded_file)
+            report['digest'] = key
+            if sheet_name != 0:
+                key = f"{key}:{sheet_name}"
+            workbook = cache.get(key)
+            report['cache'] = 'miss' if workbook is None else 'hit'
+
+        if store is not None and 'digest' not in report:
+            # Recorded with the groups once the batch is posted
+            with stats.stage('hash'):
+                report['digest'] = workbook_digest(uploaded_file)
+
+        if workbook is None:
+            # Size the workbook up before reading it, so a file too large for the budget is never loaded whole
+            with stats.stage('estimate_memory'):
+                plan = memory_plan(uploaded_file, sheet_name)
+            report['memory_plan'] = plan
+            if plan['path'] == 'rejected':
+                return _over_budget(report, _too_large_message(plan))
+            if plan['path'] == 'low_memory':
+                # Not cached: the point of reading row by row is not holding more than this conversion needs
+                if cache is not None:
+                    report['cache'] = 'skipped'
+                workbook = read_workbook_rows(uploaded_file, stats, sheet_name, plan['rows'])
+            else:
+                workbook = read_workbook(uploaded_file, stats, sheet_name)
+            if cache is not None and plan['path'] == 'in_memory':
+                frame_bytes = 0 if workbook['frame'] is None else int(workbook['frame'].memory_usage(deep=True).sum())
+                cache.put(key, workbook, size=frame_bytes)
+
+        report['rows'] = workbook['rows']
+        if workbook['error']:
+            return _failed(report, workbook['error'])
+
+        df, columns = workbook['frame'], workbook['columns']
+        report['columns'] = dict(columns)
+        report['column_confidence'] = dict(workbook['confidence'])
+        report['header_row'] = workbook['header_row']
+        # Every row is validated before any is converted, so a failing file is not parsed at all
+        with stats.stage('validate'):
+            errors = validation_table(df, columns)
+        if len(errors):
+            stats.count('validation_errors', len(errors))
+            return _validation_failed(report, errors)
+
+        # Group and map in one pass over the column arrays; merged groups are
+        # written before single rows
+        dates = BatchDates(effective_date)
+        merged_data = ResultBuilder(mapping, dates)
+        single_data = ResultBuilder(mapping, dates)
+        parser_stats = mapping.parser.stats()
+        pipeline = RowPipeline(effective_date, merged_data.add, single_data.add, mapping=mapping, store=store,
+                               delta=delta)
+        control = workbook.get('control')
+        with stats.stage('convert'):
+            rows = zip(df.index, *(df[column].to_numpy() for column in [*(columns[role] for role in ROLES), control]
+                                   if column is not None))
+            done = 0
+            stats.progress(done, len(df))
+            for block in iter(lambda: list(islice(rows, PROGRESS_ROWS)), []):
+                for row in block:
+                    pipeline.add(*row)
+                done += len(block)
+                stats.progress(done, len(df))
+            pipeline.finish()
+        report['comment_cache'] = comment_parser_delta(parser_stats, mapping.parser)
+        _count_pipeline(stats, pipeline, report['comment_cache'])
+        if store is not None:
+            report['incremental'] = _incremental_report(pipeline)
+            report['group_fingerprints'] = pipeline.fingerprints
+        report['reconciliation'] = pipeline.reconciliation.report(mapping, control)
+
+        if not pipeline.transactions and not pipeline.skipped_transactions:
+            return _failed(report, "❌ No valid transactions found in the file. Please check your comment/description format.")
+
+        with stats.stage('build_result'):
+            merged_data.extend(single_data)
+            result_df = merged_data.frame()
+        report['transactions'] = len(result_df)
+        return result_df, report
+
+    except ConversionCancelled:
+        raise
+    except MemoryBudgetExceeded as e:
+        return _over_budget(report, _over_budget_message(e))
+    except Exception as e:
+        error_msg = f"❌ **Error processing file:** {str(e)}\n\n"
+        error_msg += "**Common solutions:**\n"
+        error_msg += "- Ensure the file is a valid Excel (.xlsx or .xls) file\n"
+        error_msg += "- Check that the file is not corrupted\n"
+        error_msg += "- Verify that required columns exist\n"
+        error_msg += "- Try saving the Excel file in a different format\n"
+        return _failed(report, error_msg)
+
+
+def read_workbook_rows(uploaded_file, stats=NULL_STATS, sheet_name=0, total=None):
+    """
+    Read a sheet of an .xlsx file object like read_workbook, keeping only the mapped columns of each row.
+
+    read_excel holds every cell of the sheet before it selects the columns
+    to keep; here rows are read one at a time through openpyxl's read-only
+    mode and only the cells of the mapped columns are kept. Cells are
+    converted as read_excel converts them and the kept columns are parsed by
+    the same pandas parser, so the frame is the one read_workbook returns.
+    total is the sheet's row count, for progress.
+
+    Returns the same dict as read_workbook.
+    """
+    rows = iter_excel_rows(uploaded_file, sheet_name)
+    try:
+        sheet = _read_sheet_header(rows, stats)
+        if sheet['error']:
+            return _read_failed(sheet['error'])
+        with stats.stage('read'):
+            df = next(_sheet_frames(rows, sheet, stats=stats, total=total))
+    except (ConversionCancelled, MemoryBudgetExceeded):
+        raise
+    except Exception as e:
+        return _read_failed(_unreadable_message([f"openpyxl engine: {str(e)}"]))
+    finally:
+        rows.close()
+    stats.count('rows_read', len(df))
+
+    with stats.stage('clean'):
+        df = validate_and_clean_dataframe(df)
+    stats.count('cells_cleaned', df.size)
+    return {'frame': df, 'columns': sheet['columns'], 'confidence': sheet['confidence'], 'control': sheet['control'],
+            'header_row': sheet['header_row'], 'rows': len(df), 'error': None}
+
+
+def workbook_sheet_names(uploaded_file):
+    """Names of every sheet in an Excel file object, or None if the workbook cannot be opened"""
+    import pandas as pd
+
+    uploaded_file.seek(0)
+    try:
+        with pd.ExcelFile(uploaded_file) as book:
+            return list(book.sheet_names)
+    except Exception:
+        return None
+    finally:
+        uploaded_file.seek(0)
+
+
+def source_label(report):
+    """Human-readable name of one converted source, including the sheet when there is one"""
+    if report.get('sheet') is None:
+        return report['source']
+    return f"{report['source']} › {report['sheet']}"
+
+
+def _source_jobs(sources, all_sheets):
+    """
+    Split (name, data) sources into (name, data, sheet) conversion jobs.
+
+    data is a path or the workbook's bytes. With all_sheets every sheet is a
+    job of its own; otherwise, and for workbooks whose sheets cannot be
+    listed, only the first sheet is converted and sheet is None.
+    """
+    jobs = []
+    for name, data in sources:
+        sheets = None
+        if all_sheets:
+            if isinstance(data, (str, os.PathLike)):
+                with open(data, 'rb') as handle:
+                    sheets = workbook_sheet_names(handle)
+            else:
+                sheets = workbook_sheet_names(BytesIO(data))
+        jobs.extend((name, data, sheet) for sheet in (sheets or [None]))
+    return jobs
+
+
+def _convert_job(name, data, sheet, effective_date, stats, mapping_version, store_path=None, delta=False):
+    """
+    Convert one sheet of one source with its own stats (a RunStats or None).
+
+    Runs in a worker process unless the batch has a single worker, so it
+    takes and returns plain data.
+    """
+    handle = open(data, 'rb') if isinstance(data, (str, os.PathLike)) else BytesIO(data)
+    store = None if store_path is None else GroupStore(store_path)
+    try:
+        with handle:
+            result_df, report = convert_file(handle, effective_date, stats=stats,
+                                             sheet_name=0 if sheet is None else sheet, mapping=mapping_version,
+                                             store=store, delta=delta)
+    finally:
+        if store is not None:
+            store.close()
+    report['source'] = name
+    report['sheet'] = sheet
+    return result_df, report
+
+
+def convert_sources(sources, effective_date, all_sheets=False, workers=None, stats=None, mapping=None, store=None,
+                    delta=False):
+    """
+    Convert several workbooks, and optionally every sheet of each, into one CreditEase batch.
+
+    sources is a list of (name, data) pairs where data is a path or the
+    workbook's bytes. Sheets are read and converted concurrently across a
+    pool of up to workers processes (one per CPU core by default) and their
+    rows are concatenated in source order, then sheet order, whatever order
+    the workers finish in.
+
+    Returns a (result_df, report) pair like convert_file. report['sources']
+    holds each sheet's own report (rows, transactions, columns and error);
+    if any of them failed, result_df is None and report['error'] lists the
+    failures, so a partial batch is never produced. Every sheet is converted
+    with the same mapping version, and with store and delta, as for
+    convert_file; the workers open their own connection to the store.
+    """
+    run_stats = stats or NULL_STATS
+    report = new_report(', '.join(name for name, _ in sources))
+    try:
+        mapping = resolve_mapping(mapping)
+    except MappingError as e:
+        return _failed(report, f"❌ **Transaction mapping error:** {e}")
+    report['mapping'] = mapping.describe()
+
+    digest = hashlib.sha256(repr(all_sheets).encode())
+    for name, data in sources:
+        digest.update(name.encode('utf-8'))
+        digest.update(hashlib.sha256(data).digest() if isinstance(data, bytes) else os.fsencode(os.path.abspath(data)))
+    report['digest'] = digest.hexdigest()
+
+    with run_stats.stage('list_sheets'):
+        jobs = _source_jobs(sources, all_sheets)
+
+    store_path = None if store is None else store.path
+    with run_stats.stage('convert_sources'):
+        import multiprocessing
+        from concurrent.futures import ProcessPoolExecutor, as_completed
+
+        workers = min(workers or os.cpu_count() or 1, len(jobs))
+        run_stats.progress(0, len(jobs))
+        if workers > 1:
+            # Forking is unsafe here: the app calls this from a job thread while other threads hold locks
+            executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+            cancelled = False
+            try:
+                futures = [executor.submit(_convert_job, *job, effective_date, None if stats is None else RunStats(),
+                                           mapping.version, store_path, delta)
+                           for job in jobs]
+                for done, _ in enumerate(as_completed(futures), 1):
+                    run_stats.progress(done, len(jobs))
+                results = [future.result() for future in futures]
+            except ConversionCancelled:
+                cancelled = True
+                raise
+            finally:
+                # A cancelled batch drops the sheets not started yet and does not wait for the running ones
+                executor.shutdown(wait=not cancelled, cancel_futures=cancelled)
+        else:
+            results = []
+            for job in jobs:
+                # In this process, so each sheet's stats can stop it like the batch's would
+                results.append(_convert_job(*job, effective_date, None if stats is None else stats.source_stats(),
+                                            mapping, store_path, delta))
+                run_stats.progress(len(results), len(jobs))
+
+    source_reports = [source_report for _, source_report in results]
+    report['sources'] = source_reports
+    report['rows'] = sum(source_report['rows'] for source_report in source_reports)
+    report['comment_cache'] = {
+        counter: sum(source_report.get('comment_cache', {}).get(counter, 0) for source_report in source_reports)
+        for counter in ('hits', 'misses', 'evictions', 'parts', 'unmatched')
+    }
+    for source_report in source_reports:
+        run_stats.add_counters(source_report.get('stats', {}).get('counters', {}))
+    if store is not None:
+        report['incremental'] = {
+            counter: sum(source_report.get('incremental', {}).get(counter, 0) for source_report in source_reports)
+            for counter in ('groups', 'reused', 'already_posted', 'skipped_transactions')
+        }
+        report['incremental']['delta'] = delta
+        report['group_fingerprints'] = [fingerprint for source_report in source_reports
+                                        for fingerprint in source_report.pop('group_fingerprints', [])]
+    if len(source_reports) == 1:
+        report['columns'] = source_reports[0]['columns']
+    reconciliations = [source_report['reconciliation'] for source_report in source_reports
+                       if 'reconciliation' in source_report]
+    if reconciliations:
+        report['reconciliation'] = merge_reconciliations(reconciliations)
+
+    failed = [source_report for source_report in source_reports if source_report['error']]
+    if len(source_reports) == 1 and failed:
+        result = _failed(report, failed[0]['error'])
+    elif failed:
+        error_msg = "\n\n".join(f"**{source_label(source_report)}:**\n\n{source_report['error']}"
+                                for source_report in failed)
+        result = _failed(report, error_msg)
+    else:
+        with run_stats.stage('merge'):
+            result_df = concat_results([result_df for result_df, _ in results])
+        report['transactions'] = len(result_df)
+        result = result_df, report
+
+    if stats is not None:
+        report['stats'] = stats.as_dict()
+    return result
+
+
+def _header_names(header_values):
+    """Column names for a header row, naming blank and duplicate headers like read_excel does"""
+    values = list(header_values)
+    while values and values[-1] is None:
+        values.pop()
+
+    names = []
+    counts = {}
+    for position, value in enumerate(values):
+        name = f"Unnamed: {position}" if value is None else value
+        count = counts.get(name, 0)
+        while count > 0:
+            counts[name] = count + 1
+            name = f"{name}.{count}"
+            count = counts.get(name, 0)
+        counts[name] = count + 1
+        names.append(name)
+    return names
+
+
+def _excel_cell_value(cell):
+    """Convert an openpyxl read-only cell exactly as read_excel's openpyxl reader does"""
+    if cell.value is None:
+        return ''
+    if cell.data_type == 'e':
+        return float('nan')
+    if cell.data_type == 'n':
+        value = int(cell.value)
+        return value if value == cell.value else float(cell.value)
+    return cell.value
+
+
+def iter_excel_rows(source, sheet_name=0):
+    """Yield a worksheet's rows (by position or name) as lists of cell values converted as read_excel converts them"""
+    import openpyxl
+
+    # The options read_excel opens workbooks with
+    workbook = openpyxl.load_workbook(source, read_only=True, data_only=True, keep_links=False)
+    try:
+        sheet = workbook.worksheets[sheet_name] if isinstance(sheet_name, int) else workbook[sheet_name]
+        sheet.reset_dimensions()
+        for cells in sheet.rows:
+            yield [_excel_cell_value(cell) for cell in cells]
+    finally:
+        workbook.close()
+
+
+def _trim_sheet_data(rows):
+    """Drop trailing blank cells and rows and pad the rest to one width, as read_excel does"""
+    data = []
+    last_row_with_data = -1
+    for row_number, row in enumerate(rows):
+        while row and row[-1] == '':
+            row.pop()
+        if row:
+            last_row_with_data = row_number
+        data.append(row)
+    data = data[:last_row_with_data + 1]
+    width = max((len(row) for row in data), default=0)
+    return [row + [''] * (width - len(row)) for row in data]
+
+
+def _parse_sheet_data(data, width=0, nrows=None):
+    """
+    A DataFrame of rows of converted cells, without a header row.
+
+    The rows go through the parser read_excel uses, with its options, so
+    each column's type is inferred from all its values exactly as it would
+    be by read_excel; nrows limits them as for read_excel. An empty sheet
+    gives width empty columns.
+    """
+    import pandas as pd
+    from pandas.io.parsers import TextParser
+
+    if not data:
+        return pd.DataFrame({position: pd.Series(dtype=object) for position in range(width)})
+    return TextParser(data, header=None, nrows=nrows, skip_blank_lines=False).read(nrows=nrows)
+
+
+def _read_sheet_header(rows, stats=NULL_STATS):
+    """
+    Find the header row and columns of a sheet from the first rows of iter_excel_rows.
+
+    Returns a dict with the header_row, the column names, the detected
+    columns, their confidence and the control column, the sorted positions
+    of the columns to keep and the sniffed rows below the header, which are
+    data. error holds a message when the required columns are not found.
+    """
+    with stats.stage('read_header'):
+        # read_excel reads one row past nrows when there is no header
+        head = list(islice(rows, HEADER_SNIFF_ROWS + 1))
+        head_df = _parse_sheet_data(_trim_sheet_data(head), nrows=HEADER_SNIFF_ROWS)
+
+    with stats.stage('detect_columns'):
+        header_row, names = sniff_header_row(head_df.itertuples(index=False, name=None))
+        columns, confidence, error_msg = find_columns(names)
+    control = None if error_msg else find_control_column(names, columns)
+    kept = [] if error_msg else [*columns.values(), control]
+    return {'header_row': header_row, 'names': names, 'columns': columns, 'confidence': confidence,
+            'control': control, 'positions': sorted({names.index(column) for column in kept if column is not None}),
+            'data': head[header_row + 1:], 'error': error_msg}
+
+
+def _sheet_frames(rows, sheet, chunk_rows=None, stats=NULL_STATS, total=None):
+    """
+    Frames of the kept columns of a sheet's data rows, chunk_rows rows at a time.
+
+    rows continues the iter_excel_rows iterator that sheet was read from by
+    _read_sheet_header. Each frame is parsed by _parse_sheet_data on its
+    own, named after the sheet's columns and indexed by row position in the
+    data. Without chunk_rows the sheet is one frame, the one read_excel
+    would return; an empty sheet gives one empty frame. total is the
+    sheet's row count, for progress.
+    """
+    positions = sheet['positions']
+    names = [sheet['names'][position] for position in positions]
+    data = []
+    start = 0
+    # Blank rows only count once a later row has data, as read_excel drops trailing ones
+    pending_blank_rows = 0
+    blank = [''] * len(positions)
+    stats.progress(0, total)
+    for row in chain(sheet['data'], rows):
+        if not any(value != '' for value in row):
+            pending_blank_rows += 1
+            continue
+        data.extend(list(blank) for _ in range(pending_blank_rows))
+        pending_blank_rows = 0
+        data.append([row[position] if position < len(row) else '' for position in positions])
+        read = start + len(data)
+        if read % PROGRESS_ROWS == 0:
+            stats.progress(read, total if total is None else max(total, read))
+        if chunk_rows is not None and len(data) >= chunk_rows:
+            # The rows are dropped before the frame is handed on, so only one copy is held
+            frame, data = _sheet_frame(data, names, start), []
+            start += len(frame)
+            yield frame
+    if data or not start:
+        frame, data = _sheet_frame(data, names, start), []
+        yield frame
+
+
+def _sheet_frame(data, names, start=0):
+    """One parsed frame of _sheet_frames, for the data rows from position start"""
+    df = _parse_sheet_data(data, len(names))
+    df.columns = names
+    if start:
+        df.index += start
+    return df
+
+
+def _typed_like_sheet(dtypes, blank, df, columns):
+    """
+    Whether a frame of _sheet_frames typed its columns as the earlier frames did.
+
+    The frame's types are recorded in dtypes and the columns it leaves blank in blank.
+
+    The parser types a column from all of its values, so frames parsed one
+    chunk at a time add up to the sheet's own frame only while every chunk
+    gives a column the same type. A chunk in which the column is blank takes
+    no part, unless the others type it as integers or booleans, which a
+    missing value turns to floats or objects.
+    """
+    for column in columns:
+        values = df[column]
+        if values.isna().all():
+            blank.add(column)
+        elif dtypes.setdefault(column, values.dtype) != values.dtype:
+            return False
+    return all(dtypes.get(column, object) in (object, float) for column in blank)
+
+
+def convert_file_streaming(uploaded_file, effective_date, output_path, chunk_size=5000, stats=None, mapping=None):
+    """
+    Convert an .xlsx workbook straight into a CreditEase CSV with bounded memory.
+
+    Rows are read one at a time through openpyxl's read-only mode, each run of
+    consecutive rows for the same contract is merged and mapped as soon as it
+    ends, and CreditEase rows are written out in chunks of chunk_size. Rows of
+    multi-row contracts are written first and single rows are spooled to a
+    temporary file and appended afterwards, so the CSV matches convert_file.
+    Nothing is written to output_path unless the whole file converts.
+
+    Rows are read as read_workbook_rows reads them and each chunk of
+    chunk_size rows is parsed and cleaned on its own. When a chunk types a
+    column differently than the chunks before it, as a column mixing numbers
+    with numeric-looking text can be, the output so far is dropped and the
+    sheet is read again as one frame, as read_workbook_rows reads it, so the
+    CSV is always the one convert_file writes. .xls workbooks cannot be read
+    in read-only mode and are converted in memory with convert_file instead.
+
+    Returns an (output_path, report) pair; output_path is None on failure and
+    report['error'] holds the message. A RunStats given as stats is filled in
+    and copied to report['stats'] as with convert_file.
+    """
+    if isinstance(uploaded_file, (str, os.PathLike)):
+        with open(uploaded_file, 'rb') as handle:
+            return convert_file_streaming(handle, effective_date, output_path, chunk_size, stats, mapping)
+
+    if stats is None:
+        return _convert_streaming(uploaded_file, effective_date, output_path, chunk_size, NULL_STATS, mapping)
+    output_path, report = _convert_streaming(uploaded_file, effective_date, output_path, chunk_size, stats, mapping)
+    report['stats'] = stats.as_dict()
+    return output_path, report
+
+
+def _convert_streaming(uploaded_file, effective_date, output_path, chunk_size, stats, mapping=None):
+    """Body of convert_file_streaming, run with a RunStats or NULL_STATS"""
+    report = new_report(getattr(uploaded_file, 'name', None))
+    try:
+        mapping = resolve_mapping(mapping)
+    except MappingError as e:
+        return _failed(report, f"❌ **Transaction mapping error:** {e}")
+    report['mapping'] = mapping.describe()
+    uploaded_file.seek(0)
+    file_signature = uploaded_file.read(8)
+    uploaded_file.seek(0)
+
+    if not any(file_signature.startswith(sig) for sig in EXCEL_SIGNATURES):
+        return _failed(report, NOT_EXCEL_MESSAGE)
+
+    if not file_signature.startswith(b'\x50\x4B\x03\x04'):
+        result_df, report = _convert(uploaded_file, effective_date, None, stats, mapping=mapping)
+        if result_df is None:
+            return None, report
+        with stats.stage('export'):
+            write_csv(result_df, output_path)
+        return output_path, report
+    if getattr(stats, 'memory', None) is not None:
+        # Rows are read through openpyxl alone; imported before the first stage as in _convert
+        import openpyxl  # noqa: F401
+
+    output_dir = os.path.dirname(os.path.abspath(output_path))
+    partial = tempfile.NamedTemporaryFile('w', newline='', encoding='utf-8', dir=output_dir,
+                                          prefix='.map_it_', suffix='.partial', delete=False)
+    spool = tempfile.TemporaryFile('w+', newline='', encoding='utf-8')
+    rows = iter_excel_rows(uploaded_file)
+    try:
+        merged_writer = csv.writer(partial, lineterminator=os.linesep)
+        single_writer = csv.writer(spool, lineterminator=os.linesep)
+
+        sheet = _read_sheet_header(rows, stats)
+        if sheet['error']:
+            return _failed(report, sheet['error'])
+        columns, control = sheet['columns'], sheet['control']
+        report['columns'] = columns
+        report['column_confidence'] = sheet['confidence']
+        report['header_row'] = sheet['header_row']
+        kept = [column for column in [*(columns[role] for role in ROLES), control] if column is not None]
+
+        dates = BatchDates(effective_date)
+        merged_chunk = ResultBuilder(mapping, dates)
+        single_chunk = ResultBuilder(mapping, dates)
+
+        def emit_merged(*group):
+            merged_chunk.add(*group)
+            if len(merged_chunk) >= chunk_size:
+                merged_writer.writerows(merged_chunk.rows())
+                merged_chunk.clear()
+
+        def emit_single(*group):
+            single_chunk.add(*group)
+            if len(single_chunk) >= chunk_size:
+                single_writer.writerows(single_chunk.rows())
+                single_chunk.clear()
+
+        def stream(frames, chunked):
+            """Run the rows of frames through a new pipeline; None if a chunk is typed unlike the others"""
+            for output in (partial, spool):
+                output.seek(0)
+                output.truncate()
+            merged_writer.writerow(CREDITEASE_COLUMNS)
+            merged_chunk.clear()
+            single_chunk.clear()
+            pipeline = RowPipeline(effective_date, emit_merged, emit_single, mapping=mapping)
+            dtypes, blank = {}, set()
+            for df in frames:
+                if chunked and not _typed_like_sheet(dtypes, blank, df, kept):
+                    return None
+                df = validate_and_clean_dataframe(df)
+                for row in zip(df.index, *(df[column].to_numpy() for column in kept)):
+                    pipeline.add(*row)
+            pipeline.finish()
+            return pipeline
+
+        parser_stats = mapping.parser.stats()
+        with stats.stage('stream'):
+            pipeline = stream(_sheet_frames(rows, sheet, chunk_size, stats), chunked=True)
+        if pipeline is None:
+            # Read the sheet again from the top, whole
+            rows.close()
+            uploaded_file.seek(0)
+            rows = iter_excel_rows(uploaded_file)
+            sheet = _read_sheet_header(rows, stats)
+            parser_stats = mapping.parser.stats()
+            with stats.stage('stream'):
+                pipeline = stream(_sheet_frames(rows, sheet, stats=stats), chunked=False)
+            stats.count('stream_rereads')
+        report['rows'] = pipeline.rows
+        report['comment_cache'] = comment_parser_delta(parser_stats, mapping.parser)
+        report['reconciliation'] = pipeline.reconciliation.report(mapping, control)
+        stats.count('rows_read', pipeline.rows)
+        stats.count('cells_cleaned', pipeline.rows * len({column for column in [*columns.values(), control] if column}))
+        _count_pipeline(stats, pipeline, report['comment_cache'])
+
+        if pipeline.error_count:
+            return _validation_failed(report, pipeline.error_table(columns))
+
+        report['transactions'] = pipeline.transactions
+        if not report['transactions']:
+            return _failed(report, "❌ No valid transactions found in the file. Please check your comment/description format.")
+
+        with stats.stage('export'):
+            merged_writer.writerows(merged_chunk.rows())
+            single_writer.writerows(single_chunk.rows())
+            spool.seek(0)
+            shutil.copyfileobj(spool, partial)
+            partial.close()
+        os.replace(partial.name, output_path)
+        return output_path, report
+
+    except MemoryBudgetExceeded as e:
+        return _over_budget(report, _over_budget_message(e))
+    except Exception as e:
+        error_msg = f"❌ **Error processing file:** {str(e)}\n\n"
+        error_msg += "**Common solutions:**\n"
+        error_msg += "- Ensure the file is a valid Excel (.xlsx or .xls) file\n"
+        error_msg += "- Check that the file is not corrupted\n"
+        error_msg += "- Verify that required columns exist\n"
+        error_msg += "- Try saving the Excel file in a different format\n"
+        return _failed(report, error_msg)
+
+    finally:
+        rows.close()
+        spool.close()
+        partial.close()
+        if os.path.exists(partial.name):
+            os.remove(partial.name)
@@ -0,0 +1,138 @@
+"""
+Background conversion jobs for the Map It app.
+
+A conversion submitted as a ConversionJob runs on an executor shared by
+every session, so the Streamlit script never blocks on it: each rerun only
+polls the job's progress, reruns caused by other widgets find the job
+still running instead of restarting it, and the user can cancel it.
+"""
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from map_it_core import ConversionCancelled, RunStats
+
+# Conversions running at once across all sessions; further jobs wait for a free worker
+JOB_WORKERS = int(os.environ.get('MAP_IT_JOB_WORKERS', 2))
+
+# How the stages recorded by RunStats are shown while a job runs
+STAGE_LABELS = {
+    'hash': "Hashing the upload",
+    'estimate_memory': "Estimating the memory needed",
+    'read_header': "Finding the header row",
+    'detect_columns': "Detecting columns",
+    'read': "Reading the workbook",
+    'clean': "Cleaning the data",
+    'validate': "Validating rows",
+    'stream': "Reading and converting rows",
+    'convert': "Converting rows",
+    'build_result': "Building the batch",
+    'list_sheets': "Listing sheets",
+    'convert_sources': "Converting sheets",
+    'merge': "Merging sheets",
+}
+
+
+def job_executor(workers=JOB_WORKERS):
+    """Thread pool the jobs of every session are submitted to"""
+    return ThreadPoolExecutor(max_workers=workers, thread_name_prefix='map_it_job')
+
+
+class JobStats(RunStats):
+    """
+    RunStats that also tracks a job's current stage and row count.
+
+    position is a (stage, done, total) tuple replaced as a whole, so the
+    script thread always reads a consistent snapshot. Once cancelled is set,
+    the next stage() or progress() call raises ConversionCancelled; a stage
+    that is not reporting progress, such as reading the workbook, runs to
+    its end first.
+    """
+
+    def __init__(self, cancelled, memory=False):
+        super().__init__(memory)
+        self.cancelled = cancelled
+        self.position = (None, 0, None)
+
+    @contextmanager
+    def stage(self, name):
+        self._check()
+        self.position = (name, 0, None)
+        with super().stage(name):
+            yield
+
+    def progress(self, done, total):
+        self.position = (self.position[0], done, total)
+        self._check()
+        super().progress(done, total)
+
+    def source_stats(self):
+        """Stats for one source of the job's batch, stopped by the same cancelled flag"""
+        return JobStats(self.cancelled, self.memory is not None)
+
+    def _check(self):
+        if self.cancelled.is_set():
+            raise ConversionCancelled()
+
+
+class ConversionJob:
+    """
+    One conversion running on a job executor.
+
+    func is called as func(*args, stats=stats) with the job's JobStats and
+    must return a (result_df, report) pair. key identifies the inputs the job
+    was submitted with, so the app can tell whether they changed since. With
+    memory, the job's stages are memory-tracked and held to the budget.
+    """
+
+    def __init__(self, key, executor, func, *args, memory=False):
+        self.key = key
+        self.submitted = time.monotonic()
+        self.finished = None
+        self._cancelled = threading.Event()
+        self.stats = JobStats(self._cancelled, memory)
+        self.future = executor.submit(self._run, func, args)
+
+    def _run(self, func, args):
+        try:
+            return func(*args, stats=self.stats)
+        finally:
+            self.finished = time.monotonic()
+
+    def cancel(self):
+        """Ask the job to stop; a job still waiting for a worker never starts"""
+        self._cancelled.set()
+        if self.future.cancel():
+            self.finished = time.monotonic()
+
+    def cancel_requested(self):
+        return self._cancelled.is_set()
+
+    def done(self):
+        return self.future.done()
+
+    def cancelled(self):
+        """Whether the job was cancelled before it finished"""
+        if not self.future.done():
+            return False
+        return self.future.cancelled() or isinstance(self.future.exception(), ConversionCancelled)
+
+    def result(self):
+        """The (result_df, report) pair of a finished job; raises what the conversion raised"""
+        return self.future.result()
+
+    def elapsed(self):
+        return (self.finished or time.monotonic()) - self.submitted
+
+    def progress(self):
+        """(fraction, text) for a progress bar; fraction is None while the stage reports no row count"""
+        stage, done, total = self.stats.position
+        if stage is None:
+            return None, "Waiting for a free worker"
+        label = STAGE_LABELS.get(stage, stage)
+        if not total:
+            return None, label
+        unit = 'sheets' if stage == 'convert_sources' else 'rows'
+        return min(done / total, 1.0), f"{label}: {done:,} of {total:,} {unit}"
@@ -0,0 +1,372 @@
+"""
+Local HTTP conversion service for Map It.
+
+Accepts a workbook's bytes over HTTP on localhost, converts it on a bounded
+pool of worker processes and streams the CreditEase CSV back, so an
+exporter can post files to Map It without a browser session.
+
+Endpoints:
+    POST /convert?effective_date=YYYY-MM-DD[&name=june.xlsx][&mapping_version=1][&all_sheets=1]
+        Body: the workbook bytes. Returns the CSV (chunked), 422 with a JSON
+        error report if the workbook cannot be converted (listing every
+        validation error when rows are incomplete), 413 when it does not
+        fit the memory budget, 503 when the service is at its concurrency
+        limit and 504 when the conversion runs past the timeout.
+    GET /health
+        Worker pool size, requests in progress and uptime as JSON.
+
+Example:
+    python map_it_service.py --port 8765 --workers 4
+    curl --data-binary @june.xlsx -o june_converted.csv \\
+        "http://127.0.0.1:8765/convert?effective_date=2024-06-30&name=june.xlsx"
+"""
+import argparse
+import ipaddress
+import json
+import multiprocessing
+import os
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from datetime import date
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO
+from urllib.parse import parse_qs, urlsplit
+
+from map_it_core import (
+    ConversionCancelled, convert_file, convert_sources, converted_filename, plain_report, validation_errors, write_csv
+)
+from map_it_jobs import JobStats
+
+DEFAULT_PORT = int(os.environ.get('MAP_IT_SERVICE_PORT', 8765))
+
+# Seconds a conversion may take, counted from when its request was accepted
+CONVERSION_TIMEOUT = float(os.environ.get('MAP_IT_SERVICE_TIMEOUT', 300))
+
+# Seconds a client may take to send its request, or keep an idle connection open
+READ_TIMEOUT = float(os.environ.get('MAP_IT_SERVICE_READ_TIMEOUT', 30))
+
+MAX_UPLOAD_MB = int(os.environ.get('MAP_IT_SERVICE_MAX_UPLOAD_MB', 200))
+
+# Bytes of CSV sent per chunk of a streamed response
+STREAM_BLOCK = 64 * 1024
+
+
+class Deadline:
+    """Stands in for a threading.Event as JobStats' cancelled flag: set once the wall-clock deadline passes"""
+
+    def __init__(self, deadline):
+        self.deadline = deadline
+
+    def is_set(self):
+        return time.time() >= self.deadline
+
+
+def convert_request(data, name, effective_date, mapping_version, all_sheets, deadline, spool_dir):
+    """
+    Convert one uploaded workbook in a worker process.
+
+    The CSV is written to a temporary file in spool_dir so only its path,
+    not the rows, goes back to the server. Returns (csv_path or None,
+    report). A conversion still running at deadline (time.time()) stops at
+    its next stage or progress step with report['timed_out'] set.
+    """
+    stats = JobStats(Deadline(deadline), memory=True)
+    try:
+        if all_sheets:
+            result_df, report = convert_sources([(name, data)], effective_date, all_sheets=True, workers=1,
+                                                stats=stats, mapping=mapping_version)
+        else:
+            upload = BytesIO(data)
+            upload.name = name
+            result_df, report = convert_file(upload, effective_date, stats=stats, mapping=mapping_version)
+        if result_df is None:
+            return None, _failure_report(report)
+
+        handle = tempfile.NamedTemporaryFile(dir=spool_dir, prefix='.map_it_', suffix='.csv', delete=False)
+        try:
+            with handle, stats.stage('export'):
+                write_csv(result_df, handle)
+        except BaseException:
+            os.remove(handle.name)
+            raise
+    except ConversionCancelled:
+        return None, {'source': name, 'error': "❌ The conversion took longer than the service timeout.",
+                      'timed_out': True}
+    report['stats'] = stats.as_dict()
+    return handle.name, report
+
+
+def _failure_report(report):
+    """A failed conversion's report as JSON-ready data, with every validation error as a {Row, Column, Rule} record"""
+    table = validation_errors(report)
+    report = plain_report(report)
+    if table is not None:
+        report['validation_errors'] = table.to_dict('records')
+    return report
+
+
+def _discard_csv(future):
+    """Remove the CSV of a conversion that finished after its request timed out"""
+    if future.exception() is None and future.result()[0] is not None:
+        os.remove(future.result()[0])
+
+
+class ServiceBusy(Exception):
+    """Every conversion slot is taken"""
+
+
+class ConversionService:
+    """
+    Worker pool and limits shared by every request of a server.
+
+    At most max_requests conversions are accepted at once, counting both
+    those running on the worker processes and those waiting for one;
+    further requests are turned away instead of queueing without bound.
+    Workers are started with spawn, which is safe next to the server's
+    threads and cheap since the core imports without pandas.
+    """
+
+    def __init__(self, workers=None, max_requests=None, timeout=CONVERSION_TIMEOUT, spool_dir=None):
+        self.workers = workers or os.cpu_count() or 1
+        self.max_requests = max_requests or 2 * self.workers
+        self.timeout = timeout
+        self.spool_dir = spool_dir or tempfile.gettempdir()
+        self.started = time.monotonic()
+        self._slots = threading.BoundedSemaphore(self.max_requests)
+        self._lock = threading.Lock()
+        self._active = 0
+        self._completed = 0
+        self._pool = self._new_pool()
+
+    def _new_pool(self):
+        return ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context('spawn'))
+
+    def health(self):
+        with self._lock:
+            return {
+                'status': 'ok',
+                'workers': self.workers,
+                'max_requests': self.max_requests,
+                'active_requests': self._active,
+                'completed_requests': self._completed,
+                'timeout_seconds': self.timeout,
+                'uptime_seconds': round(time.monotonic() - self.started, 1),
+            }
+
+    def acquire(self):
+        """Take a conversion slot, or raise ServiceBusy"""
+        if not self._slots.acquire(blocking=False):
+            raise ServiceBusy()
+        with self._lock:
+            self._active += 1
+
+    def release(self):
+        with self._lock:
+            self._active -= 1
+            self._completed += 1
+        self._slots.release()
+
+    def convert(self, data, name, effective_date, mapping_version=None, all_sheets=False):
+        """
+        (csv_path or None, report) of converting a workbook on the pool, within the timeout.
+
+        Raises FutureTimeoutError if no result arrives in time, e.g. because
+        the conversion is stuck reading a huge sheet.
+        """
+        accepted = time.time()
+        deadline = accepted + self.timeout
+        pool = self._pool
+        try:
+            future = pool.submit(convert_request, data, name, effective_date, mapping_version, all_sheets,
+                                 deadline, self.spool_dir)
+            # The worker checks the deadline itself; the grace covers it finishing its current stage
+            return future.result(timeout=self.timeout + min(30.0, self.timeout))
+        except FutureTimeoutError:
+            if not future.cancel():
+                future.add_done_callback(_discard_csv)
+            raise
+        except BrokenProcessPool:
+            # A worker died, e.g. out of memory; later requests get a fresh pool. Requests that were on the
+            # broken pool all land here, and only the first replaces it and shuts it down.
+            with self._lock:
+                replaced = self._pool is pool
+                if replaced:
+                    self._pool = self._new_pool()
+            if replaced:
+                pool.shutdown(wait=False, cancel_futures=True)
+            raise
+
+    def close(self):
+        self._pool.shutdown(cancel_futures=True)
+
+
+class ServiceHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    timeout = READ_TIMEOUT
+    max_upload_bytes = MAX_UPLOAD_MB * 1024 * 1024
+
+    @property
+    def service(self):
+        return self.server.service
+
+    def log_message(self, format, *args):
+        if not self.server.quiet:
+            super().log_message(format, *args)
+
+    def _send_json(self, status, payload, headers=()):
+        body = json.dumps(payload, indent=2, default=str).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for header, value in headers:
+            self.send_header(header, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _error(self, status, message, **extra):
+        self._send_json(status, dict(error=message, **extra))
+
+    def do_GET(self):
+        if urlsplit(self.path).path == '/health':
+            self._send_json(200, self.service.health())
+        else:
+            self._error(404, "Not found; use POST /convert or GET /health")
+
+    def do_POST(self):
+        # Until the body has been read, an error response also ends the connection
+        self.close_connection = True
+        url = urlsplit(self.path)
+        if url.path != '/convert':
+            self._error(404, "Not found; use POST /convert or GET /health")
+            return
+        query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        try:
+            effective_date = date.fromisoformat(query['effective_date'])
+        except (KeyError, ValueError):
+            self._error(400, "effective_date=YYYY-MM-DD is required")
+            return
+        try:
+            length = int(self.headers['Content-Length'])
+        except (TypeError, ValueError):
+            self._error(411, "Content-Length is required; send the workbook as the request body")
+            return
+        if length > self.max_upload_bytes:
+            self._error(413, f"Workbooks over {self.max_upload_bytes // (1024 * 1024)} MB are not accepted")
+            return
+
+        try:
+            self.service.acquire()
+        except ServiceBusy:
+            self._send_json(503, {'error': "Too many conversions in progress; retry shortly"},
+                            headers=[('Retry-After', '5')])
+            return
+        try:
+            try:
+                data = self.rfile.read(length)
+            except TimeoutError:
+                # Caught here, as future.result raises the same TimeoutError on Python 3.11+
+                self._error(408, "The workbook was not received within the read timeout")
+                return
+            if len(data) < length:
+                self._error(400, "The request body ended early")
+                return
+            self.close_connection = False
+            name = os.path.basename(query.get('name', 'upload.xlsx'))
+            csv_path, report = self.service.convert(data, name, effective_date, query.get('mapping_version'),
+                                                    query.get('all_sheets', '0') not in ('0', 'false', ''))
+        except FutureTimeoutError:
+            self._error(504, "The conversion took longer than the service timeout")
+            return
+        except BrokenProcessPool:
+            self._error(500, "The worker converting this workbook stopped unexpectedly")
+            return
+        finally:
+            self.service.release()
+
+        if csv_path is None:
+            status = 504 if report.get('timed_out') else 413 if report.get('over_budget') else 422
+            self._send_json(status, {'error': report['error'], 'report': report})
+            return
+        try:
+            self._stream_csv(csv_path, converted_filename(name), report)
+        finally:
+            os.remove(csv_path)
+
+    def _stream_csv(self, csv_path, file_name, report):
+        """Send a spooled CSV with chunked transfer encoding, one block at a time"""
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/csv; charset=utf-8')
+        self.send_header('Content-Disposition', f'attachment; filename="{file_name}"')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.send_header('X-Map-It-Rows', str(report['rows']))
+        self.send_header('X-Map-It-Transactions', str(report['transactions']))
+        self.send_header('X-Map-It-Mapping-Version', str(report.get('mapping', {}).get('version')))
+        self.end_headers()
+        try:
+            with open(csv_path, 'rb') as handle:
+                for block in iter(lambda: handle.read(STREAM_BLOCK), b''):
+                    self.wfile.write(b'%X\r\n%s\r\n' % (len(block), block))
+            self.wfile.write(b'0\r\n\r\n')
+        except (BrokenPipeError, ConnectionResetError):
+            # The client went away mid-download; nothing left to tell it
+            self.close_connection = True
+
+
+def make_server(service, host='127.0.0.1', port=DEFAULT_PORT, quiet=False):
+    """A threading HTTP server for service; port 0 picks a free port, and quiet turns off the request log"""
+    server = ThreadingHTTPServer((host, port), ServiceHandler)
+    server.daemon_threads = True
+    server.service = service
+    server.quiet = quiet
+    return server
+
+
+def loopback_host(value):
+    """argparse type accepting only hosts on this machine"""
+    if value == 'localhost':
+        return value
+    try:
+        if ipaddress.ip_address(value).is_loopback:
+            return value
+    except ValueError:
+        pass
+    raise argparse.ArgumentTypeError(f"{value} is not a loopback address; the service only listens on localhost")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Serve Map It conversions over HTTP on localhost.")
+    parser.add_argument('--host', type=loopback_host, default='127.0.0.1', help="Loopback address (default: 127.0.0.1)")
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT, help=f"Port (default: {DEFAULT_PORT})")
+    parser.add_argument('--workers', type=int, default=None,
+                        help="Worker processes converting workbooks (default: one per CPU core)")
+    parser.add_argument('--max-requests', type=int, default=None,
+                        help="Conversions accepted at once, running or waiting; more get 503 (default: 2 x workers)")
+    parser.add_argument('--timeout', type=float, default=CONVERSION_TIMEOUT,
+                        help=f"Seconds a conversion may take (default: {CONVERSION_TIMEOUT:g})")
+    parser.add_argument('--quiet', action='store_true', help="Do not log each request to stderr")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    service = ConversionService(args.workers, args.max_requests, args.timeout)
+    server = make_server(service, args.host, args.port, args.quiet)
+    host, port = server.server_address[:2]
+    print(f"Map It service on http://{host}:{port} ({service.workers} workers, "
+          f"{service.max_requests} conversions at once)", file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
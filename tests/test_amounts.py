@@ -0,0 +1,40 @@
+"""Integer-cents amount parsing and formatting"""
+import pandas as pd
+import pytest
+
+import map_it_core as core
+
+
+def test_format_cents_matches_float_repr():
+    cents = [0, 5, 50, 2500, 2550, 2597, 100050, -5, -2597, 2**53 - 1]
+    assert list(core.format_cents(cents)) == [repr(value / 100) for value in cents[:-1]] + ['90071992547409.91']
+
+
+def test_format_cents_of_no_amounts():
+    formatted = core.format_cents([])
+    assert formatted.shape == (0,)
+    assert formatted.dtype.kind == 'U'
+    assert list(core.parse_cents(pd.Series([], dtype=object))) == []
+
+
+def test_format_cents_agrees_with_the_float_path_on_parsed_amounts():
+    for text in ['25', '25.9', '25.97', '$1,000.50', '0.01', '1,234,567.8']:
+        cents = core.text_cents(text)
+        assert core.format_cents([cents])[0] == repr(core.extract_amount(text)), text
+
+
+def test_parse_cents():
+    texts = pd.Series(['25', '25.0', '25.5', '$1,000.50', ' $ 7.05 ', '-3.5', 'x', '', '1.234'])
+    assert list(core.parse_cents(texts)) == [2500, 2500, 2550, 100050, 705, -350, 0, 0, 0]
+
+
+@pytest.mark.parametrize('text, cents', [('25', 2500), ('$1,000.5', 100050), ('-0.05', -5), ('abc', None), ('1.234', None)])
+def test_text_cents_matches_parse_cents(text, cents):
+    assert core.text_cents(text) == cents
+    assert core.parse_cents(pd.Series([text]))[0] == (cents or 0)
+
+
+def test_format_money():
+    assert core.format_money(0) == '$0.00'
+    assert core.format_money(123450) == '$1,234.50'
+    assert core.format_money(-5) == '$-0.05'
@@ -0,0 +1,67 @@
+"""Appending batches to the posting archive, checking new batches against it and totalling it"""
+from datetime import date
+
+import pandas as pd
+import pytest
+
+pytest.importorskip('pyarrow')
+
+import map_it_core as core  # noqa: E402
+from map_it_archive import PostingArchive  # noqa: E402
+from workbook_generator import generate_workbook  # noqa: E402
+
+EFFECTIVE_DATE = date(2024, 6, 30)
+
+
+@pytest.fixture(scope='module')
+def result_df(tmp_path_factory):
+    path = str(tmp_path_factory.mktemp('archive') / 'export.xlsx')
+    generate_workbook(path, rows=200, seed=2)
+    result_df, report = core.convert_file(path, EFFECTIVE_DATE)
+    assert report['error'] is None
+    return result_df
+
+
+def test_append_archives_a_batch_once(tmp_path, result_df):
+    archive = PostingArchive(str(tmp_path))
+    assert archive.append(result_df, 'batch-a', EFFECTIVE_DATE)
+    assert archive.contains('batch-a', EFFECTIVE_DATE)
+    assert not archive.append(result_df, 'batch-a', EFFECTIVE_DATE)
+    assert [partition_date for partition_date, _ in archive.partitions()] == [EFFECTIVE_DATE]
+    archived = archive.read()
+    assert len(archived) == len(result_df)
+    assert set(archived['Batch']) == {'batch-a'}
+    assert list(archived['Amount']) == list(result_df['Amount'])
+
+
+def test_duplicates_finds_rows_posted_in_an_earlier_batch(tmp_path, result_df):
+    archive = PostingArchive(str(tmp_path))
+    archive.append(result_df.iloc[:50], 'batch-a', EFFECTIVE_DATE)
+
+    repeated = result_df.iloc[40:50]
+    fresh = result_df.iloc[50:60].copy()
+    fresh['Amount'] = fresh['Amount'] + 100_000_000
+    batch = pd.concat([repeated, fresh])
+
+    duplicates = archive.duplicates(batch, [EFFECTIVE_DATE])
+    assert list(duplicates.index) == list(repeated.index)
+    assert set(duplicates['Batch']) == {'batch-a'}
+    # Another effective date has its own partition, and a batch is not a duplicate of itself
+    assert archive.duplicates(batch, [date(2024, 7, 31)]).empty
+    assert archive.duplicates(repeated, [EFFECTIVE_DATE], exclude_batch='batch-a').empty
+
+
+def test_totals_sum_cents_per_contract_and_type(tmp_path, result_df):
+    archive = PostingArchive(str(tmp_path))
+    archive.append(result_df.iloc[:100], 'batch-a', EFFECTIVE_DATE)
+    archive.append(result_df.iloc[100:], 'batch-b', date(2024, 7, 31))
+
+    totals = archive.totals('contract')
+    expected = result_df.groupby('Contract No')['Amount'].agg(['count', 'sum'])
+    assert list(totals['Contract No']) == list(expected.index)
+    assert list(totals['Transactions']) == list(expected['count'])
+    assert list(totals['Total']) == list(expected['sum'])
+
+    by_type = archive.totals('type', end=EFFECTIVE_DATE)
+    assert by_type['Total'].sum() == result_df['Amount'].iloc[:100].sum()
+    assert by_type['Transactions'].sum() == 100
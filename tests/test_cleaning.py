@@ -0,0 +1,49 @@
+"""clean_series against the per-cell clean_cell_value it vectorises"""
+import random
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+import map_it_core as core
+
+PIECES = [
+    'fee', 'Service Fee', ' ', '  ', '\t', '\n', '\r\n', '\u00a0', '\u200b', '\ufeff', '\u2003',
+    '\x00', '\x07', '\u00e9', 'e\u0301', '\ufb01', '\u2460', '\u00bd', '-', '/', '100001', '2.50',
+]
+
+
+def fuzzed_value(rnd):
+    kind = rnd.random()
+    if kind < 0.6:
+        return ''.join(rnd.choice(PIECES) for _ in range(rnd.randint(0, 6)))
+    return rnd.choice([
+        None, float('nan'), pd.NA, pd.NaT, True, False, 0, 100001, -7, 2.0, 2.5, -0.0, 1e20,
+        np.int64(42), np.float64(3.0), datetime(2024, 6, 1),
+    ])
+
+
+def assert_cleans_like_cells(values):
+    series = pd.Series(values, dtype=object)
+    assert list(core.clean_series(series)) == [core.clean_cell_value(value) for value in values]
+
+
+def test_clean_series_matches_clean_cell_value_on_fuzzed_cells():
+    rnd = random.Random(2)
+    for _ in range(200):
+        assert_cleans_like_cells([fuzzed_value(rnd) for _ in range(rnd.randint(1, 40))])
+
+
+def test_clean_series_matches_clean_cell_value_on_all_ascii_and_all_unicode_columns():
+    assert_cleans_like_cells(['  fee\t2 ', 'a\x00b', '', '100001'])
+    assert_cleans_like_cells(['\u00a0fee\u200b', '\ufeffcaf\u00e9', '\u2003'])
+
+
+def test_clean_series_matches_clean_cell_value_on_numeric_columns():
+    for series in [pd.Series([1.0, np.nan, 2.5, -0.0]), pd.Series([100001, 7]), pd.Series([True, False])]:
+        assert list(core.clean_series(series)) == [core.clean_cell_value(value) for value in series]
+
+
+def test_clean_series_keeps_the_index():
+    series = pd.Series([' a ', None], index=[5, 9], dtype=object)
+    assert list(core.clean_series(series).index) == [5, 9]
@@ -0,0 +1,44 @@
+"""Header row sniffing and column detection"""
+from datetime import date
+
+import pytest
+
+import map_it_core as core
+from workbook_generator import HEADER_VARIANTS, generate_workbook
+
+HEADER = ['Contract No', 'Customer Name', 'EC Number', 'Comment']
+
+
+def test_sniff_header_row_skips_title_rows():
+    rows = [['Transactions report'], [], [None, 'June 2024'], HEADER + ['Branch'], [100001, 'A', 'EC1', 'fee 2']]
+    position, names = core.sniff_header_row(rows)
+    assert position == 3
+    assert names == HEADER + ['Branch']
+
+
+def test_sniff_header_row_defaults_to_the_first_row():
+    assert core.sniff_header_row([['a', 'b'], ['c', 'd']]) == (0, ['a', 'b'])
+
+
+def test_sniff_header_row_names_blank_and_duplicate_headers_like_read_excel():
+    _, names = core.sniff_header_row([HEADER + [None, 'Comment', 'Extra', None]])
+    assert names == HEADER + ['Unnamed: 4', 'Comment.1', 'Extra']
+
+
+def test_find_columns_reports_missing_roles():
+    columns, _, error_msg = core.find_columns(['Contract No', 'Comment'])
+    assert columns == {}
+    assert 'Missing required columns' in error_msg
+
+
+@pytest.mark.parametrize('variant', sorted(HEADER_VARIANTS))
+@pytest.mark.parametrize('title_rows', [0, 3])
+def test_convert_finds_the_header_below_title_rows(tmp_path, variant, title_rows):
+    path = str(tmp_path / 'titled.xlsx')
+    generate_workbook(path, rows=50, header_variant=variant, title_rows=title_rows)
+    result_df, report = core.convert_file(path, date(2024, 6, 30))
+    assert report['error'] is None
+    assert report['header_row'] == title_rows
+    assert report['rows'] == 50
+    assert len(set(report['columns'].values())) == len(core.ROLES)
+    assert len(result_df) >= 50
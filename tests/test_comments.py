@@ -0,0 +1,45 @@
+"""The single-pass comment tokenizer against the regex chain it replaced"""
+import random
+
+import pytest
+
+import map_it_core as core
+from bench_comment_lexer import build_corpus, fuzz_comment
+
+
+@pytest.fixture(scope='module')
+def parser():
+    return core.CommentParser(core.DESCRIPTION_MATCHER)
+
+
+@pytest.mark.parametrize('comment', [
+    'monthly interest 25.97',
+    'Service Fee $1,000.50, receipts 25',
+    'card fee $12, instalment 300.5',
+    'direct-deposit 1,000',
+    '',
+    '   ',
+    'no amount here',
+    '$$ 1,2,3 .5',
+    '\ufeffmonthly\u200b interest\u00a0 25',
+])
+def test_tokenizer_matches_regex_chain(parser, comment):
+    assert parser.parse(comment) == core.process_comment_regex(comment)
+
+
+def test_tokenizer_matches_regex_chain_on_generated_comments(parser):
+    for comment in build_corpus(3000, seed=7):
+        assert parser.parse(comment) == core.process_comment_regex(comment), comment
+
+
+def test_tokenizer_matches_regex_chain_on_fuzzed_comments(parser):
+    rnd = random.Random(12)
+    keys = list(core.DESCRIPTION_MAPPING)
+    for _ in range(3000):
+        comment = fuzz_comment(rnd, keys)
+        assert parser.parse(comment) == core.process_comment_regex(comment), comment
+
+
+def test_process_comment_uses_the_tokenizer():
+    comment = 'monthly interest 25.97, service fee 2'
+    assert core.process_comment(comment) == core.process_comment_regex(comment)
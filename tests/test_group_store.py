@@ -0,0 +1,82 @@
+"""Contract groups reused from the GroupStore and left out of delta exports"""
+from datetime import date
+
+import pytest
+
+import map_it_core as core
+from workbook_generator import generate_workbook
+
+EFFECTIVE_DATE = date(2024, 6, 30)
+
+
+@pytest.fixture
+def workbook(tmp_path):
+    path = str(tmp_path / 'export.xlsx')
+    generate_workbook(path, rows=300)
+    return path
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = core.GroupStore(str(tmp_path / 'groups.sqlite'))
+    yield store
+    store.close()
+
+
+def test_store_reuses_groups_without_changing_the_batch(workbook, store):
+    plain_df, _ = core.convert_file(workbook, EFFECTIVE_DATE)
+    cold_df, cold = core.convert_file(workbook, EFFECTIVE_DATE, store=store)
+    warm_df, warm = core.convert_file(workbook, EFFECTIVE_DATE, store=store)
+    assert cold['incremental']['reused'] == 0
+    assert warm['incremental']['reused'] == warm['incremental']['groups'] == cold['incremental']['groups']
+    assert core.csv_bytes(cold_df) == core.csv_bytes(warm_df) == core.csv_bytes(plain_df)
+
+
+def test_converting_does_not_post_groups(workbook, store):
+    core.convert_file(workbook, EFFECTIVE_DATE, store=store)
+    result_df, report = core.convert_file(workbook, EFFECTIVE_DATE, store=store, delta=True)
+    assert report['incremental']['already_posted'] == 0
+    assert report['transactions'] == len(result_df) > 0
+
+
+def test_delta_leaves_out_posted_groups_for_their_date_only(workbook, store):
+    result_df, report = core.convert_file(workbook, EFFECTIVE_DATE, store=store, delta=True)
+    core.record_posted_groups(store, report, EFFECTIVE_DATE)
+
+    again_df, again = core.convert_file(workbook, EFFECTIVE_DATE, store=store, delta=True)
+    assert again['error'] is None
+    assert again['incremental']['already_posted'] == report['incremental']['groups']
+    assert again['incremental']['skipped_transactions'] == len(result_df)
+    assert len(again_df) == 0
+
+    # Without delta the posted groups are still converted, only counted
+    full_df, full = core.convert_file(workbook, EFFECTIVE_DATE, store=store)
+    assert full['incremental']['already_posted'] == report['incremental']['groups']
+    assert core.csv_bytes(full_df) == core.csv_bytes(result_df)
+
+    other_df, other = core.convert_file(workbook, date(2024, 7, 31), store=store, delta=True)
+    assert other['incremental']['already_posted'] == 0
+    assert len(other_df) == len(result_df)
+
+
+def test_record_posted_groups_keeps_the_first_upload(workbook, store):
+    _, report = core.convert_file(workbook, EFFECTIVE_DATE, store=store)
+    core.record_posted_groups(store, report, EFFECTIVE_DATE)
+    core.record_posted_groups(store, dict(report, digest='later upload'), EFFECTIVE_DATE)
+    fingerprints = report['group_fingerprints']
+    _, posted = store.lookup(fingerprints, 'unused', EFFECTIVE_DATE.isoformat())
+    assert posted == set(fingerprints)
+    uploads = {upload for upload, in store._connection.execute('SELECT DISTINCT upload FROM posted')}
+    assert uploads == {report['digest']}
+
+
+def test_lookup_batches_more_groups_than_one_query_takes(store):
+    fingerprints = [f"{number:032x}" for number in range(core.STORE_LOOKUP_BATCH * 2 + 7)]
+    transactions = [{'description': 'Monthly Interest', 'cents': 2500}]
+    store.record(((fingerprint, transactions) for fingerprint in fingerprints[::2]), 'v1')
+    store.mark_posted(fingerprints[::3], '2024-06-30', 'upload')
+    stored, posted = store.lookup(fingerprints, 'v1', '2024-06-30')
+    assert set(stored) == set(fingerprints[::2])
+    assert stored[fingerprints[0]] == transactions
+    assert posted == set(fingerprints[::3])
+    assert store.lookup(fingerprints, 'v2', '2024-07-31') == ({}, set())
@@ -0,0 +1,141 @@
+"""DescriptionMatcher against the linear scans of the mapping it replaced"""
+import random
+
+import pytest
+
+import map_it_core as core
+from bench_comment_lexer import build_corpus, fuzz_comment
+
+# The app's original if/elif chain from description to transaction type; anything else fell through to GEN
+BASELINE_TYPES = {
+    'Monthly Interest': 'INT',
+    'Reverse Write Off': 'REV_WOFF',
+    'Reverse Complete Write Off': 'REV_COMP_WOFF',
+    'Interest Reversal': 'INT_ADJ_CR',
+    'Receipts': 'REC',
+    'Arrear Interest': 'INT_ARR',
+    'Penalty Interest': 'P_INT',
+    'Direct Deposits': 'DIRECT_DEPOSIT',
+    'Refund': 'REFUND',
+    'Service Fee': 'SERV_FEE',
+    'Card Fee': 'CARD_FEE',
+    'Legal Fees': 'LEG_FEE',
+    'Funeral Fee': 'FUN_FEE',
+    'Arrangement Fee': 'INIT_FEE',
+    'Transfer Fee': 'TRF_FEE',
+    'Early Settlement Fee': 'SET_FEE',
+    'Receipts Reversals': 'REV_REC',
+    'Cash Drawer Receipt Reversal': 'R_CASH_REC',
+    'Reversal Service Fee': 'R_SERV_FEE',
+    'Reversal Card Fee': 'R_CARD_FEE',
+    'Reverse Legal Fees': 'REV_LEG_FEE',
+    'Reverse Funeral Fee': 'REV_FUN_FEE',
+    'Reversal Initiation Fee': 'REV_INI_FEE',
+    'Contract Status - Active': 'STAT_ACTIVE',
+    'Contract Status - Complete': 'STAT_COMPLETE',
+    'Status - Settled': 'STAT_SETT',
+    'Status - Legal': 'STAT_LEGAL',
+    'Status - Cancelled': 'STAT_CANCEL',
+    'Cash Disbursement': 'CASH_DISB',
+    'Cash Receipt': 'CASH_REC',
+    'Bank Deposit': 'BANK_DEP',
+    'Bank Withdrawal': 'BANK_WTHDRW',
+    'Instalment': 'INS',
+    'Write Off': 'WOFF',
+    'Complete Write Off': 'COMP_WOFF',
+    'Small Balance Credit W-Off': 'SB_C_WOFF',
+}
+
+
+def baseline_description(cleaned):
+    """The description the original process_comment found for a cleaned part by scanning the mapping, or None"""
+    for key, value in core.DESCRIPTION_MAPPING.items():
+        if cleaned == core.normalize_column_name(key):
+            return value
+    for key, value in core.DESCRIPTION_MAPPING.items():
+        norm_key = core.normalize_column_name(key)
+        if norm_key in cleaned or cleaned in norm_key:
+            return value
+    # The original went on to any shared word; that tier is now the trigram tier
+    return None
+
+
+def cleaned_parts(comments):
+    """Every comment part as match_part hands it to the matcher"""
+    for comment in comments:
+        for part in core.split_comment(core.normalize_comment(comment)):
+            yield core.normalize_column_name(core.clean_comment(part).lower())
+
+
+def assert_matches_baseline(cleaned):
+    """Whether the matcher agrees with the scan on a part the scan matches; False when the scan finds nothing"""
+    expected = baseline_description(cleaned)
+    if expected is None:
+        return False
+    description = core.DESCRIPTION_MATCHER.match(cleaned)
+    assert description == expected, cleaned
+    assert core.DEFAULT_MAPPING.transaction_type(description) == BASELINE_TYPES.get(expected, 'GEN'), cleaned
+    return True
+
+
+def test_transaction_types_match_the_original_chain():
+    mapping = core.DEFAULT_MAPPING
+    for description in set(core.DESCRIPTION_MAPPING.values()) | set(BASELINE_TYPES):
+        assert mapping.transaction_type(description) == BASELINE_TYPES.get(description, 'GEN'), description
+    assert mapping.transaction_type('Not A Description') == 'GEN'
+
+
+@pytest.mark.parametrize('cleaned', [
+    'monthly interest',
+    'interest',
+    'reverse write off',
+    'write off',
+    'small balance write off adj',
+    'status legal',
+    'card',
+    'manual service fee corr',
+    '',
+])
+def test_matcher_matches_the_mapping_scan(cleaned):
+    assert assert_matches_baseline(cleaned)
+
+
+def test_matcher_matches_the_mapping_scan_on_key_fragments():
+    rnd = random.Random(4)
+    for key in core.DESCRIPTION_MAPPING:
+        norm_key = core.normalize_column_name(key)
+        assert assert_matches_baseline(norm_key)
+        assert assert_matches_baseline(f"{rnd.choice(['adj', 'rev', 'per branch'])} {norm_key} {rnd.choice(['x', 'corr'])}")
+        for _ in range(20):
+            start = rnd.randrange(len(norm_key))
+            assert_matches_baseline(norm_key[start:rnd.randint(start, len(norm_key))])
+
+
+def test_matcher_matches_the_mapping_scan_on_generated_comments():
+    rnd = random.Random(9)
+    keys = list(core.DESCRIPTION_MAPPING)
+    comments = build_corpus(2000, seed=3) + [fuzz_comment(rnd, keys) for _ in range(2000)]
+    matched = sum(assert_matches_baseline(cleaned) for cleaned in cleaned_parts(comments))
+    assert matched > 2000
+
+
+def test_fuzzy_tier_matches_misspelt_descriptions():
+    matcher = core.DESCRIPTION_MATCHER
+    assert matcher.match('servise fee') == 'Service Fee'
+    assert matcher.match('monthly intrest') == 'Monthly Interest'
+
+
+@pytest.mark.parametrize('cleaned', ['xyzzy quux', 'rental', 'zzz'])
+def test_fuzzy_tier_leaves_unrelated_fragments_unmatched(cleaned):
+    assert core.DESCRIPTION_MATCHER.match(cleaned) is None
+
+
+def test_fuzzy_threshold_is_the_cutoff():
+    rank, score = core.DESCRIPTION_MATCHER.fuzzy_rank('servise fee')
+    assert core.DESCRIPTION_MATCHER.descriptions[rank] == 'Service Fee'
+    assert core.DescriptionMatcher(core.DESCRIPTION_MAPPING, fuzzy_threshold=score).match('servise fee') == 'Service Fee'
+    stricter = core.DescriptionMatcher(core.DESCRIPTION_MAPPING, fuzzy_threshold=score + 0.01)
+    assert stricter.match('servise fee') is None
+    # The cutoff only applies to the fuzzy tier
+    assert stricter.match('service fee') == 'Service Fee'
+    assert stricter.match('manual service fee corr') == 'Service Fee'
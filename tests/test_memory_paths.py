@@ -0,0 +1,71 @@
+"""The in-memory and row-by-row conversion paths produce the same batch"""
+from datetime import date
+
+import openpyxl
+import pytest
+
+import map_it_core as core
+from workbook_generator import generate_workbook
+
+EFFECTIVE_DATE = date(2024, 6, 30)
+
+
+def convert_both_ways(path, monkeypatch):
+    """(in-memory, low-memory) convert_file results, the path forced through MEMORY_BUDGET_MB"""
+    with open(path, 'rb') as handle:
+        estimate = core.estimate_memory(handle)
+    # Fits the row-by-row estimate but not the in-memory one
+    monkeypatch.setattr(core, 'MEMORY_BUDGET_MB', estimate['in_memory_bytes'] // 2**20)
+    assert estimate['low_memory_bytes'] <= core.MEMORY_BUDGET_MB * 2**20
+    low_memory = core.convert_file(path, EFFECTIVE_DATE)
+    monkeypatch.setattr(core, 'MEMORY_BUDGET_MB', 0)
+    in_memory = core.convert_file(path, EFFECTIVE_DATE)
+    assert in_memory[1]['memory_plan']['path'] == 'in_memory'
+    assert low_memory[1]['memory_plan']['path'] == 'low_memory'
+    return in_memory, low_memory
+
+
+@pytest.mark.parametrize('options', [
+    {'rows': 2000},
+    {'rows': 2000, 'edge_cases': True, 'extra_columns': 3},
+    {'rows': 1000, 'edge_cases': True, 'title_rows': 3, 'header_variant': 'messy'},
+])
+def test_paths_write_identical_csvs(tmp_path, monkeypatch, options):
+    path = str(tmp_path / 'export.xlsx')
+    generate_workbook(path, **options)
+    (in_df, in_report), (low_df, low_report) = convert_both_ways(path, monkeypatch)
+    assert in_report['error'] is None and low_report['error'] is None
+    assert core.csv_bytes(low_df) == core.csv_bytes(in_df)
+    assert low_report['rows'] == in_report['rows'] == options['rows']
+
+
+def test_paths_coerce_cells_like_read_excel(tmp_path, monkeypatch):
+    book = openpyxl.Workbook()
+    sheet = book.active
+    sheet.append(['Contract No', 'Customer Name', 'EC Number', 'Comment'])
+    sheet.append(['001002', 'Ann', True, 'monthly interest 5'])
+    sheet.append([1003.0, 1234, 7, 'service fee 2'])
+    sheet.append([])
+    path = str(tmp_path / 'coerced.xlsx')
+    book.save(path)
+    (in_df, _), (low_df, _) = convert_both_ways(path, monkeypatch)
+    assert core.csv_bytes(low_df) == core.csv_bytes(in_df)
+    # read_excel reads the whole contract and employee columns as numbers
+    assert list(low_df['Contract No'].unique()) == ['1002', '1003']
+
+
+def test_paths_report_the_same_validation_errors(tmp_path, monkeypatch):
+    book = openpyxl.Workbook()
+    sheet = book.active
+    sheet.append(['Report title'])
+    sheet.append(['Contract No', 'Customer Name', 'EC Number', 'Comment'])
+    sheet.append([1001, '#N/A', 5, 'receipts 3'])
+    sheet.append([])
+    sheet.append([None, None, None, None, 'only an unmapped cell'])
+    sheet.append([1002, 'NA', 6, 'receipts 4'])
+    path = str(tmp_path / 'invalid.xlsx')
+    book.save(path)
+    (in_df, in_report), (low_df, low_report) = convert_both_ways(path, monkeypatch)
+    assert in_df is None and low_df is None
+    assert low_report['error'] == in_report['error']
+    assert low_report['validation'] == in_report['validation']
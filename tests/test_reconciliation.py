@@ -0,0 +1,60 @@
+"""Batch totals and control-total checks in the conversion report"""
+from datetime import date
+
+import openpyxl
+import pytest
+
+import map_it_core as core
+
+EFFECTIVE_DATE = date(2024, 6, 30)
+
+
+@pytest.fixture
+def control_workbook(tmp_path):
+    book = openpyxl.Workbook()
+    sheet = book.active
+    sheet.append(['Contract No', 'Customer Name', 'EC Number', 'Comment', 'Control Total'])
+    sheet.append([1001, 'Ann', 5, 'monthly interest 5, service fee 2', 7])
+    sheet.append([1002, 'Bob', 6, 'service fee 4', '4.00'])
+    # Converts to 10 against a control total of 9
+    sheet.append([1003, 'Cy', 7, 'receipts 10', 9])
+    sheet.append([1004, 'Di', 8, 'receipts 1', None])
+    path = str(tmp_path / 'control.xlsx')
+    book.save(path)
+    return path
+
+
+def test_reconciliation_totals_each_contract_and_type(control_workbook):
+    result_df, report = core.convert_file(control_workbook, EFFECTIVE_DATE)
+    assert report['error'] is None
+    reconciliation = report['reconciliation']
+    assert reconciliation['transactions'] == len(result_df) == 5
+    assert reconciliation['total_cents'] == result_df['Amount'].sum() == 2200
+    assert reconciliation['by_type'] == {'INT': [1, 500], 'SERV_FEE': [2, 600], 'REC': [2, 1100]}
+    # Contracts given a control total carry it as a third item
+    assert reconciliation['by_contract'] == {
+        '1001': [2, 700, 700],
+        '1002': [1, 400, 400],
+        '1003': [1, 1000, 900],
+        '1004': [1, 100],
+    }
+
+
+def test_reconciliation_flags_control_total_mismatches(control_workbook, tmp_path):
+    _, report = core.convert_file(control_workbook, EFFECTIVE_DATE)
+    assert report['reconciliation']['control'] == {'column': 'Control Total', 'checked': 3, 'mismatched': ['1003']}
+
+    _, stream_report = core.convert_file_streaming(control_workbook, EFFECTIVE_DATE, str(tmp_path / 'control.csv'))
+    assert stream_report['reconciliation'] == report['reconciliation']
+
+
+def test_reconciliation_without_a_control_column(tmp_path):
+    book = openpyxl.Workbook()
+    sheet = book.active
+    sheet.append(['Contract No', 'Customer Name', 'EC Number', 'Comment'])
+    sheet.append([1001, 'Ann', 5, 'receipts 3'])
+    path = str(tmp_path / 'plain.xlsx')
+    book.save(path)
+    _, report = core.convert_file(path, EFFECTIVE_DATE)
+    assert report['reconciliation']['control'] is None
+    assert report['reconciliation']['by_contract'] == {'1001': [1, 300]}
@@ -0,0 +1,120 @@
+"""The HTTP conversion service's /convert endpoint"""
+import http.client
+import json
+import threading
+import time
+from datetime import date
+
+import openpyxl
+import pytest
+
+import map_it_core as core
+import map_it_service as service_module
+from workbook_generator import generate_workbook
+
+EFFECTIVE_DATE = date(2024, 6, 30)
+
+
+def serve(service):
+    """A running server for service and its port"""
+    server = service_module.make_server(service, port=0, quiet=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, server.server_address[1]
+
+
+@pytest.fixture(scope='module')
+def port(tmp_path_factory):
+    service = service_module.ConversionService(workers=1, spool_dir=str(tmp_path_factory.mktemp('spool')))
+    server, port = serve(service)
+    yield port
+    server.shutdown()
+    server.server_close()
+    service.close()
+
+
+def post(port, data, query=f'effective_date={EFFECTIVE_DATE.isoformat()}&name=june.xlsx'):
+    """(status, headers, body) of POSTing data to /convert"""
+    connection = http.client.HTTPConnection('127.0.0.1', port, timeout=120)
+    try:
+        connection.request('POST', f'/convert?{query}', body=data)
+        response = connection.getresponse()
+        return response.status, dict(response.getheaders()), response.read()
+    finally:
+        connection.close()
+
+
+def workbook_bytes(path):
+    with open(path, 'rb') as handle:
+        return handle.read()
+
+
+def test_convert_streams_the_csv(tmp_path, port):
+    path = str(tmp_path / 'june.xlsx')
+    generate_workbook(path, rows=300, seed=3)
+    result_df, report = core.convert_file(path, EFFECTIVE_DATE)
+
+    status, headers, body = post(port, workbook_bytes(path))
+    assert status == 200
+    assert body == core.csv_bytes(result_df)
+    assert headers['Content-Disposition'] == 'attachment; filename="june_converted.csv"'
+    assert headers['X-Map-It-Rows'] == str(report['rows'])
+    assert headers['X-Map-It-Transactions'] == str(report['transactions'])
+
+
+def test_convert_lists_every_validation_error(tmp_path, port):
+    book = openpyxl.Workbook()
+    sheet = book.active
+    sheet.append(['Contract No', 'Customer Name', 'EC Number', 'Comment'])
+    sheet.append([1001, 'Ann', 5, 'receipts 3'])
+    sheet.append([1002, None, 6, 'receipts 4'])
+    sheet.append([1003, 'Bob', None, None])
+    path = str(tmp_path / 'invalid.xlsx')
+    book.save(path)
+
+    status, _, body = post(port, workbook_bytes(path))
+    assert status == 422
+    payload = json.loads(body)
+    assert payload['error'] == payload['report']['error']
+    assert [(error['Row'], error['Rule']) for error in payload['report']['validation_errors']] == [
+        (2, "Missing or empty payee name"),
+        (3, "Missing or empty employee/EC number"),
+        (3, "Missing or empty comment"),
+    ]
+
+
+def test_convert_requires_an_effective_date(port):
+    status, _, body = post(port, b'PK', query='name=june.xlsx')
+    assert status == 400
+    assert 'effective_date' in json.loads(body)['error']
+
+
+def test_convert_refuses_uploads_over_the_size_limit(port, monkeypatch):
+    monkeypatch.setattr(service_module.ServiceHandler, 'max_upload_bytes', 1024)
+    status, _, body = post(port, b'x' * 2048)
+    assert status == 413
+    assert 'not accepted' in json.loads(body)['error']
+
+
+def test_convert_stops_at_the_deadline(tmp_path):
+    path = str(tmp_path / 'june.xlsx')
+    generate_workbook(path, rows=300, seed=3)
+    service = service_module.ConversionService(workers=1, timeout=0.0, spool_dir=str(tmp_path))
+    server, port = serve(service)
+    try:
+        status, _, body = post(port, workbook_bytes(path))
+    finally:
+        server.shutdown()
+        server.server_close()
+        service.close()
+    assert status == 504
+    assert 'timeout' in json.loads(body)['error']
+
+
+def test_convert_request_reports_a_passed_deadline(tmp_path):
+    path = str(tmp_path / 'june.xlsx')
+    generate_workbook(path, rows=50, seed=3)
+    csv_path, report = service_module.convert_request(workbook_bytes(path), 'june.xlsx', EFFECTIVE_DATE, None,
+                                                      False, time.time() - 1, str(tmp_path))
+    assert csv_path is None
+    assert report['timed_out']
+    assert not list(tmp_path.glob('*.csv'))
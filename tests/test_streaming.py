@@ -0,0 +1,61 @@
+"""convert_file_streaming writes the CSV convert_file writes"""
+from datetime import date
+
+import openpyxl
+import pytest
+
+import map_it_core as core
+from workbook_generator import generate_workbook
+
+EFFECTIVE_DATE = date(2024, 6, 30)
+
+
+def convert_both_ways(path, tmp_path, chunk_size):
+    """(convert_file CSV bytes, streamed CSV bytes, streamed RunStats) for the workbook at path"""
+    result_df, report = core.convert_file(path, EFFECTIVE_DATE)
+    assert report['error'] is None
+    stats = core.RunStats()
+    output_path, stream_report = core.convert_file_streaming(path, EFFECTIVE_DATE, str(tmp_path / 'streamed.csv'),
+                                                             chunk_size=chunk_size, stats=stats)
+    assert stream_report['error'] is None
+    assert stream_report['rows'] == report['rows']
+    with open(output_path, 'rb') as handle:
+        return core.csv_bytes(result_df), handle.read(), stats
+
+
+@pytest.mark.parametrize('chunk_size', [5000, 300])
+@pytest.mark.parametrize('options', [
+    {'rows': 2000, 'edge_cases': True, 'seed': 4},
+    {'rows': 2000, 'edge_cases': True, 'seed': 1, 'extra_columns': 2},
+    {'rows': 1000, 'edge_cases': True, 'seed': 7, 'title_rows': 3, 'header_variant': 'messy'},
+])
+def test_streaming_writes_the_convert_file_csv(tmp_path, options, chunk_size):
+    path = str(tmp_path / 'export.xlsx')
+    generate_workbook(path, **options)
+    expected, streamed, _ = convert_both_ways(path, tmp_path, chunk_size)
+    assert streamed == expected
+
+
+def test_streaming_rereads_a_column_typed_unlike_its_other_chunks(tmp_path):
+    book = openpyxl.Workbook()
+    sheet = book.active
+    sheet.append(['Contract No', 'Customer Name', 'EC Number', 'Comment'])
+    for number in range(40):
+        contract = 100000 + number // 2
+        sheet.append([f'{contract:09d}' if number % 3 else contract, 'Ann', 7, 'monthly interest 5'])
+    # Only this last chunk keeps the earlier chunks' zero-padded contract numbers as text
+    sheet.append(['ABC', 'Bob', 8, 'service fee 2'])
+    path = str(tmp_path / 'mixed.xlsx')
+    book.save(path)
+    expected, streamed, stats = convert_both_ways(path, tmp_path, chunk_size=10)
+    assert streamed == expected
+    assert b'000100001' in streamed
+    assert stats.counters['stream_rereads'] == 1
+
+
+def test_streaming_reads_uniformly_typed_chunks_once(tmp_path):
+    path = str(tmp_path / 'export.xlsx')
+    generate_workbook(path, rows=500)
+    expected, streamed, stats = convert_both_ways(path, tmp_path, chunk_size=50)
+    assert streamed == expected
+    assert 'stream_rereads' not in stats.counters